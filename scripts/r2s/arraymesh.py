@@ -0,0 +1,455 @@
+"""Module defines ArrayScdMesh, a structured mesh held in NumPy arrays.
+
+An ArrayScdMesh has the public interface of ScdMesh (dims, getDivisions,
+iterateHex, getHex, getTagArray, the imesh and scdset attributes, fromFile,
+...), so code written for ScdMesh runs on either.  Instead of iMesh
+entities, the hexahedra and vertices of an ArrayScdMesh are identified by
+their integer positions in the canonical (zyx) order of the mesh, and each
+tag stores its values for all hexes in one array.
+
+Tags may be set on hexes, on the root set (imesh.rootSet) and on the
+structured mesh set (scdset); vertex tags are not supported.  MOAB .h5m files
+are only read and written at the edges, by fromFile() and save().  With h5py,
+fromFile() reads just the mesh geometry and the tags asked for; the values of
+other tags are read from the file as they are needed (see r2s.h5mfile), so
+that e.g. ScdMesh.iterateSlabs() reads one slab of values at a time.  save()
+then writes the changed tags back into a copy of the file.  Without h5py,
+these methods need PyTAPS.  Everything else works without either.
+"""
+
+import copy
+import os
+import shutil
+
+import numpy as np
+
+from r2s.scdmesh import ScdMesh, ScdMeshError, TagNotFoundError, \
+        TagAlreadyExistsError
+from r2s.h5mfile import H5mFile, H5mFileError, tag_data
+
+
+class ArrayTag(object):
+    """A tag of an ArrayScdMesh, mimicking an iMesh.Tag
+
+    Values are got and set by indexing the tag with a hex handle, a sequence
+    of hex handles, or an entity set of the mesh.  Getting a value that has
+    not been set raises TagNotFoundError.  The modified flag notes whether
+    values have been set since the tag was read from a file.
+
+    A tag whose source is an H5mFile holds only its values on entity sets;
+    its values on hexes are read from the file when they are got for a
+    sequence of hexes, and only for those hexes.  Setting values, or getting
+    the value of a single hex, reads the values of all hexes into memory
+    first (see load()).
+    """
+
+    def __init__(self, name, size, dtype, num_hexes, source=None):
+        self.name = name
+        self.sizeValues = size
+        self.type = dtype
+        self.source = source
+        if source is None:
+            shape = (num_hexes,) if size == 1 else (num_hexes, size)
+            self.data = np.zeros(shape, dtype=dtype)
+            self.isset = np.zeros(num_hexes, dtype=bool)
+        else:
+            self.data = self.isset = None
+        self.setdata = {}
+        self.modified = source is None
+
+    def load(self):
+        """Read the tag's values on hexes from its source file into memory"""
+        if self.source is not None:
+            data = self.source.read_tag(self.name)
+            self.data, self.isset = data.hexes, data.isset
+            self.source = None
+
+    def __getitem__(self, key):
+        if isinstance(key, ArraySet):
+            try:
+                return self.setdata[key]
+            except KeyError:
+                raise TagNotFoundError(self.name)
+        key = _handles(key)
+        if self.source is not None:
+            if np.ndim(key) == 0:
+                self.load()
+            else:
+                data = self.source.read_tag(self.name, key)
+                if not data.isset.all():
+                    raise TagNotFoundError(self.name)
+                return data.hexes
+        if not self.isset[key].all():
+            raise TagNotFoundError(self.name)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.modified = True
+        if isinstance(key, ArraySet):
+            value = np.asarray(value, dtype=self.type)
+            if value.size != self.sizeValues:
+                raise ScdMeshError('Tag {0} takes {1} value(s), not ' \
+                        '{2}'.format(self.name, self.sizeValues, value.size))
+            self.setdata[key] = value if self.sizeValues > 1 \
+                    else value.ravel()[0]
+            return
+        self.load()
+        key = _handles(key)
+        self.data[key] = value
+        self.isset[key] = True
+
+    def __delitem__(self, key):
+        self.modified = True
+        if isinstance(key, ArraySet):
+            del self.setdata[key]
+        else:
+            self.load()
+            self.isset[_handles(key)] = False
+
+
+class ArraySet(object):
+    """An entity set of an ArrayScdMesh: its root set or its scdset"""
+
+    def __init__(self, mesh, name):
+        self.mesh = mesh
+        self.name = name
+
+    def save(self, filename):
+        """Save the mesh to a MOAB file; see ArrayScdMesh.save()"""
+        self.mesh.save(filename)
+
+    def __repr__(self):
+        return '<ArraySet {0}>'.format(self.name)
+
+
+class ArrayTags(object):
+    """The tags of an ArrayScdMesh, mimicking the tag methods of iMesh.Mesh
+
+    If source is an H5mFile, the tags in it are looked up as tags whose
+    values are read from the file as they are needed (see ArrayTag).  The
+    names of tags destroyed since are kept in destroyed, so that they are
+    not looked up in the file again.
+    """
+
+    def __init__(self, mesh, source=None):
+        self.mesh = mesh
+        self.rootSet = ArraySet(mesh, 'root')
+        self.tags = {}
+        self.source = source
+        self.writable = False
+        self.destroyed = set()
+
+    def createTag(self, name, size, tag_type):
+        """Create a tag of size values of type int or float"""
+        if name in self.tags or self._inSource(name):
+            raise TagAlreadyExistsError(name)
+        tag = ArrayTag(name, size, _tag_dtype(tag_type),
+                       len(self.mesh._hexArray()))
+        self.tags[name] = tag
+        return tag
+
+    def getTagHandle(self, name):
+        if name not in self.tags and self._inSource(name):
+            self._open(name)
+        try:
+            return self.tags[name]
+        except KeyError:
+            raise TagNotFoundError(name)
+
+    def destroyTag(self, tag, force=False):
+        del self.tags[tag.name]
+        if self.source is not None:
+            self.destroyed.add(tag.name)
+
+    def load(self, name):
+        """Read tag name, with its values on all hexes, into memory"""
+        tag = self.getTagHandle(name)
+        tag.load()
+        return tag
+
+    def _open(self, name):
+        """Look up tag name in the source file, reading only its set values"""
+        data = self.source.read_tag(name, [])
+        tag = ArrayTag(name, data.size, data.type, 0, self.source)
+        for eset, value in ((self.rootSet, data.root),
+                            (self.mesh.scdset, data.scdset)):
+            if value is not None:
+                tag[eset] = value
+        tag.modified = False
+        self.tags[name] = tag
+        return tag
+
+    def _inSource(self, name):
+        """Return whether tag name is still to be looked up in the source"""
+        return self.source is not None and name not in self.destroyed and \
+                name in self.source
+
+    def getAllTags(self, entity):
+        """Return the tags set on a hex or entity set"""
+        if self.source is not None:
+            for name in self.source.tag_names():
+                if name in self.tags or name in self.destroyed or \
+                        name == 'BOX_DIMS':
+                    continue
+                try:
+                    self._open(name)
+                except H5mFileError:
+                    pass # tags not of integers or floats are left out
+        if isinstance(entity, ArraySet):
+            return [tag for tag in self.tags.itervalues()
+                    if entity in tag.setdata]
+        tags = []
+        for tag in self.tags.itervalues():
+            try:
+                tag[[entity]]
+            except TagNotFoundError:
+                continue
+            tags.append(tag)
+        return tags
+
+    def save(self, filename):
+        """Save the mesh to a MOAB file; see ArrayScdMesh.save()"""
+        self.mesh.save(filename)
+
+
+class ArrayScdMesh(ScdMesh):
+    """A structured mesh whose geometry and tags are held in NumPy arrays.
+
+    Public member variables::
+
+        self.imesh -- an ArrayTags object holding the mesh's tags, with the
+                      tag methods of iMesh.Mesh
+        self.scdset -- the ArraySet of this structured mesh
+        self.dims -- A namedtuple indicating the minimum and maximum
+                     (i,j,k) coordinates of this structured mesh.
+    """
+
+    def __init__(self, x_points, y_points, z_points, mins=(0, 0, 0)):
+        """Construct an ArrayScdMesh from given x, y, and z coordinates.
+
+        Parameters
+        ----------
+        x_points, y_points, z_points : list of floats
+            List of points.
+        mins : tuple of 3 ints, optional
+            The smallest i, j and k coordinates; by default the extents of
+            the structured mesh are numbered from 0.
+        """
+        self._divs = {}
+        for dim, points in zip('xyz', (x_points, y_points, z_points)):
+            divs = np.array(points, dtype=float)
+            divs.flags.writeable = False
+            self._divs[dim] = divs
+        self.dims = ScdMesh.extents_tuple(*(list(mins) +
+                [m + len(self._divs[d]) - 1 for m, d in zip(mins, 'xyz')]))
+        vdims_incr = list(self.dims[0:3]) + [x + 1 for x in self.dims[3:6]]
+        self.vdims = ScdMesh.extents_tuple(*vdims_incr)
+        self._hexes = np.arange(np.prod(self._orderShape('xyz')))
+        self._vtxs = np.arange(np.prod([len(self._divs[d]) for d in 'xyz']))
+        self._volumes = None
+        self.imesh = ArrayTags(self)
+        self.scdset = ArraySet(self, 'scdset')
+
+    @classmethod
+    def fromScdMesh(cls, sm):
+        """Return an ArrayScdMesh with the geometry and tags of a ScdMesh
+
+        Hex tags of integer or float values are copied, as are such tags on
+        the mesh's root set and structured mesh set (except BOX_DIMS).
+        """
+        mesh = cls(*[sm.getDivisionArray(d) for d in 'xyz'],
+                   mins=sm.dims[0:3])
+        hexes = sm.iterateHex()
+        tags = sm.imesh.getAllTags(hexes[0])
+        for tag in tags:
+            tag_type = _tag_dtype(tag.type, None)
+            if tag_type is None:
+                continue
+            newtag = mesh.imesh.createTag(tag.name, tag.sizeValues, tag_type)
+            try:
+                newtag[mesh._hexes] = tag[hexes]
+            except TagNotFoundError:
+                # Not every hex has the tag; copy the hexes that do
+                for n, hx in enumerate(hexes):
+                    try:
+                        newtag[n] = tag[hx]
+                    except TagNotFoundError:
+                        pass
+
+        for eset, newset in ((sm.imesh.rootSet, mesh.imesh.rootSet),
+                             (sm.scdset, mesh.scdset)):
+            for tag in sm.imesh.getAllTags(eset):
+                tag_type = _tag_dtype(tag.type, None)
+                if tag_type is None or tag.name == 'BOX_DIMS':
+                    continue
+                try:
+                    newtag = mesh.imesh.getTagHandle(tag.name)
+                except TagNotFoundError:
+                    newtag = mesh.imesh.createTag(tag.name, tag.sizeValues,
+                                                  tag_type)
+                newtag[newset] = tag[eset]
+        return mesh
+
+    @classmethod
+    def fromFile(cls, filename, imesh=None, tags=None, writable=False):
+        """Load structured meshes from a MOAB file
+
+        Returns one mesh if the file contains one structured mesh, or a list
+        if it contains several.
+
+        If h5py is available and the file holds one structured mesh, only the
+        mesh geometry and the given tags are read; the values of other tags
+        are read from the file as they are needed.  Otherwise the whole file
+        is loaded with PyTAPS.
+
+        Parameters
+        ----------
+        filename : string
+            Path of the file, e.g. an .h5m file.
+        imesh : iMesh.Mesh object, optional
+            iMesh instance into which to load the file with PyTAPS.
+        tags : list of strings, optional
+            Names of the tags to read into memory at once.  When the file is
+            loaded with PyTAPS, every tag holding integer or float values on
+            the mesh is read.
+        writable : boolean, optional
+            If True, values set on the hexes of slabs of the mesh (see
+            ScdMesh.iterateSlabs()) for tags not read into memory are
+            written straight into the file, rather than being held in memory
+            until the mesh is saved.  Only has an effect when h5py is used.
+        """
+        if imesh is None:
+            try:
+                source = H5mFile(filename)
+            except H5mFileError:
+                source = None
+            if source is not None:
+                mesh = cls(*source.divisions, mins=source.dims[0:3])
+                mesh.imesh.source = source
+                mesh.imesh.writable = writable
+                for name in tags or []:
+                    mesh.imesh.load(name)
+                return mesh
+
+        meshes = ScdMesh.fromFile(filename, imesh)
+        if isinstance(meshes, list):
+            return [cls.fromScdMesh(sm) for sm in meshes]
+        return cls.fromScdMesh(meshes)
+
+    def toScdMesh(self, imesh=None):
+        """Return a ScdMesh with the geometry and tags of this mesh
+
+        Needs PyTAPS.
+
+        Parameters
+        ----------
+        imesh : iMesh.Mesh object, optional
+            iMesh instance in which to create the mesh.
+        """
+        sm = ScdMesh(*[self.getDivisionArray(d) for d in 'xyz'], imesh=imesh)
+        hexes = sm.iterateHex()
+        sets = {self.imesh.rootSet: sm.imesh.rootSet, self.scdset: sm.scdset}
+        for tag in self.imesh.tags.itervalues():
+            if tag.name == 'BOX_DIMS':
+                continue
+            tag.load()
+            tag_type = int if np.issubdtype(tag.type, np.integer) else float
+            try:
+                newtag = sm.imesh.createTag(tag.name, tag.sizeValues, tag_type)
+            except TagAlreadyExistsError:
+                newtag = sm.imesh.getTagHandle(tag.name)
+            if tag.isset.any():
+                newtag[hexes[tag.isset]] = tag.data[tag.isset]
+            for eset, value in tag.setdata.iteritems():
+                newtag[sets[eset]] = value
+        return sm
+
+    def save(self, filename):
+        """Save the mesh and its tags to a MOAB file, e.g. an .h5m file
+
+        A mesh read from an .h5m file with h5py is saved by copying that file
+        (unless saving over it) and writing into the copy the tags that have
+        been changed or destroyed; other tags are kept as they are in the
+        file.  Any other mesh is saved with PyTAPS.
+        """
+        source = self.imesh.source
+        if source is None:
+            self.toScdMesh().imesh.save(filename)
+            return
+
+        inplace = os.path.exists(filename) and \
+                os.path.samefile(filename, source.filename)
+        if inplace:
+            target = source
+        else:
+            shutil.copyfile(source.filename, filename)
+            target = copy.copy(source)
+            target.filename = filename
+
+        for name in self.imesh.destroyed.difference(self.imesh.tags):
+            target.delete_tag(name)
+        for tag in self.imesh.tags.itervalues():
+            if tag.modified:
+                tag.load()
+                target.write_tag(tag.name, tag_data(tag.type, tag.sizeValues,
+                        tag.data, tag.isset,
+                        tag.setdata.get(self.imesh.rootSet),
+                        tag.setdata.get(self.scdset)))
+                if inplace:
+                    tag.modified = False
+        if inplace:
+            self.imesh.destroyed.clear()
+
+    def _setHexValues(self, name, hexes, values):
+        """Set the values of tag name on some hexes
+
+        For a writable mesh read from a file, values of tags not read into
+        memory are written into the file.
+        """
+        imesh = self.imesh
+        if imesh.source is not None and imesh.writable:
+            try:
+                tag = imesh.getTagHandle(name)
+            except TagNotFoundError:
+                tag = None
+            if tag is None or tag.source is not None:
+                if name in imesh.destroyed:
+                    imesh.source.delete_tag(name)
+                    imesh.destroyed.discard(name)
+                try:
+                    imesh.source.write_values(name, hexes, values)
+                except H5mFileError:
+                    pass # the tag is not on every hex; set it in memory
+                else:
+                    if tag is None:
+                        imesh._open(name)
+                    return
+        ScdMesh._setHexValues(self, name, hexes, values)
+
+    def _hexArray(self):
+        """Return an array of the mesh's hexahedra, in canonical order"""
+        return self._hexes
+
+    def _vtxArray(self):
+        """Return an array of the mesh's vertices, in canonical order"""
+        return self._vtxs
+
+
+def _handles(key):
+    """Return a hex handle, or an array of hex handles, for indexing"""
+    if np.isscalar(key):
+        return key
+    return np.asarray(key, dtype=int)
+
+
+def _tag_dtype(tag_type, default=float):
+    """Return the NumPy type for a tag type given as for iMesh.createTag"""
+    if tag_type in (int, 'i') or (isinstance(tag_type, type) and
+                                  issubclass(tag_type, np.integer)):
+        return np.int64
+    if tag_type in (float, 'd') or (isinstance(tag_type, type) and
+                                    issubclass(tag_type, np.floating)):
+        return np.float64
+    if default is None:
+        return None
+    raise ScdMeshError('Unsupported tag type: {0}'.format(tag_type))
@@ -0,0 +1,1200 @@
+"""Module reads MCNP meshtal files into NumPy arrays.
+
+This module depends only on NumPy, and not on MOAB/PyTAPS; tagging meshtal
+results onto structured meshes is done by r2s.data_transfer.read_meshtal.
+
+The results of each tally are held in an array of shape
+(e_bins, spatial_points, 2): the result and relative error of each voxel for
+each energy group, with voxels in 'xyz' order (the order in which MCNP writes
+them: z changing fastest, x least fast).  For a tally with more than one
+energy bin, the last group is the totals group.  read_tally_arrays() returns
+the same results as arrays indexed [group, i, j, k].
+"""
+
+from collections import namedtuple
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+from r2s.fileio import open_file, is_compressed
+
+
+class MeshtalError(Exception):
+    pass
+
+
+# Number of lines after a 'Mesh Tally Number' line within which the rest of
+# the tally header is expected to be found.
+_HEADER_LINES = 100
+
+# Version of the tally index format written to sidecar files; indices with
+# a different version are rebuilt.
+_INDEX_VERSION = 1
+
+# Version of the tally cache file format; it is part of each cache key.
+_CACHE_VERSION = 1
+
+# Default size limit of the tally cache, in megabytes.
+_CACHE_SIZE_MB = 2048
+
+################################################################################
+
+class MeshtalTally(object):
+    """Header information and results for one tally of an MCNP meshtal file
+
+    Public member variables::
+
+        self.number -- the tally number, as a string
+        self.particle -- tally type; either neutron ('n') or photon ('p')
+        self.x_bounds, self.y_bounds, self.z_bounds -- lists of floats
+                     giving the mesh boundaries along each dimension
+        self.e_bounds -- list of floats giving the energy bin boundaries
+        self.columns -- number of columns in each line of tally data
+        self.data -- array of shape (e_bins, spatial_points, 2) holding the
+                     result and relative error of each voxel, with voxels
+                     in 'xyz' order (z changing fastest)
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.particle = None
+        self.x_bounds = None
+        self.y_bounds = None
+        self.z_bounds = None
+        self.e_bounds = None
+        self.columns = None
+        self.data = None
+
+    @property
+    def fluxes(self):
+        """View of the results in self.data, shaped (e_bins, spatial_points)"""
+        return self.data[:, :, 0]
+
+    @property
+    def errors(self):
+        """View of the relative errors in self.data"""
+        return self.data[:, :, 1]
+
+    @property
+    def dims(self):
+        """Number of voxels along the x, y and z dimensions"""
+        return tuple(len(b) - 1 for b in (self.x_bounds, self.y_bounds,
+                                         self.z_bounds))
+
+    @property
+    def spatial_points(self):
+        """Number of meshtally points (aka voxels)"""
+        return (len(self.x_bounds) - 1) * (len(self.y_bounds) - 1) * \
+               (len(self.z_bounds) - 1)
+
+    @property
+    def e_bins(self):
+        """Number of energy groups in the tally, including the totals group
+
+        For 1 energy bin, the meshtal does not have a TOTALS group.
+        """
+        if len(self.e_bounds) > 2:
+            return len(self.e_bounds) #don't substract 1; cancels with totals bin
+        else:
+            return 1
+
+################################################################################
+
+def find_tallies(meshtal) :
+    """Searches the meshtal file to determine the number of tallies present and
+    returns the tallies and lines where they are listed.
+    
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+
+    Returns
+    -------
+    tally_numbers : list of strings
+        List of tally numbers (as strings)
+    tally_lines : list of integers
+        List of the line numbers where tallies begin
+
+    Notes
+    -----
+    The tallies are found from the meshtal's tally index; see load_index().
+    """
+    index = load_index(meshtal)
+    tally_numbers = [entry['number'] for entry in index]
+    tally_lines = [entry['line'] for entry in index]
+    return tally_numbers, tally_lines
+
+
+def read_histories(meshtal):
+    """Return the number of histories a meshtal file's tallies are
+    normalized by
+
+    This is given on the 'Number of histories used for normalizing tallies'
+    line, before the first tally.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+
+    Returns
+    -------
+    histories : float
+    """
+    with open_file(meshtal) as f:
+        for line in itertools.islice(f, _HEADER_LINES):
+            if line.find('Number of histories') != -1:
+                return float(line.split('=')[1])
+            if line.find('Mesh Tally Number') != -1:
+                break
+    raise MeshtalError('Number of histories not found in ' + meshtal)
+
+###############################################################################
+
+def read_tally_header(lines, tally_number):
+    """Parse a tally header, leaving `lines` at the first line of tally data
+
+    The header is everything between the 'Mesh Tally Number' line and the
+    "Energy X Y Z Result Rel Error" table heading: the particle type, and the
+    x, y, z and energy boundaries.
+
+    Parameters
+    ----------
+    lines : iterator over strings
+        Lines of a meshtal file, positioned just after the line
+        'Mesh Tally Number ...'.
+    tally_number : string
+        Number of the tally being read.
+
+    Returns
+    -------
+    tally : MeshtalTally object
+        Tally with its header information filled in, and no results.
+    """
+    tally = MeshtalTally(tally_number)
+    divs = {}
+    found_heading = False
+    for count, line in enumerate(lines, 1):
+        line_array = line.split()
+
+        if tally.particle is None:
+            if line.find('neutron') != -1:
+                tally.particle = 'n'
+            elif line.find('photon') != -1:
+                tally.particle = 'p'
+
+        if line.find('direction:') != -1:
+            divs[line_array[0]] = [float(x) for x in line_array[2:]]
+        elif line.find('Energy bin boundaries:') != -1:
+            tally.e_bounds = [float(x) for x in line_array[3:]]
+        elif line_array[-3:] == ['Result', 'Rel', 'Error']:
+            # 'Rel Error' is a single column
+            tally.columns = len(line_array) - 1
+            found_heading = True
+            break
+
+        if count >= _HEADER_LINES:
+            break
+
+    if not found_heading:
+        raise MeshtalError('Table heading not found in first {0} lines of '
+                'tally {1}; this may not be a meshtal file.'.format(
+                    _HEADER_LINES, tally_number))
+    if tally.particle is None:
+        raise MeshtalError('Tally type not found in header of tally '
+                '{0}'.format(tally_number))
+    if not all(d in divs for d in 'XYZ') or tally.e_bounds is None:
+        raise MeshtalError('Spatial or energy boundaries not found in '
+                'header of tally {0}'.format(tally_number))
+
+    tally.x_bounds, tally.y_bounds, tally.z_bounds = \
+            divs['X'], divs['Y'], divs['Z']
+    return tally
+
+
+def decode_block(block, nlines, columns):
+    """Decode a block of meshtal data lines into results and relative errors
+
+    The whole block is converted by numpy in one operation, rather than line
+    by line.
+
+    Parameters
+    ----------
+    block : string
+        Consecutive lines of tally data, e.g.
+        "Energy X Y Z Result Rel Error" rows.
+    nlines : int
+        Number of lines in `block`.
+    columns : int
+        Number of columns in each line.
+
+    Returns
+    -------
+    values : array of shape (nlines, 2)
+        The result and relative error columns of each line.
+    """
+    # The energy column of the totals group holds the word 'Total', which
+    # numpy cannot parse.  Only the last two columns are kept anyway.
+    values = np.fromstring(block.replace('Total', '0'), dtype=np.float64,
+                           sep=' ')
+    if values.size != nlines * columns:
+        raise MeshtalError('Expected {0} lines of {1} values in tally data, '
+                           'but read {2} values'.format(nlines, columns,
+                                                        values.size))
+    return values.reshape(nlines, columns)[:, -2:]
+
+
+def read_tally_data(lines, tally):
+    """Read the results of a tally into a (e_bins, spatial_points, 2) array
+
+    Parameters
+    ----------
+    lines : iterator over strings
+        Lines of a meshtal file, positioned at the first line of tally data.
+    tally : MeshtalTally object
+        Tally whose header has been read; its data array is filled in.
+
+    Returns
+    -------
+    line_lengths : set of ints
+        The lengths of the data lines read.
+    """
+    spatial_points = tally.spatial_points
+    data = np.empty((tally.e_bins, spatial_points, 2), dtype=np.float64)
+    line_lengths = set()
+    # Decode one energy group at a time, so that the text being decoded is
+    # never larger than a single group
+    for e_group in xrange(tally.e_bins):
+        group = list(itertools.islice(lines, spatial_points))
+        line_lengths.update(itertools.imap(len, group))
+        block = ''.join(group)
+        try:
+            data[e_group] = decode_block(block, spatial_points,
+                                         tally.columns)
+        except MeshtalError as e:
+            raise MeshtalError('Tally {0}, energy group {1}: {2}'.format(
+                               tally.number, e_group + 1, e))
+    tally.data = data
+    return line_lengths
+
+
+def iter_tallies(meshtal):
+    """Generator: yield each tally of a meshtal file, in a single pass
+
+    The file is read sequentially, once.  Only the tally being yielded is
+    held in memory, so the peak memory use is bounded by the size of the
+    largest tally rather than that of the file.  The meshtal's tally index
+    is saved as a side effect (see scan_tallies()).
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file, which may be gzip, bzip2 or xz
+        compressed.
+
+    Returns
+    -------
+    tallies : generator of MeshtalTally objects
+        Tallies with header information and results, in file order.
+    """
+    for entry, tally in scan_tallies(meshtal):
+        yield tally
+
+
+###############################################################################
+# Tally index
+#
+# An index records, for each tally in a meshtal file, the byte offsets of its
+# 'Mesh Tally Number' line, its bounds lines, and its data block.  Indices are
+# saved next to the meshtal in a small JSON sidecar file, keyed by the
+# meshtal's size and modification time, so that repeated reads of a large
+# meshtal can seek straight to a tally.
+
+class _LineReader(object):
+    """Iterator over the lines of a file that tracks byte offsets
+
+    Unlike iterating over the file object itself, this uses readline(), so
+    that tell() is accurate after every line.
+
+    Public member variables::
+
+        self.offset -- byte offset of the line most recently returned
+        self.line_number -- line number of the line most recently returned
+        self.record -- if not None, a list to which (offset, line) is
+                       appended for each line returned
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+        self.line_number = 0
+        self.record = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        self.offset = self.f.tell()
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.line_number += 1
+        if self.record is not None:
+            self.record.append((self.offset, line))
+        return line
+
+
+def _check_fixed_width(f, tally, data_offset, line_length):
+    """Return True if the tally's data lines all seem to have one length
+
+    The first line of each energy group, and the last line of the tally,
+    are checked to start at the offsets that fixed width lines would give.
+    """
+    nlines = tally.e_bins * tally.spatial_points
+    starts = [g * tally.spatial_points for g in xrange(tally.e_bins)]
+    starts.append(nlines - 1)
+    for n in starts:
+        f.seek(data_offset + n * line_length)
+        line = f.readline()
+        if len(line) != line_length or len(line.split()) != tally.columns:
+            return False
+    return True
+
+
+def build_index(meshtal):
+    """Scan a meshtal file and return its tally index
+
+    Tally data blocks written with fixed width lines (as MCNP does) are
+    skipped with a seek instead of being read.  Compressed meshtal files
+    cannot be seeked through cheaply, so they are read through; offsets
+    in their index refer to the decompressed text.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file, which may be gzip, bzip2 or xz
+        compressed.
+
+    Returns
+    -------
+    index : list of dicts
+        One dictionary per tally, in file order, with keys:
+        'number' (tally number string), 'line' (line number of the
+        'Mesh Tally Number' line), 'header', 'bounds', 'data' and 'end'
+        (byte offsets of the 'Mesh Tally Number' line, the first bounds
+        line, the first data line and the end of the data block), and
+        'line_length' (length in bytes of each data line, or None if the
+        data lines do not all have the same length).
+    """
+    return [entry for entry, tally in
+            scan_tallies(meshtal, lambda n, entry: False, save_index=False)]
+
+
+def scan_tallies(meshtal, select=None, save_index=True):
+    """Generator: yield the index entry and results of each tally of a
+    meshtal file, building the file's tally index in the same single pass
+
+    The file is read sequentially, once.  The results of the selected
+    tallies are decoded as they are read; the data blocks of the other
+    tallies are skipped (with a seek, when possible).  When the whole file
+    has been scanned, its index is saved to the sidecar file (see
+    load_index()), so that later reads can seek to a tally or look it up in
+    the tally cache without scanning the file again.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file, which may be gzip, bzip2 or xz
+        compressed.
+    select : callable, optional
+        Called as select(n, entry) for the n-th tally of the file (from
+        0) and its index entry; the tally's results are read if it returns
+        True.  By default all tallies are read.
+    save_index : boolean, optional
+        Whether to save the index to the sidecar file.
+
+    Returns
+    -------
+    tallies : generator of (entry, tally) tuples
+        For each tally in file order, its index entry (see build_index())
+        and a MeshtalTally with its results, or None if it was not
+        selected.
+    """
+    index = []
+    seekable = not is_compressed(meshtal)
+    with open_file(meshtal) as f:
+        lines = _LineReader(f)
+        for line in lines:
+            line_array = line.split()
+            if line_array[0:3] != ['Mesh', 'Tally', 'Number']:
+                continue
+
+            entry = {'number': line_array[3], 'line': lines.line_number,
+                     'header': lines.offset}
+            lines.record = []
+            tally = read_tally_header(lines, entry['number'])
+            entry['data'] = f.tell()
+            for offset, line in lines.record:
+                if line.find('direction:') != -1:
+                    entry['bounds'] = offset
+                    break
+            lines.record = None
+
+            nlines = tally.e_bins * tally.spatial_points
+            if select is None or select(len(index), entry):
+                # readline() keeps f.tell() accurate, unlike iterating f
+                line_lengths = read_tally_data(iter(f.readline, ''), tally)
+                entry['end'] = f.tell()
+            else:
+                line_lengths = _skip_tally_data(f, tally, entry, seekable)
+                tally = None
+            if len(line_lengths) == 1:
+                entry['line_length'] = line_lengths.pop()
+            else:
+                entry['line_length'] = None
+
+            lines.line_number += nlines
+            index.append(entry)
+            yield entry, tally
+
+    if save_index:
+        _save_index(meshtal, index)
+
+
+def _skip_tally_data(f, tally, entry, seekable):
+    """Move f past the data block of a tally, and set entry['end']
+
+    Returns the set of the data lines' lengths, which for fixed width lines
+    in an uncompressed file are checked without reading every line.
+    """
+    nlines = tally.e_bins * tally.spatial_points
+    if seekable:
+        line_length = len(f.readline())
+        if _check_fixed_width(f, tally, entry['data'], line_length):
+            entry['end'] = entry['data'] + nlines * line_length
+            f.seek(entry['end'])
+            return set([line_length])
+        f.seek(entry['data'])
+    line_lengths = set()
+    for n in xrange(nlines):
+        line = f.readline()
+        if not line:
+            raise MeshtalError('Meshtal file ended inside the data of '
+                               'tally {0}'.format(entry['number']))
+        line_lengths.add(len(line))
+    entry['end'] = f.tell()
+    return line_lengths
+
+
+def _index_filename(meshtal):
+    """Return the name of the sidecar file holding a meshtal's tally index"""
+    return meshtal + '.idx'
+
+
+def load_index(meshtal, use_sidecar=True):
+    """Return the tally index of a meshtal file, building it if necessary
+
+    The index is loaded from the meshtal's sidecar file if that file
+    matches the meshtal's current size and modification time.  Otherwise
+    the index is built, and saved to the sidecar file if possible.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    use_sidecar : boolean, optional
+        If False, always build the index and do not save it.
+
+    Returns
+    -------
+    index : list of dicts
+        See build_index().
+    """
+    if use_sidecar:
+        index = saved_index(meshtal)
+        if index is not None:
+            return index
+
+    index = build_index(meshtal)
+    if use_sidecar:
+        _save_index(meshtal, index)
+    return index
+
+
+def _index_key(meshtal):
+    """Return the identifying fields of a meshtal's sidecar index"""
+    stat = os.stat(meshtal)
+    return {'version': _INDEX_VERSION, 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def saved_index(meshtal):
+    """Return the tally index saved in a meshtal's sidecar file, or None
+
+    None is returned if there is no sidecar file, or if it does not match
+    the meshtal's current size and modification time; the meshtal itself
+    is not read.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    """
+    key = _index_key(meshtal)
+    try:
+        with open(_index_filename(meshtal), 'r') as f:
+            saved = json.load(f)
+        if all(saved[k] == v for k, v in key.iteritems()):
+            # json gives unicode strings
+            for entry in saved['tallies']:
+                entry['number'] = str(entry['number'])
+            return saved['tallies']
+    except (IOError, ValueError, KeyError, TypeError):
+        # Missing, unreadable or stale index
+        pass
+    return None
+
+
+def _save_index(meshtal, index):
+    """Save a meshtal's tally index to its sidecar file, if possible"""
+    key = _index_key(meshtal)
+    key['tallies'] = index
+    idxfile = _index_filename(meshtal)
+    try:
+        with open(idxfile, 'w') as f:
+            json.dump(key, f)
+    except IOError:
+        # The index is only a speedup; e.g. read-only directories
+        # simply go without one.
+        print >>sys.stderr, 'Could not save meshtal index', idxfile
+
+
+def read_indexed_tally(meshtal, entry, workers=1):
+    """Read one tally of a meshtal file, seeking to it with its index entry
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    entry : dict
+        The tally's entry in the meshtal's index; see load_index().
+    workers : int, optional
+        Number of processes used to decode the tally's energy groups.  The
+        groups are only decoded in parallel if workers is greater than 1,
+        the meshtal is not compressed, and the tally's data lines all have
+        the same length.
+
+    Returns
+    -------
+    tally : MeshtalTally object
+        Tally with header information and results.
+    """
+    with open_file(meshtal) as f:
+        tally = _read_indexed_header(f, entry)
+        if workers <= 1 or tally.e_bins == 1 or not entry['line_length'] \
+                or is_compressed(meshtal):
+            read_tally_data(f, tally)
+            return tally
+
+    read_parallel_data(meshtal, entry, tally, workers)
+    return tally
+
+
+def read_parallel_data(meshtal, entry, tally, workers):
+    """Decode the energy groups of a tally in a pool of processes
+
+    Each energy group is a run of `spatial_points` lines, so when all data
+    lines have the same length every group occupies a known byte range of
+    the file.  Each worker reads and decodes whole groups from its own file
+    handle, and the groups are assembled into the tally's data array.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    entry : dict
+        The tally's entry in the meshtal's index; its 'line_length' must
+        not be None.
+    tally : MeshtalTally object
+        Tally whose header has been read; its data array is filled in.
+    workers : int
+        Number of processes to decode groups with.
+    """
+    spatial_points = tally.spatial_points
+    group_bytes = spatial_points * entry['line_length']
+    tasks = [(meshtal, tally.number, e_group,
+              entry['data'] + e_group * group_bytes, group_bytes,
+              spatial_points, tally.columns)
+             for e_group in xrange(tally.e_bins)]
+
+    pool = multiprocessing.Pool(min(workers, len(tasks)))
+    try:
+        blocks = pool.map(_decode_group, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    data = np.empty((tally.e_bins, spatial_points, 2), dtype=np.float64)
+    for e_group, block in enumerate(blocks):
+        data[e_group] = block
+    tally.data = data
+
+
+def _decode_group(task):
+    """Read and decode one energy group; run by read_parallel_data workers"""
+    meshtal, number, e_group, offset, nbytes, nlines, columns = task
+    with open_file(meshtal) as f:
+        f.seek(offset)
+        block = f.read(nbytes)
+    try:
+        return decode_block(block, nlines, columns)
+    except MeshtalError as e:
+        raise MeshtalError('Tally {0}, energy group {1}: {2}'.format(
+                           number, e_group + 1, e))
+
+
+def read_indexed_header(meshtal, entry):
+    """Read only the header of one tally of a meshtal file
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    entry : dict
+        The tally's entry in the meshtal's index; see load_index().
+
+    Returns
+    -------
+    tally : MeshtalTally object
+        Tally with header information, and no results.
+    """
+    with open_file(meshtal) as f:
+        return _read_indexed_header(f, entry)
+
+
+def _read_indexed_header(f, entry):
+    """Seek to and parse a tally header in the open meshtal file f"""
+    f.seek(entry['header'])
+    f.readline() # 'Mesh Tally Number' line
+    return read_tally_header(f, entry['number'])
+
+
+###############################################################################
+# Tally cache
+#
+# Decoded tallies are saved as NumPy .npz files in a cache directory, so that
+# reading the same tally again (e.g. with a different normalization factor)
+# skips parsing the text entirely.  Cache files are named by a hash of the
+# meshtal's path, size and modification time, the tally, and optionally a
+# hash of the meshtal's contents.  The data is cached before normalization.
+# When the cache grows beyond its size limit, the least recently used files
+# are deleted; a tally larger than the limit is not cached at all.  Caching
+# is off unless requested (use_cache=True).
+
+def cache_dir():
+    """Return the directory holding cached tallies
+
+    This is the R2S_CACHE_DIR environment variable if it is set, and
+    ~/.cache/r2s/meshtal otherwise.
+    """
+    return os.environ.get('R2S_CACHE_DIR',
+            os.path.join(os.path.expanduser('~'), '.cache', 'r2s', 'meshtal'))
+
+
+def _cache_size_limit():
+    """Return the cache size limit in bytes, from R2S_CACHE_SIZE (in MB)"""
+    return int(os.environ.get('R2S_CACHE_SIZE', _CACHE_SIZE_MB)) * 1024**2
+
+
+def file_digest(meshtal):
+    """Return the SHA-1 hex digest of a file's contents
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    """
+    sha = hashlib.sha1()
+    with open(meshtal, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024**2), ''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _cache_filename(meshtal, entry, digest=None):
+    """Return the path of the cache file for one tally of a meshtal"""
+    stat = os.stat(meshtal)
+    key = [_CACHE_VERSION, os.path.abspath(meshtal), stat.st_size,
+           stat.st_mtime, entry['number'], entry['header'], digest]
+    name = hashlib.sha1(repr(key)).hexdigest()
+    return os.path.join(cache_dir(), name + '.npz')
+
+
+def _load_cached_tally(cachefile):
+    """Return the tally stored in a cache file"""
+    npz = np.load(cachefile)
+    try:
+        tally = MeshtalTally(str(npz['number']))
+        tally.particle = str(npz['particle'])
+        tally.x_bounds = npz['x_bounds'].tolist()
+        tally.y_bounds = npz['y_bounds'].tolist()
+        tally.z_bounds = npz['z_bounds'].tolist()
+        tally.e_bounds = npz['e_bounds'].tolist()
+        tally.columns = int(npz['columns'])
+        tally.data = npz['data']
+    finally:
+        npz.close()
+    return tally
+
+
+def _save_cached_tally(cachefile, tally):
+    """Write a tally to a cache file, then trim the cache to its size limit
+
+    A tally larger than the whole cache is not cached at all, and the file
+    just written is never evicted to make room for itself.
+
+    Returns
+    -------
+    saved : boolean
+        Whether the tally was written to the cache.
+    """
+    limit = _cache_size_limit()
+    if tally.data.nbytes > limit:
+        return False
+    directory = os.path.dirname(cachefile)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Write to a temporary name first, so that an interrupted write never
+    # leaves a truncated cache file behind
+    tmpfile = cachefile + '.{0}.tmp'.format(os.getpid())
+    with open(tmpfile, 'wb') as f:
+        np.savez(f, number=tally.number, particle=tally.particle,
+                 x_bounds=tally.x_bounds, y_bounds=tally.y_bounds,
+                 z_bounds=tally.z_bounds, e_bounds=tally.e_bounds,
+                 columns=tally.columns, data=tally.data)
+    os.rename(tmpfile, cachefile)
+    evict_cache(limit, keep=cachefile)
+    return True
+
+
+def evict_cache(limit, keep=None):
+    """Delete least recently used cache files until the cache fits in limit
+
+    Parameters
+    ----------
+    limit : int
+        Maximum total size of the cache files, in bytes.
+    keep : string, optional
+        Path of a cache file that is never deleted (e.g. one just written).
+    """
+    directory = cache_dir()
+    if not os.path.isdir(directory):
+        return
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith('.npz'):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= limit:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        os.remove(path)
+        total -= size
+
+
+def clear_cache():
+    """Delete all cached tallies"""
+    evict_cache(0)
+
+
+def read_cached_tally(meshtal, entry, workers=1, digest=None):
+    """Read one tally of a meshtal file, using the tally cache
+
+    If the tally is in the cache it is loaded from there; otherwise it is
+    read from the meshtal, and added to the cache.  Problems writing the
+    cache are reported, but are not errors.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    entry : dict
+        The tally's entry in the meshtal's index; see load_index().
+    workers : int, optional
+        Number of processes used to decode the tally's energy groups, if
+        it is not cached.
+    digest : string, optional
+        Hash of the meshtal's contents (see file_digest()) to include in
+        the cache key, for when modification times are not trustworthy.
+
+    Returns
+    -------
+    tally : MeshtalTally object
+        Tally with header information and results.
+    """
+    cachefile = _cache_filename(meshtal, entry, digest)
+    tally = _use_cached_tally(cachefile)
+    if tally is None:
+        tally = read_indexed_tally(meshtal, entry, workers)
+        _cache_tally(cachefile, tally)
+    return tally
+
+
+def _use_cached_tally(cachefile):
+    """Return the tally in a cache file, marking it as recently used, or
+    None if the file is missing or unreadable"""
+    if os.path.exists(cachefile):
+        try:
+            tally = _load_cached_tally(cachefile)
+            os.utime(cachefile, None)
+            return tally
+        except (IOError, OSError, ValueError, KeyError):
+            # Unreadable cache file; it is rewritten by the caller
+            pass
+    return None
+
+
+def _cache_tally(cachefile, tally):
+    """Save a tally to the cache, reporting (but not raising) failures"""
+    try:
+        if not _save_cached_tally(cachefile, tally):
+            print >>sys.stderr, 'Meshtal tally {0} is larger than the tally ' \
+                    'cache; not caching it'.format(tally.number)
+    except (IOError, OSError) as e:
+        print >>sys.stderr, 'Could not cache meshtal tally:', e
+
+
+def read_tallies(meshtal, select=None, workers=1, use_cache=False,
+                 digest=None):
+    """Generator: yield the selected tallies of a meshtal file, in file order
+
+    The meshtal is read at most once, in a single pass (see
+    scan_tallies()), which also saves its tally index.  With use_cache,
+    tallies found in the tally cache are loaded from there instead, and
+    the others are added to it as they are read; if the meshtal's index is
+    saved and all the selected tallies are cached, the meshtal is not read
+    at all.
+
+    With more than one worker, the tallies are instead read one at a time,
+    seeking to each with the meshtal's index (which is built first if it is
+    not saved), so that their energy groups can be decoded in parallel (see
+    read_indexed_tally()).
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    select : callable, optional
+        Selects the tallies to read; see scan_tallies().  By default all
+        tallies are read.
+    workers : int, optional
+        Number of processes used to decode each tally's energy groups.
+    use_cache : boolean, optional
+        Whether to load tallies from, and save them to, the tally cache.
+    digest : string, optional
+        Hash of the meshtal's contents to include in the cache keys; see
+        read_cached_tally().
+
+    Returns
+    -------
+    tallies : generator of MeshtalTally objects
+        The selected tallies, with header information and results.
+    """
+    if workers > 1:
+        for n, entry in enumerate(load_index(meshtal)):
+            if select is None or select(n, entry):
+                if use_cache:
+                    yield read_cached_tally(meshtal, entry, workers, digest)
+                else:
+                    yield read_indexed_tally(meshtal, entry, workers)
+        return
+
+    # Positions of the selected tallies that are in the cache
+    cached = set()
+    index = saved_index(meshtal) if use_cache else None
+    if index is not None:
+        selected = [n for n, entry in enumerate(index)
+                    if select is None or select(n, entry)]
+        cached = set(n for n in selected if os.path.exists(
+                     _cache_filename(meshtal, index[n], digest)))
+        if len(cached) == len(selected):
+            for n in selected:
+                yield read_cached_tally(meshtal, index[n], digest=digest)
+            return
+
+    def read_selected(n, entry):
+        return (select is None or select(n, entry)) and n not in cached
+
+    for n, (entry, tally) in enumerate(scan_tallies(meshtal, read_selected)):
+        if tally is not None:
+            if use_cache:
+                _cache_tally(_cache_filename(meshtal, entry, digest), tally)
+            yield tally
+        elif n in cached:
+            yield read_cached_tally(meshtal, entry, digest=digest)
+
+
+###############################################################################
+# Lazy tallies
+#
+# Each energy group of a tally with fixed width data lines is a fixed size
+# block of the file, and within a group the lines are in 'xyz' order (z
+# changing fastest).  So the lines for any set of groups and any i/j/k
+# sub-box of the mesh lie at known byte offsets, and can be read without
+# reading the rest of the tally.
+
+def group_names(e_bins):
+    """Return the names of a tally's energy groups, in file order
+
+    Groups are numbered from 1, as in the tag names written by
+    tag_fluxes(); the totals group, which is only present when a tally has
+    more than one energy bin, is named 'total'.
+
+    Parameters
+    ----------
+    e_bins : int
+        Number of energy groups in the tally, including the totals group.
+    """
+    if e_bins == 1:
+        return [1]
+    return range(1, e_bins) + ['total']
+
+
+class LazyMeshtalTally(object):
+    """A meshtal tally whose results are read from the file only on demand
+
+    Subsets of the tally, selected by energy group and by i/j/k ranges of
+    voxels, are read from only the byte ranges that hold them.  Tallies
+    whose data lines are not all the same length are read whole, once, on
+    first use.
+
+    Groups are named as by group_names().  Voxel ranges are (start, stop)
+    pairs of i, j or k indices, with stop excluded; None selects the whole
+    extent of the mesh along that dimension.
+
+    Public member variables::
+
+        self.meshtal -- path of the meshtal file
+        self.entry -- the tally's entry in the meshtal's index
+        self.header -- MeshtalTally with the tally's header information,
+                       and no results
+    """
+
+    def __init__(self, meshtal, entry):
+        self.meshtal = meshtal
+        self.entry = entry
+        self.header = read_indexed_header(meshtal, entry)
+        self._tally = None
+
+    @property
+    def number(self):
+        """The tally number, as a string"""
+        return self.header.number
+
+    @property
+    def particle(self):
+        """The tally type; either neutron ('n') or photon ('p')"""
+        return self.header.particle
+
+    @property
+    def dims(self):
+        """Number of voxels along the x, y and z dimensions"""
+        return tuple(len(b) - 1 for b in (self.header.x_bounds,
+                     self.header.y_bounds, self.header.z_bounds))
+
+    @property
+    def groups(self):
+        """Names of the tally's energy groups, in file order"""
+        return group_names(self.header.e_bins)
+
+    def _group_index(self, group):
+        """Return the position in the file of the named energy group"""
+        try:
+            return self.groups.index(group)
+        except ValueError:
+            raise MeshtalError('Tally {0} has no energy group {1!r}'.format(
+                               self.number, group))
+
+    def ranges(self, i=None, j=None, k=None):
+        """Return checked (start, stop) voxel ranges along x, y and z"""
+        ranges = []
+        for name, r, n in zip('ijk', (i, j, k), self.dims):
+            start, stop = (0, n) if r is None else r
+            if not 0 <= start < stop <= n:
+                raise MeshtalError('Invalid {0} range {1} for tally {2}, ' \
+                        'which has {3} voxels along that dimension'.format(
+                        name, r, self.number, n))
+            ranges.append((start, stop))
+        return ranges
+
+    def bounds(self, i=None, j=None, k=None):
+        """Return the x, y and z bounds of a sub-box of the tally's mesh
+
+        Returns
+        -------
+        x_bounds, y_bounds, z_bounds : lists of floats
+        """
+        (i0, i1), (j0, j1), (k0, k1) = self.ranges(i, j, k)
+        return (self.header.x_bounds[i0:i1 + 1],
+                self.header.y_bounds[j0:j1 + 1],
+                self.header.z_bounds[k0:k1 + 1])
+
+    def _runs(self, ranges):
+        """Yield (first line, number of lines) for each contiguous run of
+        data lines, within one energy group, that holds the sub-box"""
+        nx, ny, nz = self.dims
+        (i0, i1), (j0, j1), (k0, k1) = ranges
+        if (k0, k1) == (0, nz) and (j0, j1) == (0, ny):
+            yield i0 * ny * nz, (i1 - i0) * ny * nz
+        elif (k0, k1) == (0, nz):
+            for i in xrange(i0, i1):
+                yield (i * ny + j0) * nz, (j1 - j0) * nz
+        else:
+            for i in xrange(i0, i1):
+                for j in xrange(j0, j1):
+                    yield (i * ny + j) * nz + k0, k1 - k0
+
+    def read(self, groups=None, i=None, j=None, k=None):
+        """Read the results and relative errors of a subset of the tally
+
+        Parameters
+        ----------
+        groups : list, optional
+            Names of the energy groups to read; by default, all of them.
+        i, j, k : (start, stop) tuples, optional
+            Ranges of voxels to read; by default, the whole mesh.
+
+        Returns
+        -------
+        data : array of shape (len(groups), voxels, 2)
+            The result and relative error of each voxel of the sub-box, in
+            'xyz' order, for each of the requested groups in turn.
+        """
+        if groups is None:
+            groups = self.groups
+        indices = [self._group_index(g) for g in groups]
+        ranges = self.ranges(i, j, k)
+        (i0, i1), (j0, j1), (k0, k1) = ranges
+        points = (i1 - i0) * (j1 - j0) * (k1 - k0)
+
+        line_length = self.entry['line_length']
+        if line_length is None:
+            if self._tally is None:
+                self._tally = read_indexed_tally(self.meshtal, self.entry)
+            data = self._tally.data.reshape(
+                    (self.header.e_bins,) + self.dims + (2,))
+            data = data[indices, i0:i1, j0:j1, k0:k1]
+            return data.reshape(len(indices), points, 2)
+
+        columns = self.header.columns
+        group_bytes = self.header.spatial_points * line_length
+        runs = list(self._runs(ranges))
+        data = np.empty((len(indices), points, 2), dtype=np.float64)
+        with open_file(self.meshtal) as f:
+            # Visit the groups in file order, so that the file (which may be
+            # compressed) is only read forwards
+            for n in sorted(xrange(len(indices)), key=indices.__getitem__):
+                group_offset = self.entry['data'] + indices[n] * group_bytes
+                blocks = []
+                for first, nlines in runs:
+                    f.seek(group_offset + first * line_length)
+                    blocks.append(f.read(nlines * line_length))
+                try:
+                    data[n] = decode_block(''.join(blocks), points, columns)
+                except MeshtalError as e:
+                    raise MeshtalError('Tally {0}, energy group {1}: ' \
+                            '{2}'.format(self.number, groups[n], e))
+        return data
+
+
+def open_tally(meshtal, tally_number):
+    """Return a LazyMeshtalTally for one tally of a meshtal file
+
+    Only the tally's header is read.
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    tally_number : string or int
+        Number of the tally.
+
+    Returns
+    -------
+    tally : LazyMeshtalTally object
+    """
+    for entry in load_index(meshtal):
+        if entry['number'] == str(tally_number):
+            return LazyMeshtalTally(meshtal, entry)
+    raise MeshtalError('Tally {0} not found in {1}'.format(tally_number,
+                                                           meshtal))
+
+
+###############################################################################
+# Array API
+
+TallyArrays = namedtuple('TallyArrays', ('number', 'particle', 'x_bounds',
+                         'y_bounds', 'z_bounds', 'e_bounds', 'fluxes',
+                         'errors'))
+
+
+def tally_arrays(tally):
+    """Return a tally's bounds and results as NumPy arrays
+
+    Parameters
+    ----------
+    tally : MeshtalTally object
+        Tally whose results have been read.
+
+    Returns
+    -------
+    arrays : TallyArrays namedtuple
+        With fields number and particle (strings), x_bounds, y_bounds,
+        z_bounds and e_bounds (1-D float arrays), and fluxes and errors
+        (arrays of shape (e_bins, nx, ny, nz), indexed [group, i, j, k]).
+        The fluxes are not normalized, and are views of the tally's data.
+    """
+    shape = (tally.e_bins,) + tally.dims
+    return TallyArrays(tally.number, tally.particle,
+                       np.array(tally.x_bounds), np.array(tally.y_bounds),
+                       np.array(tally.z_bounds), np.array(tally.e_bounds),
+                       tally.fluxes.reshape(shape),
+                       tally.errors.reshape(shape))
+
+
+def read_tally_arrays(meshtal, tally_number=None, workers=1, use_cache=False):
+    """Read one tally of a meshtal file into NumPy arrays
+
+    Parameters
+    ----------
+    meshtal : string
+        File path to meshtal file.
+    tally_number : string or int, optional
+        Number of the tally to read; by default, the first in the file.
+    workers : int, optional
+        Number of processes used to decode the tally's energy groups.
+    use_cache : boolean, optional
+        Whether to load the tally from, and save it to, the tally cache.
+
+    Returns
+    -------
+    arrays : TallyArrays namedtuple
+        See tally_arrays().
+    """
+    if tally_number is None:
+        select = lambda n, entry: n == 0
+    else:
+        select = lambda n, entry: entry['number'] == str(tally_number)
+    tallies = list(read_tallies(meshtal, select, workers, use_cache))
+    if not tallies:
+        raise MeshtalError('Tally {0} not found in {1}'.format(tally_number,
+                                                               meshtal))
+    return tally_arrays(tallies[0])
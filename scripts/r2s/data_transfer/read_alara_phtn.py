@@ -6,12 +6,20 @@ information to a mesh.
 """
 
 from optparse import OptionParser
-from itaps import iBase,iMesh
-from r2s.scdmesh import ScdMesh, ScdMeshError
+import numpy as np
+try:
+    from itaps import iBase, iMesh
+except ImportError:
+    iBase = iMesh = None
+from r2s.scdmesh import ScdMesh, ScdMeshError, TagNotFoundError, \
+        TagAlreadyExistsError
+from r2s.fileio import open_file
+from r2s.grouptags import group_tag_name, vector_tag_name, \
+        find_num_groups, get_group_values, set_group_values
 
 
 def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
-                retag=False, totals=False):
+                retag=False, totals=False, vector=False):
     """Read in a phtn_src file and tag the contents to a mesh.
     
     Method reads in a phtn_src file line by line, looking for
@@ -22,7 +30,8 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
     Parameters
     ----------
     inputfile : string
-        Path to an ALARA-style 'phtn_src' file
+        Path to an ALARA-style 'phtn_src' file, which may be gzip, bzip2 or
+        xz compressed
     meshobj : ScdMesh object
         Structured mesh object to tag,
     isotope : string
@@ -33,9 +42,13 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         Whether to retag existing tags in mesh
     totals : boolean
         Whether to tag the total photon source strength for each voxel
+    vector : boolean
+        Whether to tag the source strengths of all energy groups as the
+        single vector tag 'phtn_src_groups', instead of one tag per group
+        (see r2s.grouptags)
     """
     
-    fr = open(inputfile, 'r')
+    fr = open_file(inputfile, 'r')
 
     # First, we determine the coolingstep string to look for
     try: # get_cooling_step_name() can throw a few exceptions
@@ -66,33 +79,30 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         mesh = meshobj
         voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
 
-    # We create a list of tag objects ('tagList') to use while parsing phtn_src
-    tagList = []
-    for grp in xrange(numergbins): # group tags = parts in the line - 2
+    # Unless retagging, the tags must not already exist on the mesh
+    if vector:
+        tagnames = [vector_tag_name("phtn_src")]
+    else: # group tags = parts in the line - 2
+        tagnames = [group_tag_name("phtn_src", grp+1)
+                    for grp in xrange(numergbins)]
+    for tagname in tagnames:
         try:
-            # If tags are new to file... create tag
-            tagList.append(mesh.createTag( \
-                    "phtn_src_group_{0:03d}".format(grp+1), 1, float))
-        except iBase.TagAlreadyExistsError:
-            # Else if the tags already exist...
-            if retag:
-                # Get existing tag
-                # We will overwrite tag values that already exist
-                tagList.append(mesh.getTagHandle( \
-                        "phtn_src_group_{0:03d}".format(grp+1)))
-            else:
-                # Or print error if retagging was not specified.
-                print "ERROR: The tag phtn_src_group_{0:03d} already exists " \
-                        "on the mesh." \
-                        "\nUse -r option to overwrite tags." \
-                        "".format(grp+1)
-                return 0
+            mesh.getTagHandle(tagname)
+        except TagNotFoundError:
+            continue
+        if not retag:
+            print "ERROR: The tag {0} already exists on the mesh." \
+                    "\nUse -r option to overwrite tags.".format(tagname)
+            return 0
 
+    # Source strengths are collected for each voxel and group, and tagged
+    #  once the whole file has been parsed
+    values = np.zeros((len(voxels), numergbins))
     voxelcnt = 0
 
     # We close and reopen the input file to read from beginning again
     fr.close()
-    fr = open(inputfile, 'r')
+    fr = open_file(inputfile, 'r')
 
     # Initial settings for variables that enable correct parsing when interested
     #  in specific isotopes.
@@ -112,7 +122,7 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         if lineparts[0].strip(' ') == isotope and \
                 lineparts[1].strip(' ') == coolingstep:
             for grp, val, in enumerate(lineparts[2:]):
-                 (tagList[grp])[voxels[voxelcnt]] = float(val)
+                 values[voxelcnt, grp] = float(val)
             foundIsoCool = True
             if specialIsotope: 
                 writeZeros = False # Ignores TOTAL line in this voxel
@@ -123,8 +133,7 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
         elif lineparts[0] == 'TOTAL' and \
                 lineparts[1].strip(' ') == coolingstep:
             if writeZeros:
-                for grp, val, in enumerate(lineparts[2:]):
-                     (tagList[grp])[voxels[voxelcnt]] = 0.0
+                values[voxelcnt, :] = 0.0
             voxelcnt += 1
             writeZeros = True # Reset to true at end of voxel's entry
 
@@ -136,8 +145,12 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
                 "{2}.".format(coolingstep, isotope, inputfile)
         return 0
 
+    # Only the voxels listed in the file are tagged
+    set_group_values(mesh, "phtn_src", voxels[:voxelcnt], values[:voxelcnt],
+                     vector)
+
     # We get rid of tags corresponding with higher energy groups
-    if retag:
+    if retag and not vector:
         grp = len(lineparts) - 2
         while grp:
             try:
@@ -146,7 +159,7 @@ def read_to_h5m(inputfile, meshobj, isotope="TOTAL", coolingstep=0, \
                 # Normally an exception is thrown by above line
                 mesh.destroyTag(tag,force=True)
                 grp += 1
-            except iBase.TagNotFoundError:
+            except TagNotFoundError:
                 grp = 0 # breaks the while loop
 
     if totals:
@@ -246,7 +259,7 @@ def tag_phtn_src_totals(mesh, voxels, numergbins=-1, retag=False):
         # If tags are new to file... create tag
         totalPhtnSrcTag = mesh.createTag( \
                 "phtn_src_total", 1, float)
-    except iBase.TagAlreadyExistsError:
+    except TagAlreadyExistsError:
         if not retag:
             print "ERROR: phtn_src_total tag already exists. Use the -r "\
                     "option to enable retagging."
@@ -255,39 +268,35 @@ def tag_phtn_src_totals(mesh, voxels, numergbins=-1, retag=False):
         else:
             totalPhtnSrcTag = mesh.getTagHandle("phtn_src_total")
  
-    # If not supplied, se try/except to find number of energy bins
-    if not numergbins:
-        for i in xrange(1,1000): #~ Arbitrary: we look for up to 1000 groups
-            try:
-                mesh.getTagHandle("phtn_src_group_{0:03d}".format(i))
-            except iBase.TagNotFoundError: 
-                numergbins = i - 1
-                break
-
-    # We go voxel by voxel, calculating total photon source, and then adding
-    #  these tags.
-    for cnt, vox in enumerate(voxels):
-        totstrength = 0.0
-
-        # get total for the voxel
-        for i in xrange(1,numergbins + 1):
-            grouptag = mesh.getTagHandle("phtn_src_group_{0:03d}".format(i))
-            try:
-                totstrength += float(grouptag[vox])
-            except iBase.TagNotFoundError:
-                if cnt == 0:
-                    print "ERROR: phtn_src_group_# tags not found on first " \
-                            "voxel. Tags are probably missing."
-                else:
-                    print "ERROR: phtn_src_group_# tags not found on a non-" \
-                            "first voxel. phtn_src file used to create tags " \
-                            "probably did not include enough voxels. This is " \
-                            "a problem with ALARA and voids. Replace void " \
-                            "with any zero density material to fix this."
-                return 0
-
-        # Add the total as a tag
-        totalPhtnSrcTag[vox] = float(totstrength)
+    # If not supplied, find the number of energy bins
+    if numergbins is None or numergbins < 1:
+        numergbins = find_num_groups(mesh, "phtn_src")
+
+    # We get the source strengths of all voxels, checking the first voxel on
+    #  its own to tell missing tags from voxels missing from phtn_src
+    try:
+        get_group_values(mesh, "phtn_src", voxels[:1], num_groups=numergbins)
+    except TagNotFoundError:
+        print "ERROR: phtn_src_group_# tags not found on first " \
+                "voxel. Tags are probably missing."
+        return 0
+    try:
+        values = get_group_values(mesh, "phtn_src", voxels,
+                                  num_groups=numergbins)
+    except TagNotFoundError:
+        print "ERROR: phtn_src_group_# tags not found on a non-" \
+                "first voxel. phtn_src file used to create tags " \
+                "probably did not include enough voxels. This is " \
+                "a problem with ALARA and voids. Replace void " \
+                "with any zero density material to fix this."
+        return 0
+
+    # Sum the energy groups in order, calculating total photon source, and
+    #  then add these tags.
+    totstrength = np.zeros(len(voxels))
+    for i in xrange(numergbins):
+        totstrength += values[:, i]
+    totalPhtnSrcTag[voxels] = totstrength
 
     return 1
 
@@ -326,6 +335,10 @@ def main():
             default=False,help="Option enables adding the total photon " \
             "source strength for all energy groups as a tag for each voxel. " \
             "Default: %default")
+    parser.add_option("-v","--vector",action="store_true",dest="vector", \
+            default=False,help="Option tags the source strengths of all " \
+            "energy groups as one vector tag, phtn_src_groups, instead of " \
+            "one tag per group. Default: %default")
 
     (options, args) = parser.parse_args()
 
@@ -338,7 +351,8 @@ def main():
 
     read_to_h5m( \
                 options.phtnsrcfile, mesh, options.isotope, \
-                options.coolingstep, options.retag, options.totals)
+                options.coolingstep, options.retag, options.totals, \
+                options.vector)
 
     if isinstance(mesh, ScdMesh):
         mesh.imesh.save(options.meshfile)
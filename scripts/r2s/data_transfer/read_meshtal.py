@@ -14,262 +14,205 @@
 ###############################################################################
 from itaps import iMesh, iBase
 from optparse import OptionParser
-import linecache
+from collections import OrderedDict
 import sys
 from r2s.scdmesh import ScdMesh, ScdMeshError
+from r2s.grouptags import set_group_values
+from r2s.data_transfer.meshtal import MeshtalError, find_tallies, \
+        read_tallies, file_digest, cache_dir, clear_cache
 
-################################################################################
-
-def find_tallies(meshtal) :
-    """Searches the meshtal file to determine the number of tallies present and
-    returns the tallies and lines where they are listed.
-    
-    Parameters
-    ----------
-    meshtal : string
-        File path to meshtal file.
 
-    Returns
-    -------
-    tally_numbers : list of strings
-        List of tally numbers (as strings)
-    tally_lines : list of integers
-        List of the line numbers where tallies begin
-    """
-    tally_lines=[]
-    tally_numbers = []
-    count = 1;
-    line = linecache.getline(meshtal, count)
-    while line != '' :
-
-        if line.split()[0:3] == ['Mesh', 'Tally', 'Number'] :
-            tally_numbers.append(line.split()[3])
-            tally_lines.append(count)
-        count += 1;
-
-        line = linecache.getline(meshtal, count)
-    return tally_numbers, tally_lines
-
-################################################################################
+###############################################################################
 
-def find_meshtal_type(meshtal, tally_line) :
-    """Searchs the meshtal header to determine if it is a neutron or photon 
-    meshtally
+def tag_fluxes(tally, sm, norm, prefix=None, vector=False) :
+    """Tags the fluxes from a meshtally to a structured mesh.
 
     Parameters
     ----------
-    meshtal : string
-        File path to meshtal file.
-    tally_line : int
-        Line number in file where tally begins
+    tally : MeshtalTally object
+        Tally whose results have been read.
+    sm : scdmesh.ScdMesh
+        Structured mesh to tag fluxes to
+    norm : float, optional
+       Normalization factor to multiply into each flux value. 
+    prefix : string, optional
+        Prefix of the tag names, which have the form prefix_group_###.
+        Defaults to the tally's particle type ('n' or 'p').
+    vector : boolean, optional
+        If True, the energy groups' fluxes and errors are tagged as the
+        vector tags prefix_groups and prefix_groups_error instead (see
+        r2s.grouptags); the total is still tagged as prefix_group_total.
 
     Returns
     -------
-    meshtal_type : {'n', 'p'}
-        Tally type; either neutron ('n') or photon ('p) is supported.
+    N/A
     """
-    neutron_index = -1
-    photon_index = -1
-
-    count = tally_line
-    meshtal_type = ''
-
-    while neutron_index == -1 and photon_index == -1 :
-        line = linecache.getline(meshtal, count)
-        neutron_index = line.find('neutron')
-        photon_index = line.find('photon')
-        count = count+1
-        if (count - tally_line) > 100 :
-            print >>sys.stderr, 'Tally type not found in first 100 lines\n',\
-                                 meshtal, ' may not be a meshtal file.'
-            sys.exit(1)
-
-    if neutron_index != -1 :
-        print '\tThis is a neutron tally.'
-        meshtal_type = 'n'
-
-    if photon_index != -1 :
-        print '\tThis is a photon tally.'
-        meshtal_type = 'p'
-    return meshtal_type
-
-
-###############################################################################
-
-def find_first_line(meshtal, tally_line) :
-    """Searchs for the "Energy X Y Z" line, to determine the first line of data
+    meshtal_type = prefix or tally.particle
+    voxels = sm.iterateHex('xyz')
+
+    # Normalize all groups in a single operation
+    fluxes = tally.fluxes * norm
+    num_groups = max(tally.e_bins - 1, 1)
+
+    # Tag the energy groups' data onto all voxels
+    set_group_values(sm.imesh, meshtal_type, voxels, fluxes[:num_groups].T,
+                     vector=vector)
+    set_group_values(sm.imesh, meshtal_type, voxels,
+                     tally.errors[:num_groups].T, vector=vector,
+                     suffix='_error')
+
+    # Tag the totals group, if there is one
+    for n in xrange(num_groups, tally.e_bins):
+        flux_str, error_str = _group_tag_names(meshtal_type, 'total')
+        _get_float_tag(sm, flux_str)[voxels] = fluxes[n]
+        _get_float_tag(sm, error_str)[voxels] = tally.errors[n]
+    print "\tFluxes multiplied by source normalization of {0}".format(norm)
 
-    Parameters
-    ----------
-    meshtal : string
-        File path to meshtal file.
-    tally_line : int
-        Line number in file where tally begins
 
-    Returns
-    -------
-    m : int
-        Line number of first data line for the tally in `meshtal`
-    """
-    heading = ['Result', 'Rel', 'Error']
-    m = tally_line
-    line_array = []
-    while line_array[-3:] != heading :
-        line = linecache.getline(meshtal,m)
-        line_array = line.split()
-        m += 1
-        if (m-tally_line) > 100 :
-            print >>sys.stderr,'Table heading not found in first 100 lines\n',\
-                                meshtal, ' may not be a meshtal file.'
-            sys.exit(1)
+def _group_tag_names(prefix, group):
+    """Return the flux and error tag names for a named energy group"""
+    if group == 'total': # tag name for totals group
+        flux_str = prefix + '_group_total'
+    else: # tag name for each E bin
+        flux_str = '{0}_group_{1:03d}'.format(prefix, group)
+    return flux_str, flux_str + '_error'
 
-    return m #first line of data
 
+def _get_float_tag(sm, name):
+    """Return the float tag `name` on sm's iMesh, creating it if necessary"""
+    try:
+        return sm.imesh.createTag(name, 1, float)
+    except iBase.TagAlreadyExistsError:
+        return sm.imesh.getTagHandle(name)
 
 
-###############################################################################
+def tag_tally_subset(tally, sm, groups=None, i=None, j=None, k=None,
+                     norm=1.0, prefix=None):
+    """Tag a subset of a lazily read tally onto a structured mesh
 
-def find_mesh_bounds(meshtal,tally_line) :
-    """Parse the header of the meshtal to get the x, y, z, and energy boundaries
+    Only the subset is read from the meshtal file.
+    Tags are named as by tag_fluxes().  The mesh may either have the
+    dimensions of the whole tally, in which case only the voxels of the
+    sub-box are tagged, or have the dimensions of the sub-box (see
+    LazyMeshtalTally.bounds()).
 
     Parameters
     ----------
-    meshtal : string
-        File path to meshtal file.
-    tally_line : int
-        Line number in file where tally begins
-
-    Returns
-    -------
-    ... : tuple of 4 ints 
-        Tuple of the divisions in x, y, z and energy
+    tally : meshtal.LazyMeshtalTally object
+        Tally to read the subset from.
+    sm : scdmesh.ScdMesh
+        Structured mesh to tag.
+    groups, i, j, k :
+        The subset of the tally to tag; see LazyMeshtalTally.read().
+    norm : float, optional
+        Normalization factor to multiply into each flux value.
+    prefix : string, optional
+        Prefix of the tag names; defaults to the tally's particle type.
     """
-    #Locate line where 'X direction' appears
-    line=''
-    count=tally_line
-    while line.find('direction:') == -1 :
-        count += 1
-        line=linecache.getline(meshtal, count)
-
-        #Exit loop is spatial information is not found
-        if count-tally_line > 100 :
-            print >>sys.stderr,\
-                 'Spacial bounderies not found in first 100 lines'
-            sys.exit(1)
-            
-    #Create list of all spatial and energy bounderies
-    divs=[]
-    for x in (0,1,2) :
-        divs.append(linecache.getline(meshtal, count + x).split()[2:])
-
-    divs.append(linecache.getline(meshtal, count+3).split()[3:])
-    
-    print '\tMeshtal has dimensions ({0},{1},{2}) with {3} energy bin(s)'\
-           .format(len(divs[0])-1,len(divs[1])-1, len(divs[2])-1, len(divs[3])-1)
+    if groups is None:
+        groups = tally.groups
+    ranges = tally.ranges(i, j, k)
+    sm_dims = tuple(sm.dims[d + 3] - sm.dims[d] for d in xrange(3))
+    sub_dims = tuple(stop - start for start, stop in ranges)
+    if sm_dims == sub_dims:
+        voxels = list(sm.iterateHex('xyz'))
+    elif sm_dims == tally.dims:
+        voxels = list(sm.iterateHex('xyz',
+                **dict((d, range(start, stop))
+                       for d, (start, stop) in zip('xyz', ranges))))
+    else:
+        raise ScdMeshError('Structured mesh dimensions {0} match ' \
+                'neither the tally {1} nor the sub-box {2}'.format(
+                sm_dims, tally.dims, sub_dims))
+
+    data = tally.read(groups, *ranges)
+    for n, group in enumerate(groups):
+        flux_str, error_str = _group_tag_names(prefix or tally.particle,
+                                               group)
+        _get_float_tag(sm, flux_str)[voxels] = data[n, :, 0] * norm
+        _get_float_tag(sm, error_str)[voxels] = data[n, :, 1]
+
+
+def _read_tally_at(filename, tally_line, workers=1, use_cache=False):
+    """Read the single tally beginning on line `tally_line` of `filename`,
+    or its first tally if tally_line is None"""
+    if tally_line is None:
+        select = lambda n, entry: n == 0
+    else:
+        select = lambda n, entry: entry['line'] == tally_line
+    # The whole file is scanned, so that its index is saved
+    tallies = list(read_tallies(filename, select, workers, use_cache))
+    if not tallies:
+        raise MeshtalError('No tally begins on line {0} of {1}'.format(
+                           tally_line, filename))
+    return tallies[0]
 
-    return (divs[0],divs[1],divs[2],divs[3])
-   
 
-###############################################################################
+def read_meshtal( filename, tally_line, norm=1.0, workers=1, use_cache=False,
+                  **kw ):
+    """Read an MCNP meshtal file and return a tagged structured mesh for it
 
-def tag_fluxes(meshtal, meshtal_type, m, spatial_points, \
-               e_bins, sm, norm) :
-    """Tags the fluxes from a meshtally to a structured mesh.
+    The optional normalization factor will be multiplied into each flux value.
+    This can be used to rescale a tally if a tally multiplier was not used
+    in the original MCNP problem.
+
+    The meshtal is read in a single pass (see meshtal.read_tallies()).
 
     Parameters
     ----------
-    meshtal : string
+    filename : string
         File path to meshtal file.
-    meshtal_type : {'n', 'p'}
-        Tally type; either neutron ('n') or photon ('p) is supported.
-    m : int
-        Line number of first data line for the tally in `meshtal`
-    spatial_points : int
-        Number of meshtally points (aka voxels)
-    e_bins : int
-        Number of energy bins in the meshtally
-    sm : scdmesh.ScdMesh
-        Structured mesh to tag fluxes to
+    tally_line : int
+        Line number in file where tally begins; None reads the first tally.
     norm : float, optional
        Normalization factor to multiply into each flux value. 
+    workers : int, optional
+        Number of processes used to decode the tally's energy groups.
+    use_cache : boolean, optional
+        Whether to load the tally from, and save it to, the tally cache.
+    Keyword arguments:
+        smesh: An existing scdmesh on which to tag the fluxes.  
+               A ScdMeshError is raised if this mesh has incompatible ijk dims
 
     Returns
     -------
-    N/A
+    sm : ScdMesh object
+        Opened structured mesh from filename, with meshtally data tagged
     """
-    
-    voxels = list(sm.iterateHex('xyz'))
-    
-    for e_group in range(1, e_bins +1) : 
-        # Create tags if they do not already exist
-        if e_group != e_bins or e_bins == 1: # tag name for each E bin
-            flux_str = '{0}_group_{1:03d}'.format(meshtal_type, e_group)
-            error_str = '{0}_group_{1:03d}_error'.format(meshtal_type, e_group)
-        elif e_group == e_bins : # tag name for totals group
-            flux_str = meshtal_type + '_group_total'
-            error_str = meshtal_type + '_group_total_error'
-
-        try:
-            tag_flux = sm.imesh.createTag(flux_str, 1, float)
-        except iBase.TagAlreadyExistsError:
-            tag_flux = sm.imesh.getTagHandle(flux_str)
-        try:
-            tag_error = sm.imesh.createTag(error_str ,1, float)
-        except iBase.TagAlreadyExistsError:
-            tag_error = sm.imesh.getTagHandle(error_str)
-
-        #Create lists of data from meshtal file for energy group 'e_group'
-        flux_data = list()
-        error_data = list()
-        for point in range(0, spatial_points) :
-            flux_data.append( float(linecache.getline( meshtal,m+point+\
-                               (e_group-1)*spatial_points ).split()[-2])*norm)
-            error_data.append(float(linecache.getline( meshtal,m+point+\
-                               (e_group-1)*spatial_points ).split()[-1]))
-
-        #Tag data for energy group 'e_group' onto all voxels
-        tag_flux[voxels] = flux_data
-        tag_error[voxels] = error_data
-    print "\tFluxes multiplied by source normalization of {0}".format(norm)
+    tally = _read_tally_at(filename, tally_line, workers, use_cache)
+    return tally_to_scdmesh(tally, norm, **kw)
 
 
-def read_meshtal( filename, tally_line, norm=1.0, **kw ):
-    """Read an MCNP meshtal file and return a tagged structured mesh for it
-
-    The optional normalization factor will be multiplied into each flux value.
-    This can be used to rescale a tally if a tally multiplier was not used
-    in the original MCNP problem.
+def tally_to_scdmesh( tally, norm=1.0, **kw ):
+    """Return a structured mesh tagged with the results of a meshtal tally
 
     Parameters
     ----------
-    filename : string
-        File path to meshtal file.
-    tally_line : int
-        Line number in file where tally begins
+    tally : MeshtalTally object
+        Tally whose results have been read.
     norm : float, optional
        Normalization factor to multiply into each flux value. 
     Keyword arguments:
         smesh: An existing scdmesh on which to tag the fluxes.  
                A ScdMeshError is raised if this mesh has incompatible ijk dims
+        vector: If True, tag the energy groups as vector tags; see
+                tag_fluxes().
 
     Returns
     -------
     sm : ScdMesh object
-        Opened structured mesh from filename, with meshtally data tagged
+        Structured mesh with meshtally data tagged
     """
-    # Getting relevant information from meshtal header
-    meshtal_type = find_meshtal_type( filename, tally_line )
-    m = find_first_line( filename, tally_line )
-    x_bounds, y_bounds, z_bounds, e_groups = \
-            find_mesh_bounds( filename, tally_line )
- 
-    # Calculating pertinent information from meshtal header and input
-    spatial_points = (len(x_bounds)-1)*(len(y_bounds)-1)*(len(z_bounds)-1)
-    if len(e_groups) > 2 :
-        e_bins = len(e_groups) #don't substract 1; cancels with totals bin
-    elif len(e_groups) == 2 : #for 1 energy bin, meshtal doesn't have TOTALS group
-        e_bins = 1 
-    sm = ScdMesh(x_bounds, y_bounds, z_bounds)
+    meshtal_type = tally.particle
+    if meshtal_type == 'n':
+        print '\tThis is a neutron tally.'
+    else:
+        print '\tThis is a photon tally.'
+    print '\tMeshtal has dimensions ({0},{1},{2}) with {3} energy bin(s)'\
+           .format(len(tally.x_bounds)-1, len(tally.y_bounds)-1,
+                   len(tally.z_bounds)-1, len(tally.e_bounds)-1)
+
+    sm = ScdMesh(tally.x_bounds, tally.y_bounds, tally.z_bounds)
 
     if 'smesh' in kw:
         dims = kw['smesh'].dims
@@ -278,26 +221,133 @@ def read_meshtal( filename, tally_line, norm=1.0, **kw ):
                     "Incorrect dimension in preexisting structured mesh")
         sm = kw['smesh']
 
+    tag_tally_info(tally, sm)
+
+    # Tagging structured mesh
+    tag_fluxes(tally, sm, norm, vector=kw.get('vector', False))
+
+    return sm
+
+
+def tag_tally_info(tally, sm, prefix=None):
+    """Tag a tally's particle type and energy bounds on a mesh's root set
+
+    Parameters
+    ----------
+    tally : MeshtalTally object
+        Tally whose header has been read.
+    sm : scdmesh.ScdMesh
+        Structured mesh to tag.
+    prefix : string, optional
+        Tag prefix used for the tally's fluxes.  Unless it is None or the
+        particle type, the tags are named prefix_particle and
+        prefix_E_upper_bounds instead of particle and E_upper_bounds.
+    """
+    if prefix is None or prefix == tally.particle:
+        particle_str = "particle"
+        e_bin_str = "E_upper_bounds"
+    else:
+        particle_str = prefix + "_particle"
+        e_bin_str = prefix + "_E_upper_bounds"
+
     # Tagging structured mesh with particle type at root level
-    tag_particle = sm.imesh.createTag("particle", 1, int)
+    tag_particle = sm.imesh.createTag(particle_str, 1, int)
 
-    if meshtal_type == 'n':
+    if tally.particle == 'n':
         tag_particle[sm.imesh.rootSet] = 1
 
-    elif meshtal_type == 'p':
+    elif tally.particle == 'p':
         tag_particle[sm.imesh.rootSet] = 2
 
     # Tagging structured mesh with energy lower bounds (at root level)
     # only the upper bounds are tagged, so the first value in e_groups,
     # which is always 0.000 is ommitted.
-    tag_e_bin = sm.imesh.createTag("E_upper_bounds", len(e_groups) - 1, float)
+    e_groups = tally.e_bounds
+    tag_e_bin = sm.imesh.createTag(e_bin_str, len(e_groups) - 1, float)
     tag_e_bin[sm.imesh.rootSet] = e_groups[1:]
 
-    # Tagging structured mesh
-    tag_fluxes(filename, meshtal_type, m, spatial_points,
-               e_bins, sm, norm)
 
-    return sm
+def read_meshtal_tallies( filename, tally_numbers=None, norm=1.0, workers=1,
+                          use_cache=False, vector=False ):
+    """Read several tallies of an MCNP meshtal file onto structured meshes
+
+    All tallies are read in a single pass through the file (see
+    meshtal.read_tallies()), and held in memory until they are all tagged,
+    since the tag names depend on which tallies share a mesh.  Tallies with
+    identical x, y and z bounds share one structured mesh.  A mesh holding
+    a single tally uses the usual tag names (e.g. n_group_001 and particle);
+    when tallies share a mesh, each tally's tags are instead prefixed with
+    its particle type and tally number (e.g. n14_group_001 and
+    n14_particle).
+
+    Parameters
+    ----------
+    filename : string
+        File path to meshtal file.
+    tally_numbers : list of strings or ints, optional
+        Tallies to read.  By default all tallies in the file are read.
+    norm : float or dict, optional
+        Normalization factor to multiply into each flux value, or a
+        dictionary mapping tally numbers (as strings) to factors.
+    workers : int, optional
+        Number of processes used to decode each tally's energy groups.
+    use_cache : boolean, optional
+        Whether to load tallies from, and save them to, the tally cache.
+    vector : boolean, optional
+        If True, tag the energy groups as vector tags; see tag_fluxes().
+
+    Returns
+    -------
+    meshes : OrderedDict
+        Maps each tally number (as a string), in file order, to a tuple
+        (sm, prefix): the ScdMesh holding the tally, and the prefix of its
+        flux tag names.
+    """
+    if tally_numbers is not None:
+        tally_numbers = [str(x) for x in tally_numbers]
+        select = lambda n, entry: entry['number'] in tally_numbers
+    else:
+        select = None
+    tallies = list(read_tallies(filename, select, workers, use_cache))
+    if tally_numbers is not None:
+        missing = set(tally_numbers) - set(t.number for t in tallies)
+        if missing:
+            raise MeshtalError('Tallies not found in {0}: {1}'.format(
+                               filename, ', '.join(sorted(missing))))
+
+    # Group the tallies by their bounds, so that tag names are settled
+    # before any tally is tagged.
+    by_bounds = OrderedDict()
+    for tally in tallies:
+        key = (tuple(tally.x_bounds), tuple(tally.y_bounds),
+               tuple(tally.z_bounds))
+        by_bounds.setdefault(key, []).append(tally)
+
+    prefixes = {}
+    meshes = {}
+    for key, group in by_bounds.iteritems():
+        sm = ScdMesh(*key)
+        for tally in group:
+            meshes[tally.number] = sm
+            if len(group) == 1:
+                prefixes[tally.number] = tally.particle
+            else:
+                prefixes[tally.number] = tally.particle + tally.number
+
+    result = OrderedDict()
+    for tally in tallies:
+        number = tally.number
+        if isinstance(norm, dict):
+            tally_norm = norm.get(number, 1.0)
+        else:
+            tally_norm = norm
+        print "\tTagging tally number {0}".format(number)
+        sm, prefix = meshes[number], prefixes[number]
+        tag_tally_info(tally, sm, prefix)
+        tag_fluxes(tally, sm, tally_norm, prefix, vector)
+        result[number] = (sm, prefix)
+
+    return result
 
 ###############################################################################
 
@@ -322,6 +372,27 @@ def main( arguments = None ) :
                             not spaces (eg. -n 1.1,2.2,3.3) ')
     parser.add_option('-m', dest='smesh_filename', default=None,
                       help='Preexisting mesh on which to tag fluxes')
+    parser.add_option('-j', dest='workers', type='int', default=1,
+                      help='Number of processes used to decode the energy\
+                            groups of each tally, default=%default')
+    parser.add_option('--cache', dest='use_cache', action='store_true',
+                      default=False,
+                      help='Load tallies from, and save them to, the tally\
+                            cache')
+    parser.add_option('--no-cache', dest='use_cache', action='store_false',
+                      help='Do not use the tally cache (the default)')
+    parser.add_option('--clear-cache', dest='clear_cache',
+                      action='store_true', default=False,
+                      help='Delete all cached tallies before reading')
+    parser.add_option('--cache-hash', dest='cache_hash', action='store_true',
+                      default=False,
+                      help='Include a hash of the meshtal contents in the\
+                            tally cache key')
+    parser.add_option('--vector-tags', dest='vector', action='store_true',
+                      default=False,
+                      help='Tag the fluxes and errors of all energy groups\
+                            as one vector tag each (e.g. n_groups and\
+                            n_groups_error) instead of one tag per group')
                          
 
     (opts, args) = parser.parse_args(arguments)
@@ -329,37 +400,57 @@ def main( arguments = None ) :
     #if len(args) != 2 :
      #   parser.error('\nNeed 1 argument: meshtal file')
     print "\n\nRunning read_meshtal.py"
-    tally_numbers, tally_lines = find_tallies(args[1])
-    print "Number of tallies found: {0}\nTally number(s): {1}" \
-                                     .format(len(tally_numbers), tally_numbers)
-
-    # Parse input from options parser, generate default values
-    if opts.norm :
-        norm = opts.norm.split(',')
-    else :
-        norm = [1]*len(tally_numbers)
-
-    if opts.mesh_output !='flux_mesh.h5m' :
+    if opts.clear_cache:
+        clear_cache()
+        print "Cleared tally cache in {0}".format(cache_dir())
+        if len(args) < 2:
+            return
+
+    # Parse input from options parser
+    norm = opts.norm.split(',') if opts.norm else None
+    if opts.mesh_output != 'flux_mesh.h5m':
         mesh_output = opts.mesh_output.split(',')
     else:
-        mesh_output = []
-        for n in range(0, len(tally_numbers)) :
-            if len(tally_numbers) == 1 :
-                mesh_output.append('flux_mesh.h5m')
-            else :
-                mesh_output.append('flux_mesh_tally{0}.h5m'.format(tally_numbers[n]))
-
-    # Convert each tally to h5m and name accordingly
-    for n in range(0,len(tally_numbers)) :
-        print "\nNow parsing tally number {0}".format(tally_numbers[n])
+        mesh_output = None
+
+    # Name each tally's output file before anything is written: the tally
+    # numbers are found from the meshtal's index (see meshtal.load_index()),
+    # without reading the tallies' data.
+    tally_numbers = find_tallies(args[1])[0]
+    if norm is not None and len(norm) < len(tally_numbers):
+        parser.error('A normalization factor is needed for each tally')
+    if mesh_output is not None:
+        if len(mesh_output) < len(tally_numbers):
+            parser.error('An output file name is needed for each tally')
+        outputs = mesh_output
+    elif len(tally_numbers) == 1:
+        outputs = ['flux_mesh.h5m']
+    else:
+        outputs = ['flux_mesh_tally{0}.h5m'.format(number)
+                   for number in tally_numbers]
+
+    # Convert each tally to h5m as it is read.  The meshtal file is read in
+    # a single pass (or through the cache, or with each tally's groups
+    # decoded in parallel; see meshtal.read_tallies())
+    digest = file_digest(args[1]) if opts.cache_hash else None
+    tallies = read_tallies(args[1], workers=opts.workers,
+                           use_cache=opts.use_cache, digest=digest)
+    for n, tally in enumerate(tallies) :
+        print "\nNow parsing tally number {0}".format(tally.number)
+        tally_norm = float(norm[n]) if norm is not None else 1.0
+        output = outputs[n]
+
         if opts.smesh_filename:
             alt_sm = ScdMesh.fromFile(opts.smesh_filename)
-            sm = read_meshtal(args[1], tally_lines[n], float(norm[n]), smesh=alt_sm)
+            sm = tally_to_scdmesh(tally, tally_norm, smesh=alt_sm,
+                                  vector=opts.vector)
         else:
-            sm = read_meshtal(args[1], tally_lines[n],float(norm[n]))
-        sm.scdset.save(mesh_output[n])
+            sm = tally_to_scdmesh(tally, tally_norm, vector=opts.vector)
+        sm.scdset.save(output)
 
-        print "\tSaved tally {0} as {1}".format(tally_numbers[n], mesh_output[n])
+        print "\tSaved tally {0} as {1}".format(tally.number, output)
+    print "\nNumber of tallies found: {0}\nTally number(s): {1}" \
+                                     .format(len(tally_numbers), tally_numbers)
     print "\nStructured mesh tagging complete\n\n"
 
 
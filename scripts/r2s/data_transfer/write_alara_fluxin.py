@@ -3,13 +3,19 @@
 """
 `write_alara_fluxin.py` is used to create a fluxin file for ALARA. Fluxes are
 taken from a MOAB mesh, with tag names of the form 'n_group_###' where ### is
-a 3 digit number with leading zeros as needed (e.g. 001).
+a 3 digit number with leading zeros as needed (e.g. 001), or from the vector
+tag 'n_groups' (see r2s.grouptags).
 """
 
 from optparse import OptionParser
 import sys
-from itaps import iMesh, iBase
-from r2s.scdmesh import ScdMesh
+try:
+    from itaps import iMesh, iBase
+except ImportError:
+    iMesh = iBase = None
+from r2s.scdmesh import ScdMesh, TagNotFoundError
+from r2s.arraymesh import ArrayScdMesh
+from r2s.grouptags import find_num_groups, get_group_values
 
 
 def get_flux_tag_handles(mesh):
@@ -61,24 +67,15 @@ def find_num_e_groups(sm):
     Parameters
     ----------
     sm - Scdmesh.scmesh object
-        Structured mesh object containing tags of the form 'n_group_###'.
+        Structured mesh object containing tags of the form 'n_group_###', or
+        the vector tag 'n_groups'.
 
     Returns
     -------
     num_e_groups - int
         Number of energy groups
     """    
-    num_e_groups = 0
-    for e_group in range(1,1000): #search for up to 1000 e_groups
-        
-        #Look for tags in the form n_group_'e_group'
-        try:
-            sm.imesh.getTagHandle('n_group_{0:03d}'.format(e_group))
-            num_e_groups += 1 #increment if tag is found
-
-       # Stop iterating once a tag is not found
-        except iBase.TagNotFoundError:
-            break
+    num_e_groups = find_num_groups(sm.imesh, 'n')
 
     if num_e_groups != 0:
         print 'Energy groups found: {0}'.format(num_e_groups)
@@ -91,7 +88,30 @@ def find_num_e_groups(sm):
     return num_e_groups
 
 
-def print_fluxes(mesh, num_e_groups, backward_bool, fluxin_name, tags=None):
+def _flux_blocks(mesh, num_e_groups, tags=None, slab_width=None):
+    """Yield blocks of voxels, with their fluxes, in the fluxin file's order
+
+    A structured mesh is read a slab of `slab_width` x planes at a time (all
+    at once if slab_width is None), in xyz order.  The voxels of a general
+    mesh are yielded in one block, with fluxes of None if tags were given.
+    """
+    if isinstance(mesh, ScdMesh):
+        for slab in mesh.iterateSlabs('x', slab_width):
+            yield slab.hexes, get_group_values(mesh.imesh, 'n', slab.hexes,
+                                               num_groups=num_e_groups)
+        return
+
+    voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
+    print "Got {0} voxels from mesh.".format(len(voxels))
+    if tags:
+        yield voxels, None
+    else:
+        yield voxels, get_group_values(mesh, 'n', voxels,
+                                       num_groups=num_e_groups)
+
+
+def print_fluxes(mesh, num_e_groups, backward_bool, fluxin_name, tags=None,
+                 slab_width=None):
     """Method writes tag values to ALARA fluxin format for the flux at each
     energy for each voxel
 
@@ -108,65 +128,63 @@ def print_fluxes(mesh, num_e_groups, backward_bool, fluxin_name, tags=None):
         Filename for output ALARA fluxin file
     tags : list of iMesh.Tag objects
         List of tag handles, sorted by tag name, from lowest energy to high
+    slab_width : int, optional
+        For a structured mesh, read the fluxes of this many x planes of
+        voxels at a time, rather than of the whole mesh at once.
     """
 
     output = open(fluxin_name, 'w')
 
-    # Get list of voxels, and set meshtype
+    # Set meshtype
     if isinstance(mesh, ScdMesh):
-        voxels = mesh.iterateHex('xyz')
         meshtype = 'scd'
     else:
-        voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
         meshtype = 'gen'
-        print "Got {0} voxels from mesh.".format(len(voxels))
 
     try:
         #Print fluxes for each voxel in xyz order (z changing fastest)
-        for voxel in voxels:
-            
-            #Establish for loop bounds based on if forward or backward printing
-            #is requested
-            if backward_bool == False:
-                min = 0
-                max = num_e_groups
-                direction = 1
-            else:
-                min = num_e_groups -1
-                max = -1
-                direction = -1
-            
-            #Print flux data to file
-            count=0
-            for e_group in range(min,max,direction):
-                #TODO: use try/except for catching missing tags
-                if tags and meshtype == 'gen': # general mesh with given tags
-                    output.write(str((tags[e_group])[voxel]) + " ")
-                elif meshtype == 'gen': # general mesh with assumed tags
-                    output.write(str(mesh.getTagHandle( \
-                            'n_group_{0:03d}'.format(e_group+1))[voxel]) + " ")
-                else: # structured mesh with assumed tags
-                    output.write(str(mesh.imesh.getTagHandle( \
-                            'n_group_{0:03d}'.format(e_group+1))[voxel]) + " ")
+        for voxels, fluxes in _flux_blocks(mesh, num_e_groups, tags,
+                                           slab_width):
+            for cnt, voxel in enumerate(voxels):
+                
+                #Establish for loop bounds based on if forward or backward
+                #printing is requested
+                if backward_bool == False:
+                    min = 0
+                    max = num_e_groups
+                    direction = 1
+                else:
+                    min = num_e_groups -1
+                    max = -1
+                    direction = -1
                 
-                #flux.in formatting: create a new line after every 8th entry
-                count += 1
-                if count % 8 == 0:
-                    output.write('\n')
-            output.write('\n\n')
+                #Print flux data to file
+                count=0
+                for e_group in range(min,max,direction):
+                    #TODO: use try/except for catching missing tags
+                    if tags and meshtype == 'gen': # general mesh, given tags
+                        output.write(str((tags[e_group])[voxel]) + " ")
+                    else: # mesh with assumed tags
+                        output.write(str(float(fluxes[cnt, e_group])) + " ")
+                    
+                    #flux.in formatting: new line after every 8th entry
+                    count += 1
+                    if count % 8 == 0:
+                        output.write('\n')
+                output.write('\n\n')
        
         print "flux.in file {0} sucessfully created".format(fluxin_name)
 
-    except iBase.TagNotFoundError:
+    except TagNotFoundError:
         if tags:
             print "Missing tag on mesh: {0}".format(tags[e_group].name)
         else:
-            print "Missing tag on mesh: n_group_{0:03d}".format(e_group+1)
+            print "Missing tags on mesh: n_group_### or n_groups"
 
     output.close()
 
 
-def write_alara_fluxin(filename, mesh, backwards=False):
+def write_alara_fluxin(filename, mesh, backwards=False, slab_width=None):
     """Load a MOAB mesh and create an alara_fluxin file from tags
     
     Parameters
@@ -178,6 +196,9 @@ def write_alara_fluxin(filename, mesh, backwards=False):
     backwards - boolean
         If true, prints fluxes from high energy to low energy. 
         Note that this should be true when working with the FENDL libraries.
+    slab_width - int, optional
+        For a structured mesh, read the fluxes of this many x planes of
+        voxels at a time; see print_fluxes().
     """
     if isinstance(mesh, ScdMesh):
         # Find number of energy groups
@@ -189,7 +210,8 @@ def write_alara_fluxin(filename, mesh, backwards=False):
         num_e_groups = len(fluxtaghandles)
 
     # Print flux.in file
-    print_fluxes(mesh, num_e_groups, backwards, filename, tags=fluxtaghandles)
+    print_fluxes(mesh, num_e_groups, backwards, filename, tags=fluxtaghandles,
+                 slab_width=slab_width)
 
 
 def main():
@@ -206,17 +228,27 @@ def main():
     parser.add_option('-o', dest='fluxin_name', default='ALARAflux.in',\
         help='Name of ALARA fluxin output file, default=%default')
 
+    parser.add_option('-s', '--slab-width', dest='slab_width', type='int',\
+        default=None, \
+        help='Read the fluxes of this many x planes of voxels at a time. ' \
+        'Default: the whole mesh at once')
+
     (opts, args) = parser.parse_args()
 
-    if len(args) != 2:
+    if len(args) != 1:
         parser.error\
         ( '\nNeed exactly 1 argument: structured mesh file' )
 
     # Load Structured mesh from file
-    sm = ScdMesh.fromFile(args[1])
+    if opts.slab_width is None:
+        sm = ScdMesh.fromFile(args[0])
+    else:
+        # Fluxes are read from the mesh file one slab at a time
+        sm = ArrayScdMesh.fromFile(args[0], tags=[])
 
-    write_alara_fluxin( opts.fluxin_name, sm, opts.backward_bool )
+    write_alara_fluxin( opts.fluxin_name, sm, opts.backward_bool,
+                        opts.slab_width )
 
 
 if __name__ == '__main__':
-    main(sys.argv)
+    main()
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
-import sys
 import re
 import operator
+from optparse import OptionParser
 
-from itaps import iBase, iMesh, iMeshExtensions
+try:
+    from itaps import iBase, iMesh
+except ImportError:
+    iBase = iMesh = None
 from r2s.scdmesh import ScdMesh
+from r2s.arraymesh import ArrayScdMesh
 from r2s.volumes import calc_volume
 
 
@@ -28,13 +32,32 @@ def _create_mixture_tuple(v):
     return tuple( [ round(x, 6) for x in v ] )
 
 
-def create_mixture_definitions(mesh):
+def _iter_mixtures(mesh, mat_tags, slab_width=None):
+    """Yield each voxel of a mesh with its mixture tuple
+
+    The voxels of a ScdMesh are yielded in xyz order, and their material
+    fractions are read a slab of `slab_width` x planes at a time (all at
+    once if slab_width is None); those of other meshes are read voxel by
+    voxel.
+    """
+    if isinstance(mesh, ScdMesh):
+        for slab in mesh.iterateSlabs('x', slab_width):
+            fracs = [list(t[slab.hexes]) for t in mat_tags]
+            for voxel, v in zip(slab.hexes, zip(*fracs)):
+                yield voxel, _create_mixture_tuple(v)
+    else:
+        for voxel in mesh.iterate(iBase.Type.region, iMesh.Topology.all):
+            yield voxel, _create_mixture_tuple([t[voxel] for t in mat_tags])
+
+
+def create_mixture_definitions(mesh, slab_width=None):
     """Return a list of unique materials tagged onto the mesh.
 
     unique_mixtures is a dictionary mapping mixture tuples (created through
-    _create_mixture_tuple) to lists.  The first element in the list is a
-    unique integer ID for the mixtures; the rest of the elements
-    are the hex handles that participate in that mixture.
+    _create_mixture_tuple) to unique integer IDs for the mixtures.  The
+    voxels of each mixture are not kept; write_mat_loading() reads the
+    mixtures of the voxels again, so that neither pass holds more than a
+    slab of voxels in memory.
 
     mat_tags is a list of the material tags from the input mesh.  This list
     is ordered in the same order as the mixture tuples.
@@ -43,6 +66,9 @@ def create_mixture_definitions(mesh):
     ----------
     mesh : ScdMesh object or iMesh.Mesh object
         Mesh object to read materials data from
+    slab_width : int, optional
+        For a ScdMesh, read the material fractions of this many x planes of
+        voxels at a time, rather than of the whole mesh at once.
 
     Returns
     -------
@@ -61,15 +87,16 @@ def create_mixture_definitions(mesh):
     if isinstance(mesh, ScdMesh):
         # The material tags are a subset of all the tags on a hex of the scdmesh
         # Pick the hex at minimum (i,j,k)
-        voxels = list(mesh.iterateHex('xyz'))
+        num_voxels = len(mesh.iterateHex('xyz'))
         tags = mesh.imesh.getAllTags( mesh.getHex( *(mesh.dims[:3]) ))
         void_tag = [mesh.imesh.getTagHandle('matVOID')]
     else:
         # Grab volume entities on mesh, then grab tags off the first one
         voxels = list(mesh.iterate(iBase.Type.region, iMesh.Topology.all))
+        num_voxels = len(voxels)
         tags = mesh.getAllTags(voxels[0])
         void_tag = [mesh.getTagHandle('matVOID')]
-        print "Got {0} voxels from mesh.".format(len(voxels))
+        print "Got {0} voxels from mesh.".format(num_voxels)
 
     # material tags have the name format 'mat{int}_rho{float}'
     mat_tags = [t for t in tags if \
@@ -79,22 +106,18 @@ def create_mixture_definitions(mesh):
             
     unique_mixtures = dict()
 
-    for voxel in voxels:
-        fracs = [t[voxel] for t in mat_tags]
-        mixture = _create_mixture_tuple(fracs)
+    for voxel, mixture in _iter_mixtures(mesh, mat_tags, slab_width):
         if mixture[0] == 1: # a void material
             continue
         if mixture not in unique_mixtures:
-            unique_mixtures[mixture] = [len(unique_mixtures), voxel]
-        else:
-            unique_mixtures[mixture].append(voxel)
+            unique_mixtures[mixture] = len(unique_mixtures)
 
     print "{0} unique mixtures in {1} voxels".format( \
-            len(unique_mixtures), len(voxels))
+            len(unique_mixtures), num_voxels)
     return (unique_mixtures, mat_tags)
 
 
-def write_zones(mesh, output_file):
+def write_zones(mesh, output_file, slab_width=None):
     """Write the volume and zone lines to the ALARA geometry output
 
     Parameters
@@ -103,14 +126,19 @@ def write_zones(mesh, output_file):
         Mesh object to read materials data from
     output_file : file object
         Opened file for writing contents of ALARA geometry 
+    slab_width : int, optional
+        See create_mixture_definitions().
     """
 
     output_file.write('geometry rectangular\n\n')
     output_file.write('volume\n')
     
     if isinstance(mesh, ScdMesh):
-        for idx, vol in enumerate(mesh.iterateHexVolumes('xyz')):
-            output_file.write("\t{0}\tzone_{1}\n".format(vol, idx))
+        idx = 0
+        for slab in mesh.iterateSlabs('x', slab_width):
+            for vol in slab.getVolumes():
+                output_file.write("\t{0}\tzone_{1}\n".format(vol, idx))
+                idx += 1
     else:
         for idx, voxel in enumerate( \
                 mesh.iterate(iBase.Type.region, iMesh.Topology.all)):
@@ -125,8 +153,8 @@ def write_mixtures(mixtures, mat_tags, name_dict, output_file):
 
     Parameters
     ----------
-    mixtures : ???
-        ...
+    mixtures : dictionary
+        Mixture IDs of mixture tuples; see create_mixture_definitions().
     mat_tags : list of iMesh.Tag entities
         ...
     name_dict : dictionary (optional?)
@@ -134,10 +162,9 @@ def write_mixtures(mixtures, mat_tags, name_dict, output_file):
     output_file : file object
         Opened file for writing contents of ALARA geometry 
     """
-    for mixture, voxels in sorted( mixtures.iteritems(), 
+    for mixture, mix_id in sorted( mixtures.iteritems(), 
                                    key=operator.itemgetter(1,0) ):
-        # voxels[0] is the unique mixture ID
-        output_file.write("mixture\tmix_{0}\n".format(voxels[0]))
+        output_file.write("mixture\tmix_{0}\n".format(mix_id))
         for idx, m in enumerate(mixture[1:], start=1):
             if m == 0: continue 
             material_name = mat_tags[idx].name
@@ -152,7 +179,8 @@ def write_mixtures(mixtures, mat_tags, name_dict, output_file):
             "mixture pseudo_void\n\tmaterial\tpseudo_void\t1\t1\nend\n\n")
 
 
-def write_mat_loading(mesh, mat_tags, mixtures, output_file):
+def write_mat_loading(mesh, mat_tags, mixtures, output_file,
+                      slab_width=None):
     """Write the mat_loading information to the ALARA geometry output
 
     Parameters
@@ -165,28 +193,23 @@ def write_mat_loading(mesh, mat_tags, mixtures, output_file):
         ...
     output_file : file object
         Opened file for writing contents of ALARA geometry 
+    slab_width : int, optional
+        See create_mixture_definitions().
     """
 
     output_file.write('mat_loading\n')
 
-    # Get correct iterator
-    if isinstance(mesh, ScdMesh):
-        voxels_iterator = mesh.iterateHex('xyz')
-    else:
-        voxels_iterator = mesh.iterate(iBase.Type.region, iMesh.Topology.all)
-
-    for idx, voxel in enumerate(voxels_iterator):
-        fracs = [t[voxel] for t in mat_tags]
-        mixture = _create_mixture_tuple(fracs)
+    for idx, (voxel, mixture) in enumerate(
+            _iter_mixtures(mesh, mat_tags, slab_width)):
         if mixture[0] == 1: # a void material
             output_file.write('\tzone_{0}\tpseudo_void\n'.format(idx))
         else:
-            mix_id = mixtures[mixture][0]
+            mix_id = mixtures[mixture]
             output_file.write('\tzone_{0}\tmix_{1}\n'.format(idx,mix_id))
     output_file.write('end\n\n')
 
 
-def write_alara_geom(filename, mesh, namedict={}):
+def write_alara_geom(filename, mesh, namedict={}, slab_width=None):
     """Given a mesh with mmgrid tags, write an ALARA geometry file
     
     Parameters
@@ -197,20 +220,37 @@ def write_alara_geom(filename, mesh, namedict={}):
         Mesh object containing materials tags
     namedict : dictionary (optional)
         Dictionary of names for material compositions
+    slab_width : int (optional)
+        For a ScdMesh, read the material fractions of this many x planes of
+        voxels at a time, rather than of the whole mesh at once.
     """
-    mixtures, mat_tags = create_mixture_definitions(mesh)
+    mixtures, mat_tags = create_mixture_definitions(mesh, slab_width)
 
     with open(filename,'w') as output_file:
-        write_zones(mesh, output_file)
+        write_zones(mesh, output_file, slab_width)
         write_mixtures(mixtures, mat_tags, namedict, output_file)
-        write_mat_loading(mesh, mat_tags, mixtures, output_file)
+        write_mat_loading(mesh, mat_tags, mixtures, output_file, slab_width)
 
 
 def main():
 
+    parser = OptionParser(usage='%prog <structured mesh> [options]')
+    parser.add_option('-s', '--slab-width', dest='slab_width', type='int',
+                      default=None,
+                      help='Read the material fractions of this many x planes '
+                      'of voxels at a time, default: the whole mesh at once')
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('Need exactly 1 argument: structured mesh file')
+
     # TODO: How to handle non-structured meshes from the command line...
-    mesh = ScdMesh.fromFile(sys.argv[1])
-    write_alara_geom("alara_geom", mesh)
+    if opts.slab_width is None:
+        mesh = ScdMesh.fromFile(args[0])
+    else:
+        # Tag values are read from the mesh file one slab at a time
+        mesh = ArrayScdMesh.fromFile(args[0], tags=[])
+    write_alara_geom("alara_geom", mesh, slab_width=opts.slab_width)
 
 
 if __name__ == '__main__':
@@ -14,41 +14,59 @@
 import os.path
 from datetime import datetime
 from optparse import OptionParser
-from itaps import iBase,iMesh,iMeshExtensions
 
-from r2s.scdmesh import ScdMesh, ScdMeshError
-from r2s.volumes import calc_volume
+import numpy as np
+try:
+    from itaps import iBase, iMesh
+except ImportError:
+    iBase = iMesh = None
 
-def calc_total_source_strength(mesh, voxels, tag_srcsum=False, **kwargs):
-    """
-    """
+from r2s.scdmesh import ScdMesh, ScdMeshError, TagNotFoundError, \
+        TagAlreadyExistsError
+from r2s.arraymesh import ArrayScdMesh, ArrayTags
+from r2s.volumes import calc_volume
+from r2s.grouptags import get_group_values
 
-    try:
-        grouptag = mesh.getTagHandle("phtn_src_group_001")
-    except iBase.TagNotFoundError, e:
-        print "ERROR: The structured mesh does not contain tags of the " \
-                "form 'phtn_src_group_#.'"
-        raise e
+def calc_total_source_strength(mesh, voxels=None, tag_srcsum=False,
+                               slab_width=None, coolingstep=None,
+                               isotope=None):
+    """Sum the photon source strengths of the voxels of a mesh
 
-    # Initialize list to first erg bin source strength value for each voxel
-    meshstrengths = [float(grouptag[x]) for x in voxels]
+    The source strengths are read from tags of either the form
+    'phtn_src_group_###' or the vector tag 'phtn_src_groups' (see
+    r2s.grouptags).
 
-    numergbins = 0
+    mesh is either a ScdMesh, all of whose hexes are summed, or an iMesh
+    instance (or the ArrayTags of an ArrayScdMesh), of which the voxels
+    given are summed (all regions if voxels is None).  For a ScdMesh, the
+    source strengths are read for slab_width planes of hexes normal to x at
+    a time (all at once if slab_width is None), and the voxel volumes are
+    taken from its volume array; voxels may not be given.  For other
+    meshes, slab_width may not be given.
 
-    # We now go through all photon energy groups and sum the individual bins
-    #  to get the total source strength in each voxel
-    for i in xrange(2,1000): #~ Arbitrary: we look for up to 1000 groups
-        try:
-            grouptag = mesh.getTagHandle("phtn_src_group_{0:03d}".format(i))
-            for cnt, vox in enumerate(voxels):
-                meshstrengths[cnt] += float(grouptag[vox])
-        except iBase.TagNotFoundError: 
-            numergbins = i - 1
-            break
-    
-    print "Found tags for {0} photon energy bins.".format(numergbins)
+    If given, coolingstep and isotope label the line appended to the file
+    'phtn_src_total'.
 
-    vols = [calc_volume(mesh, voxel) for voxel in voxels]
+    Returns
+    -------
+    sumvoxelsourcestrengths, sourcevolumetotal, numergbins, vols
+        vols is the list of voxel volumes, in the order of the voxels (xyz
+        order for a ScdMesh), or None if a slab_width was given.
+    """
+    if isinstance(mesh, ScdMesh):
+        if voxels is not None:
+            raise ValueError('Voxels cannot be given with a ScdMesh')
+        imesh = mesh.imesh
+        blocks = ((slab.hexes, slab.getVolumes().tolist())
+                  for slab in mesh.iterateSlabs('x', slab_width))
+    else:
+        if slab_width is not None:
+            raise ValueError('A slab width can only be given with a ScdMesh')
+        if voxels is None:
+            voxels = mesh.iterate(iBase.Type.region, iMesh.Topology.all)
+        voxels = list(voxels)
+        imesh = mesh
+        blocks = [(voxels, _voxel_volumes(mesh, voxels))]
 
     # We calculate the normalization factor as the sum over all voxels of:
     #  voxel volumetric source strength * voxel volume
@@ -57,30 +75,66 @@ def calc_total_source_strength(mesh, voxels, tag_srcsum=False, **kwargs):
     numactivatedcells = 0 # number of voxels that have nonzero source strength
     sumvoxelsourcestrengths = 0 # total photon source strength in entire model
     sourcevolumetotal = 0 # total activated volume in model
-    for cnt, meshstr in enumerate(meshstrengths):
-        if meshstr > 0:
-            numactivatedcells += 1
-            sumvoxelsourcestrengths += vols[cnt] * meshstr
-            sourcevolumetotal += vols[cnt]
+    numergbins = None
+    for block, vols in blocks:
+        try:
+            srcvalues = get_group_values(imesh, "phtn_src", block,
+                                         num_groups=numergbins)
+        except TagNotFoundError, e:
+            print "ERROR: The structured mesh does not contain tags of the " \
+                    "form 'phtn_src_group_#.'"
+            raise e
+
+        numergbins = srcvalues.shape[1]
+
+        # We now go through all photon energy groups and sum the individual
+        #  bins to get the total source strength in each voxel
+        meshstrengths = srcvalues[:, 0].copy()
+        for i in xrange(1, numergbins):
+            meshstrengths += srcvalues[:, i]
+        meshstrengths = meshstrengths.tolist()
+
+        for cnt, meshstr in enumerate(meshstrengths):
+            if meshstr > 0:
+                numactivatedcells += 1
+                sumvoxelsourcestrengths += vols[cnt] * meshstr
+                sourcevolumetotal += vols[cnt]
+
+    print "Found tags for {0} photon energy bins.".format(numergbins)
+    if slab_width is not None:
+        vols = None
 
     if tag_srcsum:
-        _tag_sumvoxelstrengths(mesh, sumvoxelsourcestrengths)
+        _tag_sumvoxelstrengths(imesh, sumvoxelsourcestrengths)
 
     # Create 'phtn_src_total' file with label of cooling time and isotope
     problemstring = ""
-    if 'coolingstep' in kwargs:
-        problemstring += " Cooling time: {0}".format(kwargs['coolingstep'])
-    if 'isotope' in kwargs:
-        problemstring += " Source isotope: {0}".format(kwargs['isotope'])
+    if coolingstep is not None:
+        problemstring += " Cooling time: {0}".format(coolingstep)
+    if isotope is not None:
+        problemstring += " Source isotope: {0}".format(isotope)
     os.system("echo {0:03e} {1} >> phtn_src_total".format( \
             sumvoxelsourcestrengths, problemstring))
 
     return sumvoxelsourcestrengths, sourcevolumetotal, numergbins, vols
 
 
+def _voxel_volumes(mesh, voxels):
+    """Return a list of the volumes of some voxels of an unstructured mesh
+
+    mesh is the iMesh instance holding the voxels, or the ArrayTags of an
+    ArrayScdMesh, whose voxels are positions in its zyx-ordered hex array;
+    their volumes are then taken from the mesh's volume array.
+    """
+    if isinstance(mesh, ArrayTags):
+        volumes = mesh.mesh.getHexVolumeArray('zyx').ravel()
+        return volumes[np.asarray(voxels, dtype=int)].tolist()
+    return [calc_volume(mesh, voxel) for voxel in voxels]
+
+
 def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
         do_bias=False, cumulative=False, cust_ergbins=False, \
-        resample=False, uni_resamp_all=False, **kwargs):
+        resample=False, uni_resamp_all=False, slab_width=None, **kwargs):
     """Generate gammas file using information from tags on a MOAB Scd mesh.
     
     Method reads tags with photon source strengths from a structured mesh object
@@ -109,6 +163,10 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
         regions of voxels, during uniform sampling, are resampled over the
         entire problem, rather than resampling just the voxel.  This has the
         potential to result in an unfair game.
+    slab_width : int, optional
+        If given, source strengths are read for this many x planes of voxels
+        at a time (see ScdMesh.iterateSlabs()), rather than for the whole
+        mesh at once.
     keyword arguments
         Currently valid: {'title', 'isotope', 'coolingstep'} 
         These are passed to header creation code.
@@ -116,16 +174,14 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
     Notes
     -----
     Requires that the structured mesh has photon source strength tags of the
-    form 'phtn_src_group_###'.
+    form 'phtn_src_group_###', or the vector tag 'phtn_src_groups'.
 
     Will read photon energy bin boundary values if the root set has the tag 
     'PHTN_ERG' (a list of floats).
     """
 
-    voxels = list(sm.iterateHex('xyz'))
-
     sumvoxelstrengths, sourcevolumetotal, numergbins, vols = \
-            calc_total_source_strength(sm.imesh, voxels)
+            calc_total_source_strength(sm, slab_width=slab_width)
 
     # norm is the average volumetric source strength (phtns/s/cm3)
     try:
@@ -142,7 +198,7 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
                     "tag.".format(len(myergbins)-1)
 
         # if there is no PHTN_ERGS tag, then send an empty string in myergbins
-        except iBase.TagNotFoundError: 
+        except TagNotFoundError: 
             print "Could not find PHTN_ERGS tag with custom energy bins."
             myergbins = "" # _gen_gammas_header will skip the energies line
     else: myergbins = ""
@@ -157,7 +213,7 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
             print "Found tags for biasing photon production based on source " \
                     "voxel."
 
-        except iBase.TagNotFoundError:
+        except TagNotFoundError:
             print "The option for biasing photon production was chosen, "\
                     "but corresponding tags were not found on the mesh."
             have_bias_info = False
@@ -170,52 +226,65 @@ def gen_gammas_file_from_h5m(sm, outfile="gammas", sampling='v', \
     fw = _gen_gammas_header(sm, outfile, sampling, myergbins, have_bias_info, \
             cumulative, resample, uni_resamp_all, **kwargs)
 
-    for cnt, voxel in enumerate(voxels):
-        sourcetotal = 0
-        ergproblist = list()
-        # We go through each energy group for the voxel and:
-        # -make list of energy bin source strengths & group #s (ergproblist)
-        # -sum up the total source strength (sourcetotal)
-        #
-        # Note an important distinction depending on sampling approach:
-        # -We account for voxel volume in voxel sampling
-        # -We do not do this for uniform sampling, because it is already
-        #   accounted for - more particles start in a voxel if it is larger
-        # How to think of this difference: for correct 'normalization' in the 
-        #  sampling process, we want photons/s/voxel for voxel sampling, and 
-        #  photons/s/volume for uniform sampling.
-        for i in xrange(1, numergbins + 1):
-            if sampling == 'v':
-                ergproblist.append(float(vols[cnt] * sm.imesh.getTagHandle( \
-                        "phtn_src_group_{0:03d}".format(i))[voxel]) / norm)
-            elif sampling == 'u':
-                ergproblist.append(float(sm.imesh.getTagHandle( \
-                        "phtn_src_group_{0:03d}".format(i))[voxel]) / norm)
-
-            sourcetotal += ergproblist[i-1]
-            if cumulative: ergproblist[i-1] = sourcetotal
-
-        if have_bias_info:
-            bias = str(bias_tag[voxel]) + " "
-        else: bias = ""
-
-        # Special case if there is no source strength: write line full of 0's
-        if sourcetotal == 0:
-            fw.write(" ".join( \
-                    ["0"]*(numergbins + int(bool(have_bias_info))) ) \
-                    + "\n")
-                    # int(bool()) ensures either 1 or 0 is added
-            continue
+    # Source strengths are read for all voxels at once, or a slab at a time
+    if slab_width is None:
+        blocks = [(sm.iterateHex('xyz'), vols)]
+    else:
+        blocks = ((slab.hexes, slab.getVolumes().tolist())
+                  for slab in sm.iterateSlabs('x', slab_width))
 
+    for voxels, vols in blocks:
+        srcvalues = get_group_values(sm.imesh, "phtn_src", voxels, \
+                num_groups=numergbins)
         if have_bias_info:
-            bias = " " + str(bias_tag[voxel])
-        else: bias = ""
-
-        # Regular case:
-        # We write the list of properly normalized probabilities for the voxel
-        #  to a line.
-        fw.write(" ".join(["{0:<12.5E}".format(x) for x in ergproblist]) + \
-                bias + "\n")
+            biases = bias_tag[voxels]
+
+        for cnt, voxel in enumerate(voxels):
+            sourcetotal = 0
+            ergproblist = list()
+            # We go through each energy group for the voxel and:
+            # -make list of energy bin source strengths & group #s
+            #  (ergproblist)
+            # -sum up the total source strength (sourcetotal)
+            #
+            # Note an important distinction depending on sampling approach:
+            # -We account for voxel volume in voxel sampling
+            # -We do not do this for uniform sampling, because it is already
+            #   accounted for - more particles start in a voxel if it is larger
+            # How to think of this difference: for correct 'normalization' in
+            #  the sampling process, we want photons/s/voxel for voxel
+            #  sampling, and photons/s/volume for uniform sampling.
+            for i in xrange(1, numergbins + 1):
+                if sampling == 'v':
+                    ergproblist.append(float(vols[cnt] * \
+                            srcvalues[cnt, i-1]) / norm)
+                elif sampling == 'u':
+                    ergproblist.append(float(srcvalues[cnt, i-1]) / norm)
+
+                sourcetotal += ergproblist[i-1]
+                if cumulative: ergproblist[i-1] = sourcetotal
+
+            if have_bias_info:
+                bias = str(biases[cnt]) + " "
+            else: bias = ""
+
+            # Special case if there is no source strength: write line of 0's
+            if sourcetotal == 0:
+                fw.write(" ".join( \
+                        ["0"]*(numergbins + int(bool(have_bias_info))) ) \
+                        + "\n")
+                        # int(bool()) ensures either 1 or 0 is added
+                continue
+
+            if have_bias_info:
+                bias = " " + str(biases[cnt])
+            else: bias = ""
+
+            # Regular case:
+            # We write the list of properly normalized probabilities for the
+            #  voxel to a line.
+            fw.write(" ".join(["{0:<12.5E}".format(x) for x in ergproblist]) \
+                    + bias + "\n")
 
     fw.close()
 
@@ -315,7 +384,7 @@ def _gen_gammas_header(sm, outfile, sampling, ergbins, biasing, cumulative, \
 
 
 def calc_sm_volumes_list(sm):
-    """Create a 1D list of the voxel volumes for a XYZ structured mesh
+    """Create a 1D array of the voxel volumes for a XYZ structured mesh
     
     Parameters
     ----------
@@ -324,8 +393,8 @@ def calc_sm_volumes_list(sm):
 
     Returns
     -------
-    vols : list of floats
-        A 1D list of voxel volumes in order 'xyz'
+    vols : 1D array of floats
+        A read-only view of the mesh's voxel volumes in order 'xyz'
 
     Notes
     -----
@@ -334,35 +403,7 @@ def calc_sm_volumes_list(sm):
          -for x iterate y
          -iterate x
     """
-    
-    meshplanes = [ sm.getDivisions('x'),
-                   sm.getDivisions('y'),
-                   sm.getDivisions('z') ]
-
-    oldz = meshplanes[2][0]
-    oldy = meshplanes[1][0]
-    oldx = meshplanes[0][0]
-
-    nxdiv = len(meshplanes[0]) - 1
-    nydiv = len(meshplanes[1]) - 1
-    nzdiv = len(meshplanes[2]) - 1
-
-    # create 1D list
-    vols = [0] * (nxdiv * nydiv * nzdiv)
-
-    for cntx, x in enumerate(meshplanes[0][1:]):
-        oldy = meshplanes[1][0]
-        for cnty, y in enumerate(meshplanes[1][1:]):
-            oldz = meshplanes[2][0]
-            for cntz, z in enumerate(meshplanes[2][1:]):
-                # Calc volume here
-                vols[nydiv*nzdiv*cntx + nzdiv*cnty + cntz] = \
-                        (x - oldx) * (y - oldy) * (z - oldz)
-                oldz = z
-            oldy = y
-        oldx = x
-    
-    return vols
+    return sm.getHexVolumeArray('xyz').ravel()
 
 
 def _tag_sumvoxelstrengths(mesh, val):
@@ -371,7 +412,7 @@ def _tag_sumvoxelstrengths(mesh, val):
     # Get the Tag handle called PHTN_SRC_TOTAL
     try:
         tag = mesh.createTag("PHTN_SRC_TOTAL",1,"d")
-    except iBase.TagAlreadyExistsError:
+    except TagAlreadyExistsError:
         tag = mesh.getTagHandle("PHTN_SRC_TOTAL")
 
     tag[mesh.rootSet] = val
@@ -396,14 +437,23 @@ def main():
     parser.add_option("-o","--output",action="store",dest="output", \
             default="gammas",help="Option specifies the name of the 'gammas'" \
             "file. Default: %default")
+    parser.add_option("-s","--slab-width",action="store",type="int", \
+            dest="slab_width",default=None,help="Option reads source " \
+            "strengths for this many x planes of voxels at a time, rather " \
+            "than for the whole mesh at once.")
     #
    
     (options, args) = parser.parse_args()
 
-    # Create ScdMesh object, which also loads 'meshfile' into mesh.
-    sm = ScdMesh.fromFile(args[0])
+    if options.slab_width is None:
+        # Create ScdMesh object, which also loads 'meshfile' into mesh.
+        sm = ScdMesh.fromFile(args[0])
+    else:
+        # Tag values are read from 'meshfile' one slab at a time
+        sm = ArrayScdMesh.fromFile(args[0], tags=[])
 
-    gen_gammas_file_from_h5m(sm, options.output)
+    gen_gammas_file_from_h5m(sm, options.output, \
+            slab_width=options.slab_width)
 
     return 1
 
@@ -0,0 +1,72 @@
+"""Module opens text input files that may be gzip, bzip2 or xz compressed.
+
+Compressed files are decompressed as a stream while they are read, so no
+uncompressed copy of the file is ever written.  The compression format is
+determined from the file name's extension: '.gz', '.bz2' or '.xz'.
+"""
+
+import bz2
+import gzip
+import os
+
+# xz support is in the standard library from Python 3.3; Python 2 needs the
+# backports.lzma package.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+class FileIOError(Exception):
+    pass
+
+
+_COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+
+
+def is_compressed(filename):
+    """Return True if filename has the extension of a compressed file
+
+    Parameters
+    ----------
+    filename : string
+        Path to a file.
+    """
+    return os.path.splitext(filename)[1].lower() in _COMPRESSED_EXTENSIONS
+
+
+def open_file(filename, mode='rb'):
+    """Open a file for reading, decompressing it if necessary
+
+    Files ending in '.gz', '.bz2' or '.xz' are opened with the gzip, bz2 or
+    lzma modules; anything else is opened with the builtin open().  The
+    returned object supports iteration, readline(), tell() and seek(),
+    though seeking backwards in a compressed file means decompressing it
+    again from the beginning.
+
+    Parameters
+    ----------
+    filename : string
+        Path to the file to open.
+    mode : string, optional
+        Mode to open the file with; 'rb' by default.
+
+    Returns
+    -------
+    f : file-like object
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.gz':
+        return gzip.open(filename, mode)
+    elif ext == '.bz2':
+        return bz2.BZ2File(filename, mode)
+    elif ext == '.xz':
+        if lzma is None:
+            raise FileIOError("Reading the xz compressed file '{0}' " \
+                    "requires the lzma module (the backports.lzma package " \
+                    "for Python 2).".format(filename))
+        return lzma.LZMAFile(filename, mode)
+    return open(filename, mode)
@@ -0,0 +1,192 @@
+"""Module reads and writes energy group values (e.g. fluxes or photon source
+strengths) tagged on the voxels of a mesh.
+
+Group values can be stored in one of two layouts:
+
+- scalar: one tag per energy group, named prefix_group_### (e.g.
+  n_group_001 ... n_group_175), with ### counting from 001.
+- vector: a single tag of one value per group, named prefix_groups (e.g.
+  n_groups, holding 175 values on each voxel).
+
+Related tags add a suffix after the group number or the vector tag name,
+e.g. n_group_001_error and n_groups_error.  When group values are written,
+the number of groups is also tagged on the mesh's root set, as
+prefix_num_groups, so that readers need not search for tags.  The functions
+reading group values work with either layout.
+"""
+
+import numpy as np
+from r2s.scdmesh import TagNotFoundError, TagAlreadyExistsError
+
+
+class GroupTagError(Exception):
+    pass
+
+
+def group_tag_name(prefix, group, suffix=''):
+    """Return the name of the scalar tag for one energy group
+
+    Parameters
+    ----------
+    prefix : string
+        Tag name prefix, e.g. 'n' or 'phtn_src'.
+    group : int
+        Energy group number, counting from 1.
+    suffix : string, optional
+        Suffix for related tags, e.g. '_error'.
+    """
+    return '{0}_group_{1:03d}{2}'.format(prefix, group, suffix)
+
+
+def vector_tag_name(prefix, suffix=''):
+    """Return the name of the vector tag holding all energy groups"""
+    return '{0}_groups{1}'.format(prefix, suffix)
+
+
+def num_groups_tag_name(prefix):
+    """Return the name of the root set tag holding the number of groups"""
+    return '{0}_num_groups'.format(prefix)
+
+
+def find_num_groups(imesh, prefix, max_groups=1000):
+    """Return the number of energy groups tagged with a given prefix
+
+    The number is read from the prefix_num_groups tag if the mesh has it;
+    otherwise from the size of a vector tag, or by looking for scalar tags
+    prefix_group_001, prefix_group_002, etc.
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh holding the tags.
+    prefix : string
+        Tag name prefix, e.g. 'n' or 'phtn_src'.
+    max_groups : int, optional
+        Largest number of scalar tags to look for.
+
+    Returns
+    -------
+    num_groups : int
+        The number of groups; 0 if no group tags were found.
+    """
+    try:
+        return int(imesh.getTagHandle(num_groups_tag_name(prefix))
+                   [imesh.rootSet])
+    except TagNotFoundError:
+        pass
+
+    try:
+        return imesh.getTagHandle(vector_tag_name(prefix)).sizeValues
+    except TagNotFoundError:
+        pass
+
+    num_groups = 0
+    for group in xrange(1, max_groups + 1):
+        try:
+            imesh.getTagHandle(group_tag_name(prefix, group))
+        except TagNotFoundError:
+            break
+        num_groups = group
+    return num_groups
+
+
+def get_group_values(imesh, prefix, voxels, suffix='', num_groups=None):
+    """Return the values of all energy groups on a list of voxels
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh holding the tags.
+    prefix : string
+        Tag name prefix, e.g. 'n' or 'phtn_src'.
+    voxels : sequence of iBase.Entity handles
+        Voxels to get values for.
+    suffix : string, optional
+        Suffix of related tags to read instead, e.g. '_error'.
+    num_groups : int, optional
+        Number of groups; found with find_num_groups() if not given.
+
+    Returns
+    -------
+    values : array of shape (len(voxels), num_groups)
+
+    Raises
+    ------
+    TagNotFoundError
+        If the mesh has neither a vector tag nor scalar tags for the groups,
+        or the voxels are not all tagged.
+    """
+    if num_groups is None:
+        num_groups = find_num_groups(imesh, prefix)
+
+    try:
+        tag = imesh.getTagHandle(vector_tag_name(prefix, suffix))
+    except TagNotFoundError:
+        tag = None
+
+    if tag is not None:
+        values = np.asarray(tag[voxels], dtype=float)
+        return values.reshape(len(voxels), -1)[:, :num_groups]
+
+    if num_groups == 0:
+        raise TagNotFoundError('No tags found for energy groups of ' \
+                '{0}'.format(vector_tag_name(prefix, suffix)))
+    values = np.empty((len(voxels), num_groups))
+    for group in xrange(num_groups):
+        tag = imesh.getTagHandle(group_tag_name(prefix, group + 1, suffix))
+        values[:, group] = tag[voxels]
+    return values
+
+
+def set_group_values(imesh, prefix, voxels, values, vector=False, suffix=''):
+    """Tag the values of all energy groups on a list of voxels
+
+    Tags are created as needed.  An existing vector tag is replaced, since
+    its number of values is fixed.  The number of groups is tagged on the
+    root set.
+
+    Parameters
+    ----------
+    imesh : iMesh.Mesh object
+        Mesh to tag.
+    prefix : string
+        Tag name prefix, e.g. 'n' or 'phtn_src'.
+    voxels : sequence of iBase.Entity handles
+        Voxels to tag.
+    values : array_like of shape (len(voxels), num_groups)
+        Values to tag.
+    vector : boolean, optional
+        If True, use a single vector tag; otherwise one tag per group.
+    suffix : string, optional
+        Suffix of related tags to write instead, e.g. '_error'.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim != 2 or values.shape[0] != len(voxels):
+        raise GroupTagError('Group values of shape {0} do not match {1} ' \
+                'voxels'.format(values.shape, len(voxels)))
+    num_groups = values.shape[1]
+
+    if vector:
+        name = vector_tag_name(prefix, suffix)
+        try:
+            imesh.destroyTag(imesh.getTagHandle(name), force=True)
+        except TagNotFoundError:
+            pass
+        tag = imesh.createTag(name, num_groups, float)
+        tag[voxels] = values
+    else:
+        for group in xrange(num_groups):
+            tag = _get_tag(imesh, group_tag_name(prefix, group + 1, suffix),
+                           1, float)
+            tag[voxels] = values[:, group]
+
+    tag = _get_tag(imesh, num_groups_tag_name(prefix), 1, int)
+    tag[imesh.rootSet] = num_groups
+
+
+def _get_tag(imesh, name, size, tag_type):
+    """Return the tag `name` on imesh, creating it if necessary"""
+    try:
+        return imesh.createTag(name, size, tag_type)
+    except TagAlreadyExistsError:
+        return imesh.getTagHandle(name)
@@ -0,0 +1,436 @@
+"""Module reads and writes the tags of a structured mesh in a MOAB .h5m file
+directly, with h5py, one tag at a time.
+
+Loading an .h5m file with PyTAPS reads every tag in the file into memory.
+H5mFile instead reads the geometry of the file's structured mesh, and leaves
+the tags on disk until they are asked for.  Tags written with H5mFile replace
+those in the file, and other tags are left as they are.
+
+The MOAB HDF5 layout used here is (names under /tstt):
+
+- nodes/coordinates: vertex coordinates, with a start_id attribute
+- elements/Hex8/connectivity: the vertex ids of each hex
+- elements/Hex8/tags/NAME: values of tag NAME on every hex, in file order
+- sets/list: entity sets; sets/tags/NAME: values of NAME on every set
+- tags/NAME: definition of tag NAME, with its committed data type ('type'),
+  its value on the root set (attribute 'global'), and its values on other
+  entities (datasets 'id_list' and 'values').
+
+h5py is optional; without it, H5mFile raises H5mFileError.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from r2s.scdmesh import TagNotFoundError
+
+
+class H5mFileError(Exception):
+    pass
+
+
+# The values of a tag on the hexes and sets of a structured mesh.  hexes holds
+# the values of all hexes in the canonical (zyx) order of the mesh, of which
+# those flagged in isset are set; root and scdset are the values on the root
+# set and the structured mesh set, or None.
+tag_data = namedtuple('tag_data',
+                      ('type', 'size', 'hexes', 'isset', 'root', 'scdset'))
+
+# MOAB's storage classes for tags: tags written with values on every hex are
+# dense (MB_TAG_DENSE), others sparse (MB_TAG_SPARSE)
+_SPARSE = 1
+_DENSE = 2
+
+
+class H5mFile(object):
+    """A structured mesh in a MOAB .h5m file
+
+    The file must hold a single structured mesh (one set with the BOX_DIMS
+    tag), whose vertices and hexes are all the vertices and hexes in the
+    file.
+
+    Public member variables::
+
+        self.filename -- path of the .h5m file
+        self.dims -- the BOX_DIMS of the structured mesh
+        self.divisions -- arrays of the mesh divisions along x, y and z
+
+    The ids of the entities with sparse values of each tag are read once,
+    and cached, so that the values of a few hexes are found without
+    reading all of a tag's sparse values.
+    """
+
+    def __init__(self, filename):
+        """Read the geometry of the structured mesh in an .h5m file
+
+        Raises H5mFileError if h5py is not available or the file cannot be
+        read.
+        """
+        if h5py is None:
+            raise H5mFileError('h5py is needed to read .h5m files directly')
+        self.filename = filename
+        self._sparse = {}
+        try:
+            with h5py.File(filename, 'r') as f:
+                self._read_layout(f)
+        except (IOError, KeyError) as e:
+            raise H5mFileError('Cannot read structured mesh from ' \
+                    '{0}: {1}'.format(filename, e))
+
+    def _read_layout(self, f):
+        """Read the vertices, hexes and structured mesh set in file f"""
+        self.set_start = f['tstt/sets/list'].attrs['start_id']
+        boxes = self._read_set_values(f, 'BOX_DIMS')
+        if len(boxes) != 1:
+            raise H5mFileError('{0} holds {1} structured meshes, ' \
+                    'not one'.format(self.filename, len(boxes)))
+        self.scdset_id, dims = boxes.popitem()
+        self.dims = [int(x) for x in dims]
+        shape = [self.dims[n + 3] - self.dims[n] for n in xrange(3)]
+        self.num_hexes = np.prod(shape)
+
+        coords = f['tstt/nodes/coordinates']
+        conn = f['tstt/elements/Hex8/connectivity']
+        self.hex_start = conn.attrs['start_id']
+        if not self._read_canonical_layout(coords, conn, shape):
+            self._read_any_layout(coords, conn, shape)
+
+    def _read_canonical_layout(self, coords, conn, shape):
+        """Read the layout of a file whose vertices and hexes are in canonical
+        order, as MOAB writes a structured mesh, or return False if they are
+        not
+
+        Only the vertices along the edges of the mesh and the first vertex
+        of each hex are read.
+        """
+        vshape = [n + 1 for n in shape]
+        if coords.shape[0] != np.prod(vshape) or \
+                conn.shape[0] != self.num_hexes:
+            return False
+        node_start = coords.attrs['start_id']
+        strides = [1, vshape[0], vshape[0] * vshape[1]]
+        divisions = [coords[0:strides[n] * vshape[n]:strides[n], n]
+                     for n in xrange(3)]
+        if not all((np.diff(divs) > 0).all() for divs in divisions):
+            return False
+
+        # The first vertex of each hex is its lowest corner
+        i, j, k = [np.arange(n) for n in shape]
+        first = (i[np.newaxis, np.newaxis, :] +
+                 strides[1] * j[np.newaxis, :, np.newaxis] +
+                 strides[2] * k[:, np.newaxis, np.newaxis]).ravel()
+        if not (conn[:, 0].astype(np.int64) - node_start == first).all():
+            return False
+
+        self.divisions = divisions
+        self.positions = np.arange(self.num_hexes)
+        self.rows = self.positions
+        return True
+
+    def _read_any_layout(self, coords, conn, shape):
+        """Read the layout of a file from all its vertices and hexes"""
+        node_start = coords.attrs['start_id']
+        coords = coords[...]
+        self.divisions = [np.unique(coords[:, n]) for n in xrange(3)]
+        if [len(divs) - 1 for divs in self.divisions] != shape:
+            raise H5mFileError('The vertices in {0} do not match the ' \
+                    'structured mesh {1}'.format(self.filename, self.dims))
+
+        # A hex's lowest corner is the lesser of its first and seventh vertex
+        conn = conn[...]
+        corners = np.minimum(coords[conn[:, 0].astype(np.int64) - node_start],
+                             coords[conn[:, 6].astype(np.int64) - node_start])
+        ijk = [np.searchsorted(self.divisions[n], corners[:, n])
+               for n in xrange(3)]
+        # Canonical position of the hex in each row of the file
+        self.positions = ijk[0] + shape[0] * (ijk[1] + shape[1] * ijk[2])
+        if len(self.positions) != self.num_hexes or \
+                not np.bincount(self.positions,
+                                minlength=self.num_hexes).all():
+            raise H5mFileError('The hexes in {0} do not match the ' \
+                    'structured mesh {1}'.format(self.filename, self.dims))
+        # File row of the hex at each canonical position
+        self.rows = np.argsort(self.positions)
+
+    def _read_set_values(self, f, name):
+        """Return a dict of the values of tag name on entity sets, by id"""
+        values = {}
+        dense = 'tstt/sets/tags/' + name
+        if dense in f:
+            for row, value in enumerate(f[dense][...]):
+                values[int(self.set_start) + row] = value
+        ids, rows = self._sparse_ids(f, name)
+        first = np.searchsorted(ids, self.set_start)
+        if first < len(ids):
+            setvalues = _read_rows(f['tstt/tags/' + name + '/values'],
+                                   rows[first:])
+            for eid, value in zip(ids[first:], setvalues):
+                values[int(eid)] = value
+        return values
+
+    def _sparse_ids(self, f, name):
+        """Return the sorted ids of the entities with sparse values of tag
+        name in file f, and the rows of their values
+        """
+        key = (self.filename, name)
+        if key not in self._sparse:
+            group = f['tstt/tags/' + name]
+            if 'id_list' in group:
+                ids = group['id_list'][...].astype(np.int64)
+            else:
+                ids = np.zeros(0, dtype=np.int64)
+            rows = np.argsort(ids, kind='mergesort')
+            self._sparse[key] = (ids[rows], rows)
+        return self._sparse[key]
+
+    def tag_names(self):
+        """Return the names of the tags defined in the file"""
+        with h5py.File(self.filename, 'r') as f:
+            return [str(name) for name in f['tstt/tags']]
+
+    def __contains__(self, name):
+        with h5py.File(self.filename, 'r') as f:
+            return 'tstt/tags/' + name in f
+
+    def read_tag(self, name, positions=None):
+        """Return the values of tag name on the structured mesh
+
+        Parameters
+        ----------
+        name : string
+            Name of the tag.
+        positions : array_like of ints, optional
+            Canonical positions of the hexes to read values for; only these
+            rows of the tag's data are read from the file.  By default, the
+            values of all hexes are read.
+
+        Returns
+        -------
+        data : tag_data namedtuple
+            The hex values are given for the hexes in positions, if given.
+
+        Raises
+        ------
+        TagNotFoundError
+            If the tag is not in the file.
+        H5mFileError
+            If the tag does not hold integers or floats.
+        """
+        with h5py.File(self.filename, 'r') as f:
+            path = 'tstt/tags/' + name
+            if path not in f:
+                raise TagNotFoundError(name)
+            group = f[path]
+            tag_type, size = _tag_type(group)
+            if tag_type is None or 'var_lengths' in group:
+                raise H5mFileError('Tag {0} does not hold integer or float ' \
+                        'values'.format(name))
+
+            if positions is None:
+                positions = np.arange(self.num_hexes)
+            positions = np.asarray(positions, dtype=int)
+            rows = self.rows[positions]
+            num = len(positions)
+            hexes = np.zeros((num,) if size == 1 else (num, size),
+                             dtype=tag_type)
+            isset = np.zeros(num, dtype=bool)
+            dense = 'tstt/elements/Hex8/tags/' + name
+            if dense in f:
+                hexes[:] = _read_rows(f[dense], rows)
+                isset[:] = True
+            ids, idrows = self._sparse_ids(f, name)
+            if num and len(ids):
+                # Look up the hexes among the ids of the sparse values, and
+                # read the values of those found
+                hexids = rows + self.hex_start
+                idx = np.minimum(np.searchsorted(ids, hexids), len(ids) - 1)
+                found = ids[idx] == hexids
+                if found.any():
+                    hexes[found] = _read_rows(group['values'],
+                                              idrows[idx[found]])
+                    isset |= found
+
+            root = group.attrs.get('global')
+            scdset = self._read_set_values(f, name).get(self.scdset_id)
+        return tag_data(tag_type, size, hexes, isset, root, scdset)
+
+    def write_tag(self, name, data):
+        """Write the values of tag name, replacing any in the file
+
+        Parameters
+        ----------
+        name : string
+            Name of the tag.
+        data : tag_data namedtuple
+            The values to write.  Hex values are written for every hex if all
+            are set, or otherwise for the hexes that are set.
+        """
+        with h5py.File(self.filename, 'r+') as f:
+            self._delete(f, name)
+            group, base = _create_tag(f, name, data.type, data.size,
+                                      _DENSE if data.isset.all() else _SPARSE)
+            typeid = group['type'].id
+
+            if data.root is not None:
+                attr = h5py.h5a.create(group.id, 'global', typeid,
+                                       h5py.h5s.create(h5py.h5s.SCALAR))
+                attr.write(np.asarray(data.root, dtype=base), mtype=typeid)
+
+            ids = []
+            values = []
+            if data.isset.all():
+                hexes = _dataset(f['tstt/elements/Hex8/tags'], name, typeid,
+                                 self.num_hexes)
+                hexes.write(h5py.h5s.ALL, h5py.h5s.ALL,
+                            np.ascontiguousarray(data.hexes[self.positions],
+                                                 dtype=base), mtype=typeid)
+            elif data.isset.any():
+                rows = np.argsort(self.positions)[data.isset]
+                ids.append(rows + self.hex_start)
+                values.append(data.hexes[data.isset])
+            if data.scdset is not None:
+                ids.append([self.scdset_id])
+                values.append(np.reshape(data.scdset,
+                                         (1,) + data.hexes.shape[1:]))
+            if ids:
+                ids = np.concatenate(ids).astype('<u8')
+                group.create_dataset('id_list', data=ids)
+                dset = _dataset(group, 'values', typeid, len(ids))
+                dset.write(h5py.h5s.ALL, h5py.h5s.ALL,
+                           np.ascontiguousarray(np.concatenate(values),
+                                                dtype=base), mtype=typeid)
+
+    def write_values(self, name, positions, values):
+        """Write the values of tag name on some hexes into the file
+
+        If the tag is not in the file, it is created with values on every
+        hex, which are 0 until written.  Otherwise the tag must already have
+        values on every hex.
+
+        Parameters
+        ----------
+        name : string
+            Name of the tag.
+        positions : array_like of ints
+            Canonical positions of the hexes to write values for.
+        values : array_like
+            Values of shape (len(positions),) or (len(positions), n) for a
+            tag of n values.
+        """
+        values = np.asarray(values)
+        rows = self.rows[np.asarray(positions, dtype=int)]
+        with h5py.File(self.filename, 'r+') as f:
+            dense = 'tstt/elements/Hex8/tags/' + name
+            if 'tstt/tags/' + name not in f:
+                size = values.shape[1] if values.ndim == 2 else 1
+                group = _create_tag(f, name, values.dtype, size, _DENSE)[0]
+                _dataset(f['tstt/elements/Hex8/tags'], name,
+                         group['type'].id, self.num_hexes)
+            elif dense not in f:
+                raise H5mFileError('Tag {0} is not set on every hex of ' \
+                        '{1}'.format(name, self.filename))
+            _write_rows(f[dense], rows, values)
+
+    def delete_tag(self, name):
+        """Remove tag name and all its values from the file"""
+        with h5py.File(self.filename, 'r+') as f:
+            self._delete(f, name)
+
+    def _delete(self, f, name):
+        """Remove tag name from file f, if it is there"""
+        self._sparse.pop((self.filename, name), None)
+        if 'tstt/nodes/tags/' + name in f:
+            raise H5mFileError('Tag {0} is set on vertices, which are not ' \
+                    'supported'.format(name))
+        for path in ('tstt/elements/Hex8/tags/', 'tstt/sets/tags/',
+                     'tstt/tags/'):
+            if path + name in f:
+                del f[path + name]
+
+
+def _tag_type(group):
+    """Return the NumPy type and number of values of a tag definition
+
+    The type is None if the tag does not hold signed integers or floats.
+    """
+    dtype = group['type'].dtype
+    size = 1
+    if dtype.subdtype is not None:
+        dtype, shape = dtype.subdtype
+        size = int(np.prod(shape))
+    if dtype.kind == 'i':
+        return np.int64, size
+    if dtype.kind == 'f':
+        return np.float64, size
+    return None, size
+
+
+def _create_tag(f, name, tag_type, size, storage):
+    """Create the definition of tag name in file f, with MOAB storage class
+    storage
+
+    Returns the tag's group, and the NumPy type of its values in the file.
+    """
+    base = np.dtype('<i4') if np.issubdtype(tag_type, np.integer) \
+            else np.dtype('<f8')
+    group = f.create_group('tstt/tags/' + name)
+    group.attrs.create('class', storage, dtype=np.int32)
+    group['type'] = base if size == 1 else np.dtype((base, (size,)))
+    return group, base
+
+
+def _dataset(group, name, typeid, length):
+    """Create a dataset of length values of a committed type in group"""
+    return h5py.h5d.create(group.id, name, typeid,
+                           h5py.h5s.create_simple((length,)))
+
+
+def _select(dset, rows):
+    """Return the file space of dset with the given sorted, unique rows
+    selected, as one strided block if possible
+    """
+    space = dset.id.get_space()
+    breaks = np.nonzero(np.diff(rows) != 1)[0] + 1
+    starts = rows[np.r_[0, breaks]]
+    lengths = np.diff(np.r_[0, breaks, len(rows)])
+    steps = np.diff(starts)
+    if (lengths == lengths[0]).all() and (steps == steps[:1]).all():
+        stride = steps[0] if len(steps) else 1
+        space.select_hyperslab((starts[0],), (len(starts),),
+                               stride=(stride,), block=(lengths[0],))
+    else:
+        space.select_none()
+        for start, length in zip(starts, lengths):
+            space.select_hyperslab((start,), (1,), block=(length,),
+                                   op=h5py.h5s.SELECT_OR)
+    return space
+
+
+def _read_rows(dset, rows):
+    """Read the given rows of a dataset, in the given order"""
+    base, shape = dset.dtype.subdtype or (dset.dtype, ())
+    if len(rows) == 0:
+        return np.zeros((0,) + shape, dtype=base)
+    rows, inverse = np.unique(rows, return_inverse=True)
+    values = np.empty((len(rows),) + shape, dtype=base)
+    dset.id.read(h5py.h5s.create_simple((len(rows),)), _select(dset, rows),
+                 values, mtype=h5py.h5t.py_create(dset.dtype))
+    return values[inverse]
+
+
+def _write_rows(dset, rows, values):
+    """Write values to the given (unique) rows of a dataset"""
+    if len(rows) == 0:
+        return
+    base = (dset.dtype.subdtype or (dset.dtype,))[0]
+    order = np.argsort(rows)
+    values = np.ascontiguousarray(values[order], dtype=base)
+    dset.id.write(h5py.h5s.create_simple((len(rows),)),
+                  _select(dset, rows[order]), values,
+                  mtype=h5py.h5t.py_create(dset.dtype))
@@ -2,13 +2,14 @@
 
 from operator import itemgetter
 import itertools
+import multiprocessing
 import numpy as np
 import random
 import sys
 import optparse
 
 from itaps import iMesh, iBase
-from r2s import scdmesh
+from r2s import scdmesh, sharedmesh
 from data_transfer.write_alara_geom import write_alara_geom
 from pydagmc import dagmc
 from pydagmc import util as dagutil
@@ -20,6 +21,9 @@ class mmGridError(Exception):
 
 _quiet = False
 
+# The geometry file loaded into DagMC by load_geom(), if any
+_geom_file = None
+
 
 def _msg(msg, newline=True):
     """Print to stdout if the module's _quiet flag is not set.
@@ -69,6 +73,24 @@ def get_mat_id(materials, volume_id):
     return mat_idx
 
 
+def get_volume_materials(materials):
+    """Look up the material index of every volume in the DagMC geometry
+
+    Parameters
+    ----------
+    materials : dictionary
+        Materials of the geometry, as returned by prepare_materials().
+
+    Returns
+    -------
+    vol_mats : dictionary
+        Maps the id of each volume to its material index (see get_mat_id()),
+        so that the DagMC metadata of each volume is queried only once.
+    """
+    return dict((vol, get_mat_id(materials, vol))
+                for vol in dagmc.get_volume_list())
+
+
 def get_vox_centers(mesh, voxels):
     """Calculate the center point of voxels and return a list of (x,y,z) coords
 
@@ -96,7 +118,7 @@ def get_vox_centers(mesh, voxels):
     return coords
 
 
-def get_point_materials(materials, coords):
+def get_point_materials(materials, coords, vol_mats=None):
     """Query DAGMC for materials at a list of points
 
     Parameters
@@ -105,6 +127,9 @@ def get_point_materials(materials, coords):
         ...
     coords : list of (x, y, z) float triplets
         Point coordinates; typically for voxel centers.
+    vol_mats : dictionary, optional
+        Material index of each volume, as returned by get_volume_materials();
+        looked up if not given.
     
     Returns
     -------
@@ -115,11 +140,13 @@ def get_point_materials(materials, coords):
     -----
     Requires that DagMC geometry has already been loaded via dagmc.load().
     """
+    if vol_mats is None:
+        vol_mats = get_volume_materials(materials)
     mats = list()
     for coord in coords:
         vol_id = dagmc.find_volume(coord)
-        mats.append(get_mat_id(materials, vol_id))
-        
+        mats.append(vol_mats[vol_id])
+
     return mats
 
 
@@ -151,13 +178,16 @@ def _linspace_square( n ):
     return points_inside
 
 
-def _random_square( n ):
+def _random_square( n, rng=random ):
     """Return a callable that creates randomly distributed points in the give quad
     
     Parameters
     ----------
     n : integer
         Number of rays to fire
+    rng : random.Random object, optional
+        Random number generator to draw points from; by default the random
+        module's shared generator.
     
     Returns
     -------
@@ -166,8 +196,8 @@ def _random_square( n ):
     """
     def points_inside(a0, a1, b0, b1):
         for _ in xrange(n):
-            a = random.uniform(a0,a1)
-            b = random.uniform(b0,b1)
+            a = rng.uniform(a0,a1)
+            b = rng.uniform(b0,b1)
             yield a,b
     return points_inside
 
@@ -181,17 +211,301 @@ def pairwise(l):
         x0 = x1
 
 
+class _RayTracer(object):
+    """Fires rays through the DagMC geometry along a structured grid.
+
+    This is the part of mmGrid that samples the materials along rays, which
+    needs only the materials and the grid divisions, so that it can be run
+    in worker processes without the mesh or the grid.
+
+    The rays of a grid are fired in partitions: one per row of squares on
+    the side of the grid perpendicular to each direction (see
+    mmGrid._rayframe), in the order x, y, z.
+    """
+
+    def __init__(self, materials, divisions, vol_mats):
+        """Create a ray tracer for a dict of the divisions along x, y and z
+
+        vol_mats is the material index of each volume, as returned by
+        get_volume_materials().
+        """
+        self.materials = materials
+        self.divisions = divisions
+        self.vol_mats = vol_mats
+        self.first_vol = None
+
+    def partitions(self):
+        """Return a list of (idx, a_index) for each partition of the rays
+
+        idx is 0, 1 or 2 for rays directed along x, y or z, and a_index the
+        number of the row of squares along the first axis of the plane
+        perpendicular to them.
+        """
+        partitions = []
+        for idx, dim in enumerate('xyz'):
+            plane = 'xyz'.replace(dim,'')
+            partitions.extend((idx, a_index) for a_index in
+                              xrange(len(self.divisions[plane[0]]) - 1))
+        return partitions
+
+    def fire_partition(self, idx, a_index, N, use_grid, seed, part,
+                       tolerance=None, batch=None, homogeneous=None):
+        """Fire the rays of each square in a partition
+
+        N^2 rays are fired through each square, unless tolerance is given:
+        then the rays are fired in batches of `batch` random rays, until the
+        relative errors of the material fractions of all voxels along the
+        square (see _relative_errors) are at most tolerance, or N^2 rays
+        have been fired.  At least _MIN_BATCHES batches are fired.
+
+        homogeneous, if given, is an array of shape (nb, nd) of the material
+        index of each voxel along the row that is known to be of a single
+        material, and -1 for the others (see probe_slab).  No rays are fired
+        through squares whose voxels are all of a single material; they are
+        scored as if N^2 rays had been.
+
+        Random ray starting points are drawn from a generator seeded with
+        seed and then jumped ahead by part, the number of the partition.
+
+        Returns
+        -------
+        mats, errs : arrays of shape (nb, nd, len(materials))
+            The sums, and sums of squares, of the ray samples of each voxel
+            along the row: nb squares in the row, each with nd voxels along
+            the rays.
+        rays : array of shape (nb,)
+            The number of rays fired through each square.
+        """
+        dim = 'xyz'[idx]
+        plane = 'xyz'.replace(dim,'')
+        adivs = self.divisions[plane[0]]
+        bdivs = self.divisions[plane[1]]
+        divs = self.divisions[dim]
+
+        if not use_grid:
+            rng = random.Random(seed)
+            rng.jumpahead(part)
+        if tolerance is None:
+            batch = N**2
+
+        uvw = np.array([0,0,0],dtype=np.float64)
+        uvw[idx] = 1.0
+        shape = (len(bdivs)-1, len(divs)-1, len(self.materials))
+        mats = np.zeros(shape, dtype=np.float64)
+        errs = np.zeros(shape, dtype=np.float64)
+        rays = np.zeros(shape[0], dtype=np.int64)
+
+        a0, a1 = adivs[a_index], adivs[a_index+1]
+        squares = list(pairwise(bdivs))
+        active = range(len(squares))
+        if homogeneous is not None:
+            voxels = np.arange(shape[1])
+            for b_index in np.flatnonzero((homogeneous >= 0).all(axis=1)):
+                mats[b_index, voxels, homogeneous[b_index]] = N**2
+                errs[b_index, voxels, homogeneous[b_index]] = N**2
+                rays[b_index] = N**2
+                active.remove(b_index)
+        while active:
+            for b_index in active:
+                b0, b1 = squares[b_index]
+                if use_grid:
+                    count = N**2
+                    points = _linspace_square(N)(a0, a1, b0, b1)
+                else:
+                    count = min(batch, N**2 - rays[b_index])
+                    points = _random_square(count, rng)(a0, a1, b0, b1)
+                # For each ray that starts in this square, take a sample
+                for a, b in points:
+                    xyz = [a,b]
+                    xyz.insert(idx,divs[0])
+                    samples = self.fire_ray(xyz, uvw, divs)
+                    mats[b_index] += samples
+                    errs[b_index] += samples**2
+                rays[b_index] += count
+            # Keep sampling the squares whose voxels have not converged
+            active = [b_index for b_index in active if rays[b_index] < N**2
+                      and (rays[b_index] < _MIN_BATCHES * batch or
+                           _relative_errors(mats[b_index], errs[b_index],
+                                            rays[b_index]).max() > tolerance)]
+        return mats, errs, rays
+
+    def probe_slab(self, i):
+        """Probe the voxels of the i-th slab of the grid along x
+
+        Returns
+        -------
+        homogeneous : array of shape (ny, nz)
+            The material index of each voxel of the slab found to be of a
+            single material by probe_voxel(), and -1 for the others.
+        """
+        xdivs, ydivs, zdivs = [self.divisions[dim] for dim in 'xyz']
+        homogeneous = np.empty((len(ydivs)-1, len(zdivs)-1), dtype=np.int64)
+        for (j, (y0, y1)), (k, (z0, z1)) in itertools.product(
+                enumerate(pairwise(ydivs)), enumerate(pairwise(zdivs))):
+            homogeneous[j, k] = self.probe_voxel((xdivs[i], y0, z0),
+                                                 (xdivs[i+1], y1, z1))
+        return homogeneous
+
+    def probe_voxel(self, lo, hi):
+        """Look for a single material in the voxel between corners lo and hi
+
+        The voxel is probed at its center and near its 8 corners (inset by
+        _PROBE_INSET of its size, so that surfaces on its faces do not
+        count), and along a ray between two opposite probes.  If all of
+        these find the same material, its index is returned, and otherwise
+        -1.
+
+        Probes cannot prove that no surface crosses the voxel: a feature
+        that lies between the probes, away from the diagonal, is missed.
+        """
+        vol_mats = self.vol_mats
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+        center = (lo + hi) / 2
+        half = (hi - lo) / 2 * (1 - _PROBE_INSET)
+        corners = [center + half * signs for signs in
+                   itertools.product((-1, 1), repeat=3)]
+        vols = [dagmc.find_volume(list(xyz)) for xyz in [center] + corners]
+        mats = set(vol_mats.get(vol) for vol in vols)
+        if len(mats) != 1 or None in mats:
+            return -1
+        mat = mats.pop()
+
+        # The ray from the first corner to the last must not leave the
+        # material before reaching it
+        length = np.sqrt(((corners[-1] - corners[0])**2).sum())
+        uvw = (corners[-1] - corners[0]) / length
+        travelled = 0.0
+        for nxtvol, raydist, _ in dagmc.ray_iterator(vols[1],
+                                                     list(corners[0]), uvw):
+            travelled += raydist
+            if travelled >= length:
+                break
+            if vol_mats.get(nxtvol) != mat:
+                return -1
+        return mat
+
+    def fire_ray(self, xyz, uvw, divs):
+        """Fire a single ray and return the materials sampled along it
+
+        xyz: start position of ray
+        uvw: direction of ray
+        divs: The structured grid divisions along this dimension.
+
+        Returns a 2D array of the fractions of the length of each voxel along
+        the ray (rows) that the ray spends in each material (columns).
+        """
+        first_vol = self.first_vol
+        if not first_vol or not dagmc.point_in_volume(first_vol,xyz,uvw):
+            first_vol = dagmc.find_volume(xyz,uvw)
+
+        # Collect the lengths of the ray in successive volumes, and their
+        # materials, then bin them on the grid all at once
+        vol_mats = self.vol_mats
+        vol = first_vol
+        lengths = []
+        seg_mats = []
+        for nxtvol, raydist, _ in dagmc.ray_iterator( vol, xyz, uvw ):
+            lengths.append(raydist)
+            seg_mats.append(vol_mats[vol])
+            vol = nxtvol
+
+        # Save the first detected volume to speed future queries
+        self.first_vol = first_vol
+        return _bin_segments(divs, lengths, seg_mats, len(self.materials))
+
+
+# Fraction of a voxel's size by which probe_voxel() insets its corner probes
+_PROBE_INSET = 1e-3
+
+# Number of batches fired through each square before adaptive sampling may
+# stop; the errors estimated from a single batch are not trustworthy
+_MIN_BATCHES = 2
+
+
+def _row_axes(idx):
+    """Return the grid axes along the squares, and along the rays, of the
+    rows of rays directed along axis idx (see _RayTracer.partitions)"""
+    plane = 'xyz'.replace('xyz'[idx],'')
+    return ['xyz'.find(plane[0]), 'xyz'.find(plane[1]), idx]
+
+
+def _relative_errors(mats, errs, n):
+    """Return the relative errors of material fractions sampled by n rays
+
+    mats and errs are the sums, and sums of squares, of the ray samples; the
+    relative error of a fraction is its standard error divided by it, and 0
+    for fractions of 0.
+    """
+    mean = mats / n
+    sigma = np.sqrt(np.maximum(errs / n - mean**2, 0) / n)
+    rel = np.zeros_like(mean)
+    nonzero = mean > 0
+    rel[nonzero] = sigma[nonzero] / mean[nonzero]
+    return rel
+
+
+def _bin_segments(divs, lengths, seg_mats, nmats):
+    """Bin the segments of a ray on the divisions of a grid
+
+    Parameters
+    ----------
+    divs : sequence of floats
+        Divisions of the grid along the ray, which starts at divs[0].
+    lengths : sequence of floats
+        Lengths of the successive segments of the ray.
+    seg_mats : sequence of integers
+        Material index of each segment.
+    nmats : integer
+        Number of materials.
+
+    Returns
+    -------
+    samples : 2D array of floats
+        samples[i, m] is the fraction of the length of voxel i (between
+        divs[i] and divs[i+1]) covered by segments of material m.  Parts of
+        the ray beyond divs[-1] are ignored.
+    """
+    divs = np.asarray(divs, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    if len(lengths) == 0:
+        return np.zeros((len(divs) - 1, nmats), dtype=np.float64)
+    # starts[k] is the position at which segment k starts
+    starts = divs[0] + np.concatenate(([0.0], np.cumsum(lengths)))
+    # covered[k, m] is the length in material m from divs[0] to starts[k]
+    covered = np.zeros((len(lengths) + 1, nmats), dtype=np.float64)
+    covered[np.arange(1, len(lengths) + 1), seg_mats] = lengths
+    covered = np.cumsum(covered, axis=0)
+
+    # The same at each division: up to the start of the segment the
+    # division falls in, plus the part of that segment before the division
+    seg = np.searchsorted(starts, divs, side='right') - 1
+    seg = np.clip(seg, 0, len(lengths) - 1)
+    at_divs = covered[seg]
+    partial = np.clip(divs - starts[seg], 0, lengths[seg])
+    at_divs[np.arange(len(divs)), np.asarray(seg_mats)[seg]] += partial
+
+    return np.diff(at_divs, axis=0) / np.diff(divs)[:, np.newaxis]
+
+
 class MatGrid:
     """Parent class for mmGrid-likes.
     
     Daughter classes should define
     - create_tags()
     - generate()
+
+    Public member variables::
+
+        self.materials -- materials of the geometry; see prepare_materials()
+        self.vol_mats -- material index of each volume of the geometry; see
+                         get_volume_materials()
     """
 
     def __init__(self, mesh):
         """ """
         self.materials = prepare_materials()
+        self.vol_mats = get_volume_materials(self.materials)
 
 
 class SingleMatGrid(MatGrid):
@@ -242,7 +556,8 @@ class SingleMatGrid(MatGrid):
         """Get voxel materials by getting voxel centers and checking with DagMC
         """
         self.coords = get_vox_centers(self.mesh, self.voxels)
-        self.voxmats = get_point_materials(self.materials, self.coords)
+        self.voxmats = get_point_materials(self.materials, self.coords,
+                                           self.vol_mats)
 
 
 class mmGrid(MatGrid):
@@ -261,6 +576,10 @@ class mmGrid(MatGrid):
         self.voxel_dt = np.dtype([('mats',np.float64,mat_dim),
                                   ('errs',np.float64,mat_dim)])
         self.grid = np.zeros( (idim, jdim, kdim), dtype=self.voxel_dt )
+        # Number of rays fired through each voxel
+        self.rays = np.zeros( (idim, jdim, kdim), dtype=np.int64 )
+        # Material of each voxel found to be of a single material, if probed
+        self.homogeneous = None
         self.first_vol = None
 
     @classmethod
@@ -313,119 +632,142 @@ class mmGrid(MatGrid):
                 ijk[b_idx] += 1
             ijk[a_idx] += 1
 
-    def _grid_fragments(self, divs, div, startloc, length):
-        """Generator: yield line segments along a ray
-
-        The divs parameter is the divisions of the grid along a ray.  Div is
-        the division index after which the ray starts, and startloc is the
-        starting position.  Length is the length of the ray from startloc.
-
-        Yields a 3-tuple (L, ratio, keepgoing)
-            L: The length of the ray segment in the next grid element
-            ratio: the ratio of L to length of the grid element.
-            keepgoing: true if unassigned length remains after this iteration.
-        """
-        L = length
-        loc = startloc
-        for x0, x1 in pairwise(divs[div:]):
-            diff = x1 - loc
-            meshdiff = x1 - x0
-            if diff < L:
-                L -= diff
-                loc += diff
-                yield (diff,diff/meshdiff,True)
-            else:  # diff >= L
-                yield (L,L/meshdiff,False)
-                loc = L
-                break
-
-    def _alloc_one_ray(self, start_ijk, dim, xyz, uvw, divs, samples):
-        """Fire a single ray and store the sampled data to the grid
-        
-        start_ijk: structured mesh coordinates of the hex from which ray begins
-        dim: 0, 1, or 2 depending on whether whether ray is x, y, or z-directed.
-        xyz: start position of ray
-        uvw: direction of ray
-        divs: The structured grid divisions along this dimension.
-        samples: 2D array of zeros used to store ray info
-        """
-        first_vol = self.first_vol
-        if not first_vol or not dagmc.point_in_volume(first_vol,xyz,uvw):
-            first_vol = dagmc.find_volume(xyz,uvw)
-
-        vol = first_vol
-        loc = divs[0]
-        div = 0
-        for nxtvol, raydist, _ in dagmc.ray_iterator( vol, xyz, uvw ):
-            mat_idx = get_mat_id( self.materials, vol )
-            vol = nxtvol
-            for meshdist, meshrat, newloc in self._grid_fragments( divs, div, loc, raydist ):
-                # The ray fills this voxel for a normalized distance of
-                # meshrat = (meshdist / length_of_voxel)
-                samples[div,mat_idx] += meshrat
-                loc += meshdist
-                if(newloc):
-                    div += 1
-
-        # Save the first detected volume to speed future queries
-        self.first_vol = first_vol
-
-        # prepare an indexing object for self.grid to access the appropriate mesh row.
-        # It is important to use a slice object rather than a general sequence
-        # because a general sequence will trigger numpy's advanced iteration,
-        # which returns copies of data instead of views.
-        idx_ijk = start_ijk
-        idx_ijk[dim] = slice(self.scdmesh.dims[dim], self.scdmesh.dims[dim+3])
-        for sample, voxel in itertools.izip_longest( samples, self.grid[idx_ijk]):
-            voxel['mats'] += sample
-            voxel['errs'] += sample**2
-
-    def generate(self, N, use_grid=False ):
+    def generate(self, N, use_grid=False, workers=1, seed=None,
+                 tolerance=None, batch=None, probe=False):
         """Sample the DagMC geometry and store the results on this grid.
 
-        N is the number of samples to take per voxel per dimension
+        N is the number of samples to take per voxel per dimension.
+
+        If tolerance is given, sampling is adaptive: rays are fired through
+        each square on the sides of the mesh in batches of `batch` random
+        rays (N by default, and at least 2), until the relative errors of the
+        material fractions of all voxels along the square are at most
+        tolerance.  The errors are first tested after _MIN_BATCHES batches.
+        At most N^2 rays are fired through a square, so that adaptive
+        sampling never fires more rays than N^2 per square; voxels of a
+        single material converge after _MIN_BATCHES batches.  The number of rays fired
+        through each voxel is kept in self.rays.
+
+        If probe is True, each voxel is first probed for a single material
+        (see _RayTracer.probe_voxel), and no rays are fired along rows whose
+        voxels all are.  The material of each such voxel, or -1, is kept in
+        self.homogeneous.
+
+        The rays are fired in partitions, one per row of squares on each side
+        of the mesh (see _RayTracer), which are shared among `workers`
+        processes.  Each partition draws its random ray starting points from
+        its own generator, seeded from `seed` and the partition's number, and
+        the sums of the partitions are added to the grid in partition order,
+        so that a given seed gives the same grid with any number of workers.
+        If seed is None, it is drawn from the random module.
         """
-        count = 1
-        if use_grid:
-            rays = _linspace_square(N)
-        else:
-            rays = _random_square(N**2)
+        if tolerance is not None:
+            if use_grid:
+                raise mmGridError('Adaptive sampling needs random rays')
+            if batch is None:
+                batch = max(N, 2)
+            if batch < 2:
+                # The error estimated from a batch of one ray is always 0
+                raise mmGridError('Adaptive sampling needs batches of at '
+                                  'least 2 rays, not {0}'.format(batch))
+        if seed is None:
+            seed = random.getrandbits(32)
+        tracer = _RayTracer(self.materials, dict(
+                (dim, self.scdmesh.getDivisions(dim)) for dim in 'xyz'),
+                self.vol_mats)
+        tracer.first_vol = self.first_vol
 
         total_ray_count = sum([self._rayframe_count(dim) for dim in 'xyz']) * (N**2)
 
-        # iterate over ray-firing directions
-        for idx, dim in enumerate('xyz'):
-            uvw = np.array([0,0,0],dtype=np.float64)
-            uvw[idx] = 1.0
-            divs = self.scdmesh.getDivisions(dim)
-            samples = np.zeros((len(divs)-1,(len(self.materials))), dtype=np.float64)
-
-
-            def make_xyz(a,b):
-                    xyz = [a,b]
-                    xyz.insert(idx,divs[0])
-                    return xyz
-
-            # iterate over all the scdmesh squares on the plane normal to uvw
-            for ijk, square in self._rayframe(dim):
+        if workers > 1:
+            # The workers attach to the mesh's divisions (see r2s.sharedmesh)
+            # rather than each being sent a copy of them
+            shared = sharedmesh.publish(self.scdmesh)
+            try:
+                pool = multiprocessing.Pool(workers, _init_worker,
+                        (_geom_file, self.materials, shared.path,
+                         self.vol_mats))
+            except:
+                shared.close()
+                raise
+        else:
+            pool = None
+
+        count = 0
+        fired = 0
+        try:
+            if probe:
+                _msg('Probing voxels...')
+                slabs = xrange(self.grid.shape[0])
+                if pool is not None:
+                    probes = pool.map(_probe_slab, slabs)
+                else:
+                    probes = [tracer.probe_slab(i) for i in slabs]
+                self.homogeneous = np.array(probes)
+                _msg('{0} of {1} voxels are of a single material'.format(
+                        (self.homogeneous >= 0).sum(), self.homogeneous.size))
+
+            tasks = []
+            for part, (idx, a_index) in enumerate(tracer.partitions()):
+                if probe:
+                    rows = np.moveaxis(self.homogeneous, _row_axes(idx),
+                                       [0, 1, 2])
+                    homogeneous = np.ascontiguousarray(rows[a_index])
+                else:
+                    homogeneous = None
+                tasks.append((idx, a_index, N, use_grid, seed, part,
+                              tolerance, batch, homogeneous))
+
+            if pool is not None:
+                results = pool.imap(_fire_partition, tasks)
+            else:
+                results = (tracer.fire_partition(*task) for task in tasks)
+
+            for task, (mats, errs, rays) in itertools.izip(tasks, results):
+                # Add the partition's sums to the grid rows it sampled
+                idx, a_index = task[0:2]
+                axes = _row_axes(idx)
+                for field, sums in (('mats', mats), ('errs', errs)):
+                    rows = np.moveaxis(self.grid[field], axes, [0, 1, 2])
+                    rows[a_index] += sums
+                rows = np.moveaxis(self.rays, axes, [0, 1, 2])
+                rows[a_index] += rays[:, np.newaxis]
+                fired += rays.sum()
+                homogeneous = task[-1]
+                if homogeneous is not None:
+                    # Rows of single material voxels were scored, not fired
+                    fired -= (homogeneous >= 0).all(axis=1).sum() * (N**2)
+                count += mats.shape[0] * (N**2)
                 _msg('\rFiring rays: {0}%'.format((100*count)/total_ray_count), False)
-                # For each ray that starts in this square, take a sample
-                for xyz in (make_xyz(a,b) for a,b in rays(*square)):
-                    self._alloc_one_ray( ijk, idx, xyz, uvw, divs, samples )
-                    count += 1
-                    samples[:,:] = 0
+        except:
+            if pool is not None:
+                pool.terminate()
+                shared.close()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+            shared.close()
+        else:
+            self.first_vol = tracer.first_vol
         _msg('\rFiring rays: 100%')
+        if tolerance is not None or probe:
+            _msg("Fired {0} of at most {1} rays".format(
+                    fired, total_ray_count))
 
-        total_scores_per_vox = N*N*3
         max_err = 0
         _msg("Normalizing...")
-        for vox in self.grid.flat:
+        for vox, total_scores_per_vox in itertools.izip(self.grid.flat,
+                                                         self.rays.flat):
             # Note: vox['mats'] = ... does not work as expected, but
             #       vox['mats'] /= ... does the right thing.
             # To get the correct assignment behavior, use an extra [:], as below
             vox['mats'] /= total_scores_per_vox
             errs = vox['errs'] / total_scores_per_vox
-            sigma = np.sqrt( (errs - (vox['mats']**2)) / total_scores_per_vox )
+            # Rounding can leave the variance slightly negative; clamp it as
+            # _relative_errors does
+            variance = np.maximum(errs - (vox['mats']**2), 0)
+            sigma = np.sqrt( variance / total_scores_per_vox )
             vox['errs'][:] = sigma
             max_err = max(max_err, max(vox['errs']))
         _msg("Maximum error: {0}".format(max_err))
@@ -475,7 +817,39 @@ def load_geom(filename):
     filename : string
         Filename with geometry information. Typically a .sat file.
     """
+    global _geom_file
     dagmc.load( filename )
+    _geom_file = filename
+
+
+# The _RayTracer of a worker process of mmGrid.generate()
+_worker_tracer = None
+
+
+def _init_worker(geom_file, materials, mesh_path, vol_mats):
+    """Set up a worker process for mmGrid.generate()
+
+    The geometry is loaded with load_geom(), unless the process already has
+    it (e.g. inherited from the parent process by fork).  The divisions of
+    the grid are those of the mesh published in mesh_path (see
+    r2s.sharedmesh).
+    """
+    global _worker_tracer
+    if geom_file is not None and geom_file != _geom_file:
+        load_geom(geom_file)
+    mesh = sharedmesh.attach(mesh_path)
+    divisions = dict((dim, mesh.getDivisions(dim)) for dim in 'xyz')
+    _worker_tracer = _RayTracer(materials, divisions, vol_mats)
+
+
+def _fire_partition(task):
+    """Fire the rays of a partition in a worker process"""
+    return _worker_tracer.fire_partition(*task)
+
+
+def _probe_slab(i):
+    """Probe the voxels of a slab in a worker process"""
+    return _worker_tracer.probe_slab(i)
 
 
 def main( arguments=None ):
@@ -502,6 +876,18 @@ def main( arguments=None ):
                    dest='ndivs', default=10 )
     op.add_option( '-a', '--alara', help='Write alara geom to specified file name',
                    dest='alara_geom_file', default=None, action='store')
+    op.add_option( '-j', '--workers', help='Number of processes to fire rays with, default=%default',
+                   dest='workers', default=1, type=int )
+    op.add_option( '-s', '--seed', help='Seed for the random ray starting points; the same seed '
+                   'gives the same results with any number of processes',
+                   dest='seed', default=None, type=int )
+    op.add_option( '-t', '--tolerance', help='Fire rays in batches until the relative errors of the '
+                   'material fractions along each row are at most TOLERANCE, or N^2 rays were fired',
+                   dest='tolerance', default=None, type=float )
+    op.add_option( '-b', '--batch', help='Number of rays per batch with --tolerance (at least 2), default=N',
+                   dest='batch', default=None, type=int )
+    op.add_option( '-p', '--probe', help='Probe voxels for a single material first, and fire no rays '
+                   'along rows of such voxels', dest='probe', default=False, action='store_true' )
     opts, args = op.parse_args( arguments )
     if len(args) != 1 and len(args) != 2:
         op.error( 'Need one or two arguments' )
@@ -516,8 +902,9 @@ def main( arguments=None ):
     else:
         grid = mmGrid.fromDagGeom(opts.ndivs)
 
-    grid.generate(opts.numrays, opts.usegrid)
-    grid.createTags()
+    grid.generate(opts.numrays, opts.usegrid, opts.workers, opts.seed,
+                  opts.tolerance, opts.batch, opts.probe)
+    grid.create_tags()
     grid.writeFile( opts.output_filename, opts.alara_geom_file )
 
 
@@ -1,13 +1,31 @@
-import itertools
 from collections import namedtuple, Iterable
 
-from itaps import iBase, iMesh, iMeshExtensions
+import numpy as np
+
+# PyTAPS is needed by ScdMesh, but not by the array-backed ArrayScdMesh
+# (see r2s.arraymesh), which can be used without it.
+try:
+    from itaps import iBase, iMesh, iMeshExtensions
+except ImportError:
+    iBase = iMesh = iMeshExtensions = None
 
 
 class ScdMeshError(Exception):
     pass
 
 
+# The errors raised on tag access; PyTAPS' own when it is available.
+if iBase is not None:
+    TagNotFoundError = iBase.TagNotFoundError
+    TagAlreadyExistsError = iBase.TagAlreadyExistsError
+else:
+    class TagNotFoundError(Exception):
+        pass
+
+    class TagAlreadyExistsError(Exception):
+        pass
+
+
 class ScdMesh:
     """A structured mesh in the spirit of MOAB's ScdMesh interface.
     
@@ -17,6 +35,11 @@ class ScdMesh:
                       structured mesh resides
         self.dims -- A namedtuple indicating the minimum and maximum
                      (i,j,k) coordinates of this structured mesh.
+
+    The hexahedra and vertices of the mesh are looked up in arrays of their
+    entity handles, in the canonical (zyx) order of the structured mesh.
+    The arrays are built on first use, as are the mesh divisions along each
+    axis and the hex volumes, which are kept as NumPy arrays.
     """
 
 
@@ -26,6 +49,10 @@ class ScdMesh:
                                ('imin', 'jmin', 'kmin',
                                 'imax', 'jmax', 'kmax'))
 
+    # The result of locate(): the (i,j,k) coordinates and handles of the
+    # hexahedra containing a list of points, and which points are inside.
+    located_tuple = namedtuple('located', ('ijk', 'hexes', 'inside'))
+
     def __init__(self, x_points, y_points, z_points, imesh=None, **kw):
         """Construct a ScdMesh from given x, y, and z coordinates.
 
@@ -62,11 +89,12 @@ class ScdMesh:
         self.dims = ScdMesh.extents_tuple(*bdtag[self.scdset])
         vdims_incr = list(self.dims[0:3]) + [x + 1 for x in self.dims[3:6]]
         self.vdims = ScdMesh.extents_tuple(*vdims_incr)
-        # access iterators for hexes and vertices; used by getHex()/getVtx()
-        self.hexit = self.scdset.iterate(iBase.Type.region,
-                                         iMesh.Topology.hexahedron)
-        self.vtxit = self.scdset.iterate(iBase.Type.vertex,
-                                         iMesh.Topology.point)
+        # arrays of hex and vertex handles; see _hexArray() and _vtxArray()
+        self._hexes = None
+        self._vtxs = None
+        # cached geometry; see getDivisionArray() and getHexVolumeArray()
+        self._divs = {}
+        self._volumes = None
 
     @classmethod
     def fromFile(cls, filename, imesh=None):
@@ -104,29 +132,39 @@ class ScdMesh:
         m = cls(None, None, None, imesh, _scdset=eset)
         return m
 
+    def _hexArray(self):
+        """Return an array of the mesh's hexahedra, in canonical order"""
+        if self._hexes is None:
+            self._hexes = self.scdset.getEntities(iBase.Type.region,
+                                                  iMesh.Topology.hexahedron)
+        return self._hexes
+
+    def _vtxArray(self):
+        """Return an array of the mesh's vertices, in canonical order"""
+        if self._vtxs is None:
+            self._vtxs = self.scdset.getEntities(iBase.Type.vertex,
+                                                 iMesh.Topology.point)
+        return self._vtxs
+
     def getVtx(self, i, j, k):
         """Return the (i,j,k)'th vertex in the mesh"""
         n = _dimConvert(self.vdims, (i, j, k))
-        return _stepIter(self.vtxit, n)
+        return self._vtxArray()[n]
 
     def getHex(self, i, j, k):
         """Return the (i,j,k)'th hexahedron in the mesh"""
         n = _dimConvert(self.dims, (i, j, k))
-        return _stepIter(self.hexit, n)
+        return self._hexArray()[n]
 
     def getHexVolume(self, i, j, k):
         """Return the volume of the (i,j,k)'th hexahedron in the mesh"""
-        v = list(self.iterateVtx(x=[i, i + 1],
-                                 y=[j, j + 1],
-                                 z=[k, k + 1]))
-        coord = self.imesh.getVtxCoords(v)
-        dx = coord[1][0] - coord[0][0]
-        dy = coord[2][1] - coord[0][1]
-        dz = coord[4][2] - coord[0][2]
-        return dx * dy * dz
+        _dimConvert(self.dims, (i, j, k))
+        return self.getHexVolumeArray()[i - self.dims.imin,
+                                        j - self.dims.jmin,
+                                        k - self.dims.kmin]
 
     def iterateHex(self, order='zyx', **kw):
-        """Get an iterator over the hexahedra of the mesh
+        """Get the hexahedra of the mesh, in a given iteration order
 
         The order argument specifies the iteration order.  It must be a string
         of 1-3 letters from the set (x,y,z).  The rightmost letter is the axis
@@ -162,49 +200,213 @@ class ScdMesh:
                                         j-coordinate = 3 or 4.  k-coordinate
                                         values change fastest, j-values least
                                         fast.
+
+        The hexahedra are returned as an array of entity handles, which may be
+        iterated over, or passed to a tag to get or set the tag's values on
+        all of them at once, e.g. tag[sm.iterateHex('xyz')] = values.
         """
 
-        # special case: zyx order is the standard pytaps iteration order,
-        # so we can save time by simply returning a pytaps iterator
-        # if no kwargs were specified
+        # special case: zyx order is the canonical order of the handle array
         if order == 'zyx' and not kw:
-            return self.scdset.iterate(iBase.Type.region,
-                                       iMesh.Topology.hexahedron)
+            return self._hexArray().copy()
 
-        indices, ordmap = _scdIterSetup(self.dims, order, **kw)
-        return _scdIter(indices, ordmap, self.dims, self.hexit)
+        return self._hexArray()[_scdIndices(self.dims, order, **kw)]
+
+    def locate(self, points, outside='raise'):
+        """Find the hexahedra containing each of an array of points
+
+        Each axis is searched with one vectorized binary search of the mesh
+        divisions.  A point on a division between two hexes is in the upper
+        one, and a point on the mesh's upper boundary is in the last hex, as
+        in the binary_search of source_gamma.F90.
+
+        Parameters
+        ----------
+        points : array_like of shape (N, 3)
+            x, y and z coordinates of the points.
+        outside : {'raise', 'clip'}, optional
+            What to do with points outside the mesh: raise ScdMeshError, or
+            return the boundary hex nearest to each of them, flagged in
+            inside.
+
+        Returns
+        -------
+        located : namedtuple (ijk, hexes, inside)
+            ijk is an int array of shape (N, 3) of the (i,j,k) coordinates of
+            the hexes, hexes an array of their entity handles, and inside a
+            boolean array of which points are within the mesh.
+
+        Examples::
+
+          loc = sm.locate([[0.5, 1.2, 3.0], [2.5, 0.1, 0.1]])
+          values = sm.imesh.getTagHandle('n_group_total')[loc.hexes]
+        """
+        if outside not in ('raise', 'clip'):
+            raise ScdMeshError('Invalid outside argument: ' + str(outside))
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        ijk = np.empty(points.shape, dtype=int)
+        inside = np.ones(len(points), dtype=bool)
+        for idx, dim in enumerate('xyz'):
+            divs = self.getDivisionArray(dim)
+            coords = points[:, idx]
+            # comparisons with NaN are False, so NaN is never inside
+            inside &= (coords >= divs[0]) & (coords <= divs[-1])
+            n = np.searchsorted(divs, coords, side='right') - 1
+            ijk[:, idx] = np.clip(n, 0, len(divs) - 2)
+
+        if outside == 'raise' and not inside.all():
+            bad = points[~inside]
+            raise ScdMeshError('{0} point(s) outside the mesh, e.g. ' \
+                    '{1}'.format(len(bad), tuple(bad[0])))
+
+        ni = self.dims.imax - self.dims.imin
+        nj = self.dims.jmax - self.dims.jmin
+        hexes = self._hexArray()[(ijk[:, 2] * nj + ijk[:, 1]) * ni + ijk[:, 0]]
+        ijk += self.dims[0:3]
+        return self.located_tuple(ijk, hexes, inside)
 
     def iterateVtx(self, order='zyx', **kw):
-        """Get an iterator over the vertices of the mesh
+        """Get the vertices of the mesh, in a given iteration order
 
         See iterateHex() for an explanation of the order argument and the
         available keyword arguments.
         """
 
-        #special case: zyx order without kw is equivalent to pytaps iterator
+        # special case: zyx order is the canonical order of the handle array
         if order == 'zyx' and not kw:
-            return self.scdset.iterate(iBase.Type.vertex, iMesh.Topology.point)
+            return self._vtxArray().copy()
 
-        indices, ordmap = _scdIterSetup(self.vdims, order, **kw)
-        return _scdIter(indices, ordmap, self.vdims, self.vtxit)
+        return self._vtxArray()[_scdIndices(self.vdims, order, **kw)]
 
     def iterateHexVolumes(self, order='zyx', **kw):
-        """Get an iterator over the volumes of the mesh hexahedra
+        """Get the volumes of the mesh hexahedra, in a given iteration order
 
         See iterateHex() for an explanation of the order argument and the
-        available keyword arguments.
+        available keyword arguments.  The volumes are returned as a 1D array.
+        """
+        volumes = self.getHexVolumeArray('zyx').ravel()
+        return volumes[_scdIndices(self.dims, order, **kw)]
+
+    def _orderShape(self, order):
+        """Return the shape of a hex array with axes in the given order"""
+        if not (len(order) == 3 and set(order) == set('xyz')):
+            raise ScdMeshError('Invalid array order: ' + str(order))
+        counts = dict(zip('xyz', (self.dims[3] - self.dims[0],
+                                  self.dims[4] - self.dims[1],
+                                  self.dims[5] - self.dims[2])))
+        return tuple(counts[L] for L in order)
+
+    def getTagArray(self, name, order='xyz'):
+        """Get the values of a tag on every hexahedron as a NumPy array
+
+        Parameters
+        ----------
+        name : string
+            Name of the tag; it must be set on every hex of the mesh.
+        order : string, optional
+            Order of the array axes; any permutation of 'xyz'.  By default
+            the array is indexed [i, j, k].
+
+        Returns
+        -------
+        values : array
+            Array of shape (ni, nj, nk) for a tag of one value (with the axes
+            permuted as order), or (ni, nj, nk, n) for a tag of n values.
         """
+        shape = self._orderShape(order)
+        tag = self.imesh.getTagHandle(name)
+        values = np.asarray(tag[self.iterateHex(order)])
+        return values.reshape(shape + values.shape[1:])
 
-        indices, _ = _scdIterSetup(self.dims, order, **kw)
-        # Use an inefficient but simple approach: call getHexVolume()
-        # on each required i,j,k pair.  
-        # A better implementation would only make one call to getVtxCoords.
-        for A in itertools.product(*indices):
-            # the ordmap returned from _scdIterSetup maps to kji/zyx ordering,
-            # but we want ijk/xyz ordering, so create the ordmap differently.
-            ordmap = [order.find(L) for L in 'xyz']
-            ijk = [A[ordmap[x]] for x in range(3)]
-            yield self.getHexVolume(*ijk)
+    def setTagArray(self, name, array, order='xyz'):
+        """Set the values of a tag on every hexahedron from a NumPy array
+
+        The tag is created if it does not exist, with the array's length
+        along its fourth axis (or 1) as its size, and an integer or float
+        type according to the array's dtype.
+
+        Parameters
+        ----------
+        name : string
+            Name of the tag.
+        array : array_like
+            Values of shape (ni, nj, nk) or (ni, nj, nk, n), with the axes
+            permuted as order.
+        order : string, optional
+            Order of the array axes; any permutation of 'xyz'.  By default
+            the array is indexed [i, j, k].
+
+        Returns
+        -------
+        tag : iMesh.Tag
+            The tag that was set.
+        """
+        shape = self._orderShape(order)
+        array = np.asarray(array)
+        if array.shape[:3] != shape or array.ndim not in (3, 4):
+            raise ScdMeshError('Array of shape {0} does not match mesh of ' \
+                    'shape {1} in order {2}'.format(array.shape, shape, order))
+
+        n = shape[0] * shape[1] * shape[2]
+        array = array.reshape((n,) + array.shape[3:])
+        tag = self._hexTag(name, array)
+        tag[self.iterateHex(order)] = array
+        return tag
+
+    def iterateSlabs(self, axis='x', width=1):
+        """Iterate over the mesh in slabs of hexahedra
+
+        Each slab is a ScdSlab holding the hexes of `width` consecutive
+        planes of the mesh normal to `axis`, through which the values of
+        tags can be got and set for those hexes only.  Code that works on
+        one slab at a time needs memory for one slab's values rather than
+        the whole mesh's; for an ArrayScdMesh read from an .h5m file, only
+        one slab of values is read from the file at a time.
+
+        Parameters
+        ----------
+        axis : 'x', 'y' or 'z', optional
+            Axis along which to step from slab to slab.
+        width : int or None, optional
+            Number of planes in each slab (the last may have fewer).  If
+            None, the whole mesh is one slab.
+
+        Examples::
+
+          for slab in sm.iterateSlabs('x', 4):
+              fluxes = slab.getTag('n_group_001')
+              slab.setTag('dose', fluxes * factor)
+        """
+        if not (len(axis) == 1 and axis in 'xyz'):
+            raise ScdMeshError('Invalid dimension: ' + str(axis))
+        idx = 'xyz'.find(axis)
+        start, stop = self.dims[idx], self.dims[idx + 3]
+        if width is None:
+            width = stop - start
+        if width < 1:
+            raise ScdMeshError('Invalid slab width: ' + str(width))
+        for first in xrange(start, stop, width):
+            yield ScdSlab(self, axis, first, min(first + width, stop))
+
+    def _hexTag(self, name, values):
+        """Return tag name, creating it to hold values if necessary
+
+        A new tag has values.shape[1] (or 1) values per hex, and an integer
+        or float type according to values.dtype.
+        """
+        try:
+            return self.imesh.getTagHandle(name)
+        except TagNotFoundError:
+            size = values.shape[1] if values.ndim == 2 else 1
+            if np.issubdtype(values.dtype, np.integer):
+                return self.imesh.createTag(name, size, int)
+            return self.imesh.createTag(name, size, float)
+
+    def _setHexValues(self, name, hexes, values):
+        """Set the values of tag name on some hexes, creating the tag if
+        necessary (see _hexTag)"""
+        values = np.asarray(values)
+        self._hexTag(name, values)[hexes] = values
 
     def getDivisions(self, dim):
         """Get the mesh divisions on a given dimension
@@ -212,12 +414,92 @@ class ScdMesh:
         Given a dimension 'x', 'y', or 'z', return a list of the mesh vertices
         along that dimension
         """
-        if len(dim) == 1 and dim in 'xyz':
-            idx = 'xyz'.find(dim)
-            return [self.imesh.getVtxCoords(i)[idx]
-                    for i in self.iterateVtx(dim)]
-        else:
+        return list(self.getDivisionArray(dim))
+
+    def getDivisionArray(self, dim):
+        """Get the mesh divisions on a given dimension as a NumPy array
+
+        The array is computed once and cached, and is read-only.
+        """
+        if not (len(dim) == 1 and dim in 'xyz'):
             raise ScdMeshError('Invalid dimension: '+str(dim))
+        if dim not in self._divs:
+            idx = 'xyz'.find(dim)
+            coords = self.imesh.getVtxCoords(self.iterateVtx(dim))
+            divs = np.array(coords, dtype=float).reshape(-1, 3)[:, idx]
+            divs.flags.writeable = False
+            self._divs[dim] = divs
+        return self._divs[dim]
+
+    def getWidths(self, dim):
+        """Get the widths of the hexahedra along a given dimension"""
+        return np.diff(self.getDivisionArray(dim))
+
+    def getCenters(self, dim):
+        """Get the centers of the hexahedra along a given dimension"""
+        divs = self.getDivisionArray(dim)
+        return (divs[:-1] + divs[1:]) / 2.0
+
+    def getHexVolumeArray(self, order='xyz'):
+        """Get the volumes of all the hexahedra as a 3D NumPy array
+
+        The array has shape (ni, nj, nk), with the axes permuted as order, a
+        permutation of 'xyz'.  It is a read-only view of a cached array.
+        """
+        self._orderShape(order) # validates order
+        if self._volumes is None:
+            dx, dy, dz = [self.getWidths(L) for L in 'xyz']
+            volumes = (dx[:, np.newaxis, np.newaxis] *
+                       dy[np.newaxis, :, np.newaxis] *
+                       dz[np.newaxis, np.newaxis, :])
+            volumes.flags.writeable = False
+            self._volumes = volumes
+        return self._volumes.transpose(['xyz'.find(L) for L in order])
+
+
+class ScdSlab(object):
+    """A slab of consecutive planes of hexahedra of a structured mesh
+
+    Slabs are made by ScdMesh.iterateSlabs().  Tag values are got and set
+    as NumPy arrays over the slab's hexes, in the xyz iteration order of the
+    slab (k-coordinates changing fastest).
+
+    Public member variables::
+
+        self.mesh -- the ScdMesh the slab belongs to
+        self.axis -- the axis ('x', 'y' or 'z') normal to the slab's planes
+        self.start, self.stop -- the range of coordinates along axis that
+                                 the slab covers
+        self.hexes -- the slab's hexahedra, in xyz order
+    """
+
+    def __init__(self, mesh, axis, start, stop):
+        self.mesh = mesh
+        self.axis = axis
+        self.start = start
+        self.stop = stop
+        self.hexes = mesh.iterateHex('xyz', **self._kw())
+
+    def _kw(self):
+        return {self.axis: range(self.start, self.stop)}
+
+    def __len__(self):
+        return len(self.hexes)
+
+    def getTag(self, name):
+        """Get the values of tag name on the slab's hexes as an array"""
+        return np.asarray(self.mesh.imesh.getTagHandle(name)[self.hexes])
+
+    def setTag(self, name, values):
+        """Set the values of tag name on the slab's hexes
+
+        The tag is created if it does not exist, as by ScdMesh.setTagArray().
+        """
+        self.mesh._setHexValues(name, self.hexes, values)
+
+    def getVolumes(self):
+        """Get the volumes of the slab's hexes as an array"""
+        return self.mesh.iterateHexVolumes('xyz', **self._kw())
 
 
 def _dimConvert(dims, ijk):
@@ -237,16 +519,6 @@ def _dimConvert(dims, ijk):
     return n
 
 
-def _stepIter(it, n):
-    """Helper method for getVtx and getHex
-
-    Return the nth item in the iterator"""
-    it.step(n)
-    r = it.next()
-    it.reset()
-    return r
-
-
 def _scdIterSetup(dims, order, **kw):
     """Setup helper function for ScdMesh iterator functions
 
@@ -291,14 +563,20 @@ def _scdIterSetup(dims, order, **kw):
     return indices, ordmap
 
 
-def _scdIter(indices, ordmap, dims, it):
-    """Iterate over the indices lists, yielding _stepIter(it) for each"""
+def _scdIndices(dims, order, **kw):
+    """Return the canonical indices of the entities to iterate over
+
+    Given dims and the arguments to the iterator function, return an array
+    of the positions, in the canonical (zyx) entity order, of each entity
+    in the requested iteration order.
+    """
+    indices, ordmap = _scdIterSetup(dims, order, **kw)
     d = [0, 0, 1]
     d[1] = (dims[3] - dims[0])
     d[0] = (dims[4] - dims[1]) * d[1]
     mins = [dims[2], dims[1], dims[0]]
-    offsets = ([(a - mins[ordmap[x]]) * d[ordmap[x]]
-                for a in indices[x]]
-                for x in range(3))
-    for ioff, joff, koff in itertools.product(*offsets):
-        yield _stepIter(it, (ioff + joff + koff))
+    offsets = [(np.array(list(indices[x]), dtype=int) - mins[ordmap[x]]) *
+               d[ordmap[x]] for x in range(3)]
+    return (offsets[0][:, np.newaxis, np.newaxis] +
+            offsets[1][np.newaxis, :, np.newaxis] +
+            offsets[2][np.newaxis, np.newaxis, :]).ravel()
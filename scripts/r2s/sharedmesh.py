@@ -0,0 +1,198 @@
+"""Module shares a structured mesh between processes, read-only, through
+files mapped into memory.
+
+publish() writes the divisions of a mesh, its hex volumes and chosen hex tags
+to a directory of .npy files.  attach() returns an ArrayScdMesh whose volumes
+and tag values are read-only memory maps of those files, so that any number
+of worker processes (forked or started separately) share one copy of the
+arrays in the page cache, without copying or reloading the mesh file.
+
+Ownership and cleanup: the SharedMesh returned by publish() owns the
+directory, and should be used as a context manager (or closed in a finally
+clause), which removes the directory.  Closing only has an effect in the
+publishing process, so a SharedMesh inherited by forked workers is never
+removed by them.  The directory's name holds the publishing process's id;
+if that process is killed before it closes the mesh, the directory is
+removed by the next publish() into the same parent directory.  Workers
+should be handed SharedMesh.path and call attach(path); the memory maps of
+an attached mesh stay valid until it is garbage collected, even if the
+directory is removed meanwhile.
+
+Example::
+
+    with sharedmesh.publish(sm, ['n_group_total']) as shared:
+        pool = multiprocessing.Pool(4, sharedmesh.attach_worker,
+                                    (shared.path,))
+        results = pool.map(work, tasks)  # work() uses sharedmesh.worker_mesh
+"""
+
+import errno
+import json
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+from r2s.arraymesh import ArrayScdMesh, ArrayTag
+
+
+class SharedMeshError(Exception):
+    pass
+
+
+_MANIFEST = 'mesh.json'
+
+# Published directories are named scdmesh-<owner pid>-<random suffix>
+_PREFIX = 'scdmesh-'
+_NAME_RE = re.compile('^' + _PREFIX + r'(\d+)-')
+
+
+class SharedMesh(object):
+    """A published mesh: the directory of its arrays, owned by one process
+
+    Public member variables::
+
+        self.path -- the directory holding the mesh's arrays, for attach()
+        self.owner -- id of the process that published the mesh
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = os.getpid()
+
+    def attach(self):
+        """Return the published mesh; see attach()"""
+        return attach(self.path)
+
+    def close(self):
+        """Remove the published arrays, if called by the publishing process"""
+        if os.getpid() == self.owner and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def publish(mesh, tags=(), directory=None):
+    """Publish a structured mesh for worker processes to attach to
+
+    Parameters
+    ----------
+    mesh : ScdMesh or ArrayScdMesh
+        Mesh to publish.
+    tags : list of strings, optional
+        Names of the hex tags to publish; each must be set on every hex.
+        Tags of other values than integers or floats are not supported.
+    directory : string, optional
+        Directory in which to create the directory of the mesh's arrays; by
+        default the system's temporary directory (see tempfile).  A
+        directory on a memory-backed file system (e.g. /dev/shm) keeps the
+        arrays out of the disk altogether.  Meshes left in it by killed
+        publishing processes are removed first; see remove_stale().
+
+    Returns
+    -------
+    shared : SharedMesh
+        Owner of the published arrays, to be closed (e.g. by a with block)
+        once the workers are done.
+    """
+    if directory is None:
+        directory = tempfile.gettempdir()
+    remove_stale(directory)
+    path = tempfile.mkdtemp(prefix='{0}{1}-'.format(_PREFIX, os.getpid()),
+                            dir=directory)
+    shared = SharedMesh(path)
+    try:
+        manifest = {'mins': list(mesh.dims[0:3]), 'tags': []}
+        for dim in 'xyz':
+            np.save(os.path.join(path, dim + '.npy'),
+                    mesh.getDivisionArray(dim))
+        np.save(os.path.join(path, 'volumes.npy'),
+                mesh.getHexVolumeArray('xyz'))
+        hexes = mesh.iterateHex()
+        for n, name in enumerate(tags):
+            tag = mesh.imesh.getTagHandle(name)
+            values = np.asarray(tag[hexes])
+            if values.dtype.kind not in 'iuf':
+                raise SharedMeshError('Tag {0} does not hold integers or ' \
+                        'floats'.format(name))
+            values = values.astype(np.int64 if values.dtype.kind in 'iu'
+                                   else np.float64)
+            filename = 'tag{0:03d}.npy'.format(n)
+            np.save(os.path.join(path, filename), values)
+            manifest['tags'].append({'name': name, 'file': filename,
+                                     'size': int(tag.sizeValues)})
+        np.save(os.path.join(path, 'isset.npy'),
+                np.ones(len(hexes), dtype=bool))
+        with open(os.path.join(path, _MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+    except:
+        shared.close()
+        raise
+    return shared
+
+
+def _process_exists(pid):
+    """Return whether a process with id pid exists"""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def remove_stale(directory):
+    """Remove the published meshes in directory whose owners have exited
+
+    These are left behind by publishing processes that were killed before
+    they could close their meshes.
+    """
+    for name in os.listdir(directory):
+        match = _NAME_RE.match(name)
+        if match and not _process_exists(int(match.group(1))):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def attach(path):
+    """Return an ArrayScdMesh of a mesh published in directory path
+
+    The mesh's hex volumes and tags are read-only memory maps of the
+    published arrays; setting their values raises ValueError.  New tags may
+    be created on the mesh, and are private to the process.
+    """
+    try:
+        with open(os.path.join(path, _MANIFEST)) as f:
+            manifest = json.load(f)
+    except IOError:
+        raise SharedMeshError('No published mesh in {0}'.format(path))
+
+    load = lambda filename: np.load(os.path.join(path, filename),
+                                    mmap_mode='r')
+    mesh = ArrayScdMesh(*[load(dim + '.npy') for dim in 'xyz'],
+                        mins=manifest['mins'])
+    mesh._volumes = load('volumes.npy')
+    isset = load('isset.npy')
+    for entry in manifest['tags']:
+        data = load(entry['file'])
+        # json gives unicode strings
+        tag = ArrayTag(str(entry['name']), entry['size'], data.dtype.type, 0)
+        tag.data, tag.isset = data, isset
+        tag.modified = False
+        mesh.imesh.tags[tag.name] = tag
+    return mesh
+
+
+# The mesh attached by attach_worker() in a worker process
+worker_mesh = None
+
+
+def attach_worker(path):
+    """Attach to a published mesh as worker_mesh; for use as the initializer
+    of a multiprocessing.Pool"""
+    global worker_mesh
+    worker_mesh = attach(path)
@@ -54,6 +54,36 @@ class ScdMeshTest(unittest.TestCase):
         self.assertRaises(ScdMeshError, sm.getHex, 0, 3, 0)
         self.assertRaises(ScdMeshError, sm.getHex, 0, 0, 2)
 
+    def test_locate(self):
+        sm = ScdMesh( [0,1,3], [-3,-2,0], [12,13,15] )
+        points = [[0.5, -2.5, 12.5], [1, -2, 15], [3, 0, 12], [2.9, -0.1, 13]]
+        loc = sm.locate(points)
+        self.assertEqual( loc.ijk.tolist(),
+                          [[0,0,0], [1,1,1], [1,1,0], [1,1,1]] )
+        self.assertEqual( list(loc.hexes),
+                          [sm.getHex(*ijk) for ijk in loc.ijk] )
+        self.assertTrue( loc.inside.all() )
+
+        # points outside the mesh, or NaN
+        points = [[-0.1, -2, 13], [0.5, -2.5, 12.5], [numpy.nan, -2, 13]]
+        self.assertRaises( ScdMeshError, sm.locate, points )
+        loc = sm.locate(points, outside='clip')
+        self.assertEqual( list(loc.inside), [False, True, False] )
+        self.assertEqual( loc.ijk[0].tolist(), [0,1,1] )
+
+    def test_get_hex_order(self):
+        # getHex and getVtx agree with the canonical (zyx) iteration order
+        sm = ScdMesh( range(11,16), range(21,25), range(31,34), self.mesh )
+        it = sm.scdset.iterate( iBase.Type.region, iMesh.Topology.hexahedron )
+        ijk_zyx = [(i,j,k) for k in range(2) for j in range(3) for i in range(4)]
+        for ijk, hx in itertools.izip_longest( ijk_zyx, it ):
+            self.assertEqual( sm.getHex(*ijk), hx )
+
+        it = sm.scdset.iterate( iBase.Type.vertex, iMesh.Topology.point )
+        ijk_zyx = [(i,j,k) for k in range(3) for j in range(4) for i in range(5)]
+        for ijk, vtx in itertools.izip_longest( ijk_zyx, it ):
+            self.assertEqual( sm.getVtx(*ijk), vtx )
+
     def test_hex_volume(self):
 
         sm = ScdMesh( [0,1,3], [-3,-2,0], [12,13,15] )
@@ -68,6 +98,25 @@ class ScdMeshTest(unittest.TestCase):
         for V, ijk in itertools.izip_longest(sm.iterateHexVolumes(), ijk_all):
             self.assertEqual( V, sm.getHexVolume(*ijk) )
 
+        self.assertRaises(ScdMeshError, sm.getHexVolume, 2, 0, 0)
+
+    def test_geometry_arrays(self):
+        sm = ScdMesh( [0,1,3,6], [-3,-2], [12,13,15] )
+        self.assertEqual( list(sm.getWidths('x')), [1, 2, 3] )
+        self.assertEqual( list(sm.getCenters('z')), [12.5, 14] )
+
+        vols = sm.getHexVolumeArray()
+        self.assertEqual( vols.shape, (3, 1, 2) )
+        self.assertEqual( vols[2, 0, 1], 6 )
+        self.assertEqual( sm.getHexVolumeArray('zyx').shape, (2, 1, 3) )
+        self.assertEqual( list(sm.iterateHexVolumes('xyz')),
+                          list(vols.ravel()) )
+        self.assertEqual( list(sm.iterateHexVolumes('x', z=1)), [2, 4, 6] )
+
+        # cached arrays may not be modified by callers
+        self.assertRaises( ValueError, vols.__setitem__, (0, 0, 0), 5 )
+        self.assertRaises( ScdMeshError, sm.getDivisionArray, 'w' )
+
 
     def test_get_vtx(self):
         # mesh with valid i values 0-4, j values 0-3, k values 0-2
@@ -223,6 +272,40 @@ class ScdMeshIterateTest(unittest.TestCase):
         for (it_x, sm_x) in izip( it, sm.iterateVtx('x')):
             self.assertEqual(it_x,sm_x)
 
+    def test_bulk_tag(self):
+        # iterateHex results can be used to set a tag on many hexes at once
+        tag = self.mesh.createTag( 'bulk', 1, float )
+        hexes = self.sm.iterateHex('xyz')
+        self.assertEqual( len(hexes), 24 )
+        tag[hexes] = numpy.arange(24, dtype=float)
+
+        for n, ijk in enumerate(itertools.product( self.I, self.J, self.K )):
+            self.assertEqual( tag[self.sm.getHex(*ijk)], n )
+
+        hexes = self.sm.iterateHex('zx', y=1, x=[2,3])
+        self.assertEqual( list(tag[hexes]), [14, 20, 15, 21] )
+
+    def test_tag_array(self):
+        a = numpy.arange(24, dtype=float).reshape(4, 3, 2)
+        self.sm.setTagArray( 'scalar', a )
+        tag = self.mesh.getTagHandle( 'scalar' )
+        self.assertEqual( tag[self.sm.getHex(2, 1, 0)], a[2, 1, 0] )
+
+        self.assertTrue( (self.sm.getTagArray('scalar') == a).all() )
+        self.assertTrue( (self.sm.getTagArray('scalar', 'zyx') ==
+                          a.transpose(2, 1, 0)).all() )
+
+        # vector tag, set in zyx order
+        v = numpy.arange(48).reshape(2, 3, 4, 2)
+        self.sm.setTagArray( 'vector', v, order='zyx' )
+        tag = self.mesh.getTagHandle( 'vector' )
+        self.assertEqual( list(tag[self.sm.getHex(3, 1, 1)]), list(v[1, 1, 3]) )
+        self.assertTrue( (self.sm.getTagArray('vector') ==
+                          v.transpose(2, 1, 0, 3)).all() )
+
+        self.assertRaises( ScdMeshError, self.sm.setTagArray, 'bad', a, 'zyx' )
+        self.assertRaises( ScdMeshError, self.sm.getTagArray, 'scalar', 'xy' )
+
     
 class ScdPerfTest(unittest.TestCase):
 
@@ -0,0 +1,122 @@
+from r2s import grouptags
+from r2s import scdmesh
+from r2s.arraymesh import ArrayScdMesh
+from r2s.scdmesh import ScdMeshError, TagNotFoundError, \
+        TagAlreadyExistsError
+import numpy as np
+import unittest
+from nose.plugins.skip import SkipTest
+
+
+class TestArrayScdMesh(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = ArrayScdMesh(range(3), [0, 1, 3], [0, 2], mins=(1, 0, 0))
+
+    def test_create(self):
+        self.assertEqual(self.mesh.dims, (1, 0, 0, 3, 2, 1))
+        self.assertEqual(self.mesh.vdims, (1, 0, 0, 4, 3, 2))
+        self.assertEqual(self.mesh.getDivisions('y'), [0, 1, 3])
+        self.assertEqual(list(self.mesh.getCenters('y')), [0.5, 2])
+        self.assertEqual(self.mesh.getHexVolume(2, 1, 0), 4)
+
+    def test_iterate(self):
+        # handles are positions in zyx order
+        self.assertEqual(list(self.mesh.iterateHex()), [0, 1, 2, 3])
+        self.assertEqual(list(self.mesh.iterateHex('xy')), [0, 2, 1, 3])
+        self.assertEqual(self.mesh.getHex(2, 1, 0), 3)
+        self.assertEqual(len(self.mesh.iterateVtx()), 18)
+        self.assertRaises(ScdMeshError, self.mesh.getHex, 0, 0, 0)
+
+    def test_locate(self):
+        loc = self.mesh.locate([[1.5, 2.0, 0.0], [0.0, 0.5, 2.0]])
+        self.assertEqual(loc.ijk.tolist(), [[2, 1, 0], [1, 0, 0]])
+        self.assertEqual(list(loc.hexes), [3, 0])
+
+    def test_hex_tags(self):
+        imesh = self.mesh.imesh
+        tag = imesh.createTag('vals', 1, float)
+        self.assertRaises(TagAlreadyExistsError, imesh.createTag, 'vals', 1,
+                          float)
+        self.assertRaises(TagNotFoundError, tag.__getitem__, 0)
+
+        tag[self.mesh.getHex(1, 1, 0)] = 5.0
+        self.assertEqual(tag[self.mesh.getHex(1, 1, 0)], 5.0)
+        self.assertEqual(imesh.getAllTags(2), [tag])
+        self.assertEqual(imesh.getAllTags(0), [])
+
+        self.mesh.setTagArray('vals', np.arange(4.).reshape(2, 2, 1), 'xyz')
+        self.assertEqual(list(tag[self.mesh.iterateHex('xy')]), [0, 1, 2, 3])
+        self.assertTrue((self.mesh.getTagArray('vals', 'xyz') ==
+                         np.arange(4.).reshape(2, 2, 1)).all())
+
+        vtag = imesh.createTag('vec', 3, int)
+        vtag[self.mesh.iterateHex()] = np.arange(12).reshape(4, 3)
+        self.assertEqual(list(vtag[1]), [3, 4, 5])
+        del vtag[1]
+        self.assertRaises(TagNotFoundError, vtag.__getitem__, [0, 1])
+
+        imesh.destroyTag(tag)
+        self.assertRaises(TagNotFoundError, imesh.getTagHandle, 'vals')
+
+    def test_slabs(self):
+        slabs = list(self.mesh.iterateSlabs('x'))
+        self.assertEqual([(s.start, s.stop) for s in slabs], [(1, 2), (2, 3)])
+        self.assertEqual(list(np.concatenate([s.hexes for s in slabs])),
+                         list(self.mesh.iterateHex('xyz')))
+        self.assertEqual(len(list(self.mesh.iterateSlabs('y', None))), 1)
+        self.assertRaises(ScdMeshError, list, self.mesh.iterateSlabs('w'))
+
+        for slab in self.mesh.iterateSlabs('y'):
+            slab.setTag('vals', slab.getVolumes())
+        self.assertTrue((self.mesh.getTagArray('vals') ==
+                         self.mesh.getHexVolumeArray()).all())
+        slab = slabs[1]
+        self.assertEqual(list(slab.getTag('vals')), [2, 4])
+        self.assertEqual(
+                self.mesh.imesh.getTagHandle('vals').type, np.float64)
+
+    def test_set_tags(self):
+        imesh = self.mesh.imesh
+        tag = imesh.createTag('count', 1, int)
+        tag[imesh.rootSet] = 7
+        self.assertEqual(tag[imesh.rootSet], 7)
+        self.assertRaises(TagNotFoundError, tag.__getitem__, self.mesh.scdset)
+        self.assertEqual(imesh.getAllTags(imesh.rootSet), [tag])
+
+        vtag = imesh.createTag('bins', 2, float)
+        vtag[self.mesh.scdset] = [0.5, 1.5]
+        self.assertEqual(list(vtag[self.mesh.scdset]), [0.5, 1.5])
+        self.assertRaises(ScdMeshError, vtag.__setitem__, self.mesh.scdset,
+                          [1.0])
+
+    def test_group_tags(self):
+        voxels = self.mesh.iterateHex('xyz')
+        values = np.arange(8, dtype=float).reshape(4, 2)
+        for vector in (False, True):
+            grouptags.set_group_values(self.mesh.imesh, 'n', voxels, values,
+                                       vector=vector)
+            self.assertEqual(grouptags.find_num_groups(self.mesh.imesh, 'n'),
+                             2)
+            self.assertTrue((grouptags.get_group_values(self.mesh.imesh, 'n',
+                             voxels) == values).all())
+
+    def test_scdmesh_round_trip(self):
+        if scdmesh.iMesh is None:
+            raise SkipTest('PyTAPS is not available')
+        tag = self.mesh.imesh.createTag('vals', 1, float)
+        tag[self.mesh.iterateHex()] = [1.0, 2.0, 3.0, 4.0]
+        count = self.mesh.imesh.createTag('count', 1, int)
+        count[self.mesh.imesh.rootSet] = 4
+
+        sm = self.mesh.toScdMesh()
+        self.assertEqual(sm.getDivisions('y'), [0, 1, 3])
+        smtag = sm.imesh.getTagHandle('vals')
+        self.assertEqual(list(smtag[sm.iterateHex()]), [1.0, 2.0, 3.0, 4.0])
+
+        mesh = ArrayScdMesh.fromScdMesh(sm)
+        self.assertEqual(mesh.getDivisions('z'), [0, 2])
+        self.assertEqual(list(mesh.getTagArray('vals', 'zyx').ravel()),
+                         [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(mesh.imesh.getTagHandle('count')
+                         [mesh.imesh.rootSet], 4)
@@ -0,0 +1,58 @@
+from r2s import fileio
+import bz2
+import gzip
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+text = "first line\nsecond line\n"
+
+
+class TestOpenFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, opener):
+        path = os.path.join(self.tmpdir, name)
+        f = opener(path, 'wb')
+        f.write(text)
+        f.close()
+        return path
+
+    def test_plain(self):
+        path = self._write("plain.txt", open)
+        self.assertFalse(fileio.is_compressed(path))
+        with fileio.open_file(path) as f:
+            self.assertEqual(f.read(), text)
+
+    def test_gzip(self):
+        path = self._write("file.txt.gz", gzip.open)
+        self.assertTrue(fileio.is_compressed(path))
+        with fileio.open_file(path) as f:
+            self.assertEqual(list(f), text.splitlines(True))
+
+    def test_bzip2(self):
+        path = self._write("file.txt.bz2", bz2.BZ2File)
+        self.assertTrue(fileio.is_compressed(path))
+        with fileio.open_file(path) as f:
+            self.assertEqual(f.readline(), "first line\n")
+            offset = f.tell()
+            f.readline()
+            f.seek(offset)
+            self.assertEqual(f.readline(), "second line\n")
+
+    def test_xz(self):
+        if fileio.lzma is None:
+            path = os.path.join(self.tmpdir, "file.txt.xz")
+            self.assertRaises(fileio.FileIOError, fileio.open_file, path)
+        else:
+            path = self._write("file.txt.xz", fileio.lzma.LZMAFile)
+            with fileio.open_file(path) as f:
+                self.assertEqual(f.read(), text)
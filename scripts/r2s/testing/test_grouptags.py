@@ -0,0 +1,66 @@
+from r2s import grouptags
+from r2s.scdmesh import ScdMesh
+import numpy as np
+import unittest
+from itaps import iBase
+
+
+class TestGroupTags(unittest.TestCase):
+
+    def setUp(self):
+        self.sm = ScdMesh(range(3), range(2), range(3))
+        self.imesh = self.sm.imesh
+        self.voxels = self.sm.iterateHex('xyz')
+        self.values = np.arange(12, dtype=float).reshape(4, 3)
+
+    def test_names(self):
+        self.assertEqual(grouptags.group_tag_name('n', 7, '_error'),
+                         'n_group_007_error')
+        self.assertEqual(grouptags.vector_tag_name('phtn_src'),
+                         'phtn_src_groups')
+
+    def test_scalar(self):
+        grouptags.set_group_values(self.imesh, 'n', self.voxels, self.values)
+        tag = self.imesh.getTagHandle('n_group_002')
+        self.assertEqual(tag[self.voxels[3]], 10)
+        self.assertEqual(grouptags.find_num_groups(self.imesh, 'n'), 3)
+
+        values = grouptags.get_group_values(self.imesh, 'n', self.voxels)
+        self.assertTrue((values == self.values).all())
+
+    def test_vector(self):
+        grouptags.set_group_values(self.imesh, 'n', self.voxels, self.values,
+                                   vector=True, suffix='_error')
+        tag = self.imesh.getTagHandle('n_groups_error')
+        self.assertEqual(list(tag[self.voxels[1]]), [3, 4, 5])
+
+        values = grouptags.get_group_values(self.imesh, 'n', self.voxels,
+                                            suffix='_error')
+        self.assertTrue((values == self.values).all())
+
+        # A vector tag is replaced when groups are tagged again
+        grouptags.set_group_values(self.imesh, 'n', self.voxels,
+                                   self.values[:, :2], vector=True,
+                                   suffix='_error')
+        values = grouptags.get_group_values(self.imesh, 'n', self.voxels,
+                                            suffix='_error')
+        self.assertEqual(values.shape, (4, 2))
+
+    def test_legacy_scalar(self):
+        # Scalar tags written without the number of groups on the root set
+        for group in range(1, 3):
+            tag = self.imesh.createTag('p_group_{0:03d}'.format(group), 1,
+                                       float)
+            tag[self.voxels] = self.values[:, group]
+        self.assertEqual(grouptags.find_num_groups(self.imesh, 'p'), 2)
+        values = grouptags.get_group_values(self.imesh, 'p', self.voxels)
+        self.assertTrue((values == self.values[:, 1:]).all())
+
+    def test_missing(self):
+        self.assertEqual(grouptags.find_num_groups(self.imesh, 'n'), 0)
+        self.assertRaises(iBase.TagNotFoundError,
+                          grouptags.get_group_values, self.imesh, 'n',
+                          self.voxels)
+        self.assertRaises(grouptags.GroupTagError,
+                          grouptags.set_group_values, self.imesh, 'n',
+                          self.voxels[:2], self.values)
@@ -0,0 +1,181 @@
+import os.path
+import shutil
+from tempfile import mkdtemp
+import numpy as np
+import unittest
+from nose.plugins.skip import SkipTest
+
+from r2s import h5mfile, scdmesh
+from r2s.h5mfile import H5mFile, H5mFileError, tag_data
+from r2s.arraymesh import ArrayScdMesh
+from r2s.scdmesh import ScdMesh, TagNotFoundError
+
+thisdir = os.path.dirname(__file__)
+meshfile = os.path.join(thisdir, 'h5m_files/matFracsSCD3x3x3.h5m')
+
+
+class TestH5mFile(unittest.TestCase):
+
+    def setUp(self):
+        if h5mfile.h5py is None:
+            raise SkipTest('h5py is not available')
+        self.tmpdir = mkdtemp()
+        self.meshfile = os.path.join(self.tmpdir, 'mesh.h5m')
+        shutil.copyfile(meshfile, self.meshfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_layout(self):
+        h5m = H5mFile(self.meshfile)
+        self.assertEqual(h5m.dims, [0, 0, 0, 3, 3, 3])
+        self.assertEqual(len(h5m.divisions[1]), 4)
+        self.assertAlmostEqual(h5m.divisions[2][1], 10. / 3)
+
+        h5m = H5mFile(os.path.join(thisdir, 'h5m_files/grid543.h5m'))
+        self.assertEqual(h5m.dims, [1, 11, -5, 5, 14, -3])
+        self.assertEqual(list(h5m.divisions[2]), [-10, 2, 12])
+
+        self.assertRaises(H5mFileError, H5mFile,
+                          os.path.join(thisdir, 'files_test_r2s_step2/phtn_src'))
+
+    def test_permuted_layout(self):
+        # Hexes stored out of canonical order are found by their vertices
+        expected = H5mFile(self.meshfile).read_tag('FRACTIONS').hexes
+        with h5mfile.h5py.File(self.meshfile, 'r+') as f:
+            for path in ('tstt/elements/Hex8/connectivity',
+                         'tstt/elements/Hex8/tags/FRACTIONS'):
+                f[path][...] = f[path][...][::-1]
+        h5m = H5mFile(self.meshfile)
+        self.assertEqual(list(h5m.positions), range(26, -1, -1))
+        data = h5m.read_tag('FRACTIONS')
+        self.assertTrue((data.hexes == expected).all())
+
+    def test_read_tag(self):
+        h5m = H5mFile(self.meshfile)
+        self.assertTrue('FRACTIONS' in h5m)
+        data = h5m.read_tag('FRACTIONS')
+        self.assertEqual(data.size, 2)
+        self.assertEqual(data.hexes.shape, (27, 2))
+        self.assertTrue(data.isset.all())
+        self.assertAlmostEqual(data.hexes[0, 1], 0.9999997)
+
+        data = h5m.read_tag('MATS')
+        self.assertFalse(data.isset.any())
+        self.assertEqual(list(data.scdset), [0, 1])
+        self.assertRaises(TagNotFoundError, h5m.read_tag, 'n_group_001')
+
+    def test_write_tag(self):
+        h5m = H5mFile(self.meshfile)
+        isset = np.zeros(27, dtype=bool)
+        isset[[3, 20]] = True
+        h5m.write_tag('partial', tag_data(np.float64, 1, np.arange(27.), isset,
+                                          2.5, 7.0))
+        h5m.write_tag('groups', tag_data(np.int64, 3,
+                                         np.arange(81).reshape(27, 3),
+                                         np.ones(27, dtype=bool), None, None))
+
+        h5m = H5mFile(self.meshfile)
+        data = h5m.read_tag('partial')
+        self.assertEqual(list(data.isset.nonzero()[0]), [3, 20])
+        self.assertEqual(list(data.hexes[[3, 20]]), [3, 20])
+        self.assertEqual((data.root, data.scdset), (2.5, 7.0))
+        data = h5m.read_tag('partial', [20, 4, 3])
+        self.assertEqual(list(data.isset), [True, False, True])
+        self.assertEqual(list(data.hexes[data.isset]), [20, 3])
+        data = h5m.read_tag('groups')
+        self.assertEqual(list(data.hexes[26]), [78, 79, 80])
+        self.assertTrue(data.root is None)
+
+        # Tags with values on every hex are dense, as MOAB stores them
+        h5m.write_values('vals', [0, 1], [1.5, 2.5])
+        with h5mfile.h5py.File(self.meshfile, 'r') as f:
+            self.assertEqual(f['tstt/tags/groups'].attrs['class'],
+                             h5mfile._DENSE)
+            self.assertEqual(f['tstt/tags/vals'].attrs['class'],
+                             h5mfile._DENSE)
+            self.assertEqual(f['tstt/tags/partial'].attrs['class'],
+                             h5mfile._SPARSE)
+
+        h5m.delete_tag('partial')
+        self.assertFalse('partial' in h5m)
+
+    def test_array_mesh(self):
+        mesh = ArrayScdMesh.fromFile(self.meshfile, tags=['FRACTIONS'])
+        self.assertEqual(mesh.dims, (0, 0, 0, 3, 3, 3))
+        self.assertEqual(mesh.imesh.tags.keys(), ['FRACTIONS'])
+
+        # Other tags are read when they are looked up
+        errors = mesh.imesh.getTagHandle('ERRORS')
+        self.assertEqual(errors[mesh.getHex(0, 0, 0)].shape, (2,))
+        mesh.imesh.destroyTag(errors)
+        self.assertRaises(TagNotFoundError, mesh.imesh.getTagHandle, 'ERRORS')
+
+        tag = mesh.imesh.createTag('vals', 1, float)
+        tag[mesh.iterateHex('xyz')] = np.arange(27.)
+        copyfile = os.path.join(self.tmpdir, 'copy.h5m')
+        mesh.save(copyfile)
+        mesh.save(self.meshfile)
+
+        for filename in (copyfile, self.meshfile):
+            mesh = ArrayScdMesh.fromFile(filename)
+            self.assertEqual(mesh.imesh.getTagHandle('FRACTIONS').sizeValues,
+                             2)
+            self.assertRaises(TagNotFoundError, mesh.imesh.getTagHandle,
+                              'ERRORS')
+            self.assertEqual(list(mesh.getTagArray('vals').ravel()),
+                             range(27))
+            self.assertEqual(list(mesh.imesh.getTagHandle('MATS')
+                                  [mesh.scdset]), [0, 1])
+
+    def test_moab_load(self):
+        # Files written with h5py must load in MOAB, with the values written
+        if scdmesh.iMesh is None:
+            raise SkipTest('PyTAPS is not available')
+        h5m = H5mFile(self.meshfile)
+        isset = np.zeros(27, dtype=bool)
+        isset[[3, 20]] = True
+        h5m.write_tag('partial', tag_data(np.float64, 1, np.arange(27.), isset,
+                                          2.5, None))
+        mesh = ArrayScdMesh.fromFile(self.meshfile, tags=[])
+        tag = mesh.imesh.createTag('vals', 1, float)
+        tag[mesh.iterateHex('xyz')] = np.arange(27.)
+        tag = mesh.imesh.createTag('groups', 3, int)
+        tag[mesh.iterateHex('xyz')] = np.arange(81).reshape(27, 3)
+        mesh.imesh.destroyTag(mesh.imesh.getTagHandle('ERRORS'))
+        copyfile = os.path.join(self.tmpdir, 'copy.h5m')
+        mesh.save(copyfile)
+
+        sm = ScdMesh.fromFile(copyfile)
+        hexes = sm.iterateHex('xyz')
+        self.assertEqual(list(sm.imesh.getTagHandle('vals')[hexes]),
+                         range(27))
+        self.assertEqual(list(sm.imesh.getTagHandle('groups')[hexes[26]]),
+                         [78, 79, 80])
+        partial = sm.imesh.getTagHandle('partial')
+        self.assertEqual(list(partial[hexes[[3, 20]]]), [3, 20])
+        self.assertEqual(partial[sm.imesh.rootSet], 2.5)
+        self.assertEqual(sm.imesh.getTagHandle('FRACTIONS')[hexes[0]].shape,
+                         (2,))
+        self.assertRaises(TagNotFoundError, sm.imesh.getTagHandle, 'ERRORS')
+
+    def test_slabs(self):
+        mesh = ArrayScdMesh.fromFile(self.meshfile)
+        fractions = H5mFile(self.meshfile).read_tag('FRACTIONS').hexes
+        tag = mesh.imesh.getTagHandle('FRACTIONS')
+        for slab in mesh.iterateSlabs('y', 2):
+            # values are read from the file for the slab's hexes only
+            self.assertTrue(tag.source is not None)
+            self.assertTrue((slab.getTag('FRACTIONS') ==
+                             fractions[slab.hexes]).all())
+
+        # values of a writable mesh are written into the file slab by slab
+        mesh = ArrayScdMesh.fromFile(self.meshfile, writable=True)
+        for slab in mesh.iterateSlabs('x'):
+            slab.setTag('vals', slab.hexes * 2.0)
+            slab.setTag('FRACTIONS', np.zeros((len(slab), 2)))
+        self.assertFalse(mesh.imesh.getTagHandle('vals').modified)
+        data = H5mFile(self.meshfile).read_tag('vals')
+        self.assertEqual(list(data.hexes), range(0, 54, 2))
+        data = H5mFile(self.meshfile).read_tag('FRACTIONS')
+        self.assertFalse(data.hexes.any())
@@ -0,0 +1,416 @@
+from r2s.data_transfer import meshtal
+import gzip
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+# These directories are relative to scripts directory.
+thisdir = os.path.dirname(__file__)
+meshtal_orig = os.path.join(thisdir, "files_test_read_meshtal/meshtal_2tallies")
+
+# Reading a meshtal may write an index file next to it, and cache its
+# tallies, so the tests work on a copy of the meshtal in a temporary
+# directory, with the tally cache there too.
+tmpdir = None
+meshtal_file = None
+old_cache_dir = None
+
+
+def setup_module():
+    global tmpdir, meshtal_file, old_cache_dir
+    tmpdir = tempfile.mkdtemp()
+    meshtal_file = os.path.join(tmpdir, "meshtal")
+    shutil.copy(meshtal_orig, meshtal_file)
+    old_cache_dir = os.environ.get('R2S_CACHE_DIR')
+    os.environ['R2S_CACHE_DIR'] = os.path.join(tmpdir, "cache")
+
+
+def teardown_module():
+    if old_cache_dir is None:
+        del os.environ['R2S_CACHE_DIR']
+    else:
+        os.environ['R2S_CACHE_DIR'] = old_cache_dir
+    shutil.rmtree(tmpdir)
+
+
+class TestFindTallies(unittest.TestCase):
+
+    def test_find_tallies(self):
+        tally_numbers, tally_lines = meshtal.find_tallies(meshtal_file)
+        self.assertEqual(tally_numbers, ['4', '14'])
+        self.assertEqual(tally_lines, [5, 97])
+
+
+class TestIterTallies(unittest.TestCase):
+
+    def setUp(self):
+        self.tallies = list(meshtal.iter_tallies(meshtal_file))
+
+    def test_headers(self):
+        self.assertEqual(len(self.tallies), 2)
+        t4, t14 = self.tallies
+
+        self.assertEqual(t4.number, '4')
+        self.assertEqual(t4.particle, 'n')
+        for bounds in (t4.x_bounds, t4.y_bounds, t4.z_bounds):
+            self.assertEqual(bounds, [-15.0, -5.0, 5.0, 15.0])
+        self.assertEqual(t4.e_bounds, [0.0, 0.1, 1.0])
+        self.assertEqual(t4.spatial_points, 27)
+        # two energy bins plus the totals group
+        self.assertEqual(t4.e_bins, 3)
+
+        self.assertEqual(t14.number, '14')
+        self.assertEqual(t14.e_bounds, [0.0, 1.0e36])
+        # a single energy bin has no totals group
+        self.assertEqual(t14.e_bins, 1)
+
+    def test_data(self):
+        t4, t14 = self.tallies
+
+        self.assertEqual(len(t4.fluxes), 3)
+        self.assertEqual(len(t4.errors), 3)
+        self.assertEqual(len(t4.fluxes[0]), 27)
+        # first and last lines of each group
+        self.assertEqual(t4.fluxes[0][0], 4.38009E-04)
+        self.assertEqual(t4.errors[0][0], 2.01442E-01)
+        self.assertEqual(t4.fluxes[1][0], 5.71094E-06)
+        self.assertEqual(t4.errors[1][26], 6.46964E-01)
+        self.assertEqual(t4.fluxes[2][0], 4.43720E-04)
+
+        self.assertEqual(len(t14.fluxes), 1)
+        self.assertEqual(t14.fluxes[0][26], 4.13802E-04)
+        self.assertEqual(t14.errors[0][26], 1.98855E-01)
+
+    def test_data_array(self):
+        t4, t14 = self.tallies
+        self.assertEqual(t4.data.shape, (3, 27, 2))
+        self.assertEqual(t14.data.shape, (1, 27, 2))
+        self.assertEqual(t4.columns, 6)
+        self.assertEqual(t14.columns, 5)
+        self.assertEqual(t4.data[2, 26, 0], t4.fluxes[2][26])
+        self.assertEqual(t4.data[2, 26, 1], t4.errors[2][26])
+
+
+class TestDecodeBlock(unittest.TestCase):
+
+    def test_decode(self):
+        block = "  1.000E+00   -10.000   -10.000   -10.000 5.71094E-06 9.99500E-01\n" \
+                "   Total      -10.000   -10.000     0.000 8.52012E-04 1.33584E-01\n"
+        values = meshtal.decode_block(block, 2, 6)
+        self.assertEqual(values.shape, (2, 2))
+        self.assertEqual(list(values[0]), [5.71094E-06, 9.99500E-01])
+        self.assertEqual(list(values[1]), [8.52012E-04, 1.33584E-01])
+
+    def test_short_block(self):
+        block = "     10.000    10.000    10.000 4.13802E-04 1.98855E-01\n"
+        self.assertRaises(meshtal.MeshtalError,
+                          meshtal.decode_block, block, 2, 5)
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        idxfile = meshtal._index_filename(meshtal_file)
+        if os.path.exists(idxfile):
+            os.remove(idxfile)
+
+    def test_build_index(self):
+        index = meshtal.build_index(meshtal_file)
+        self.assertEqual([e['number'] for e in index], ['4', '14'])
+        self.assertEqual([e['line'] for e in index], [5, 97])
+
+        with open(meshtal_file, 'rb') as f:
+            for entry in index:
+                f.seek(entry['header'])
+                self.assertTrue(f.readline().startswith(' Mesh Tally Number'))
+                f.seek(entry['bounds'])
+                self.assertTrue(f.readline().startswith('    X direction:'))
+                f.seek(entry['data'])
+                first = f.readline()
+                self.assertEqual(len(first), entry['line_length'])
+                f.seek(entry['end'] - entry['line_length'])
+                self.assertEqual(f.readline().split()[-1], '1.98855E-01')
+
+    def test_sidecar(self):
+        idxfile = meshtal._index_filename(meshtal_file)
+        index = meshtal.load_index(meshtal_file)
+        self.assertTrue(os.path.exists(idxfile))
+        self.assertEqual(meshtal.load_index(meshtal_file), index)
+
+        # A stale sidecar is not used
+        with open(idxfile, 'w') as f:
+            f.write('{"version": 1, "size": 0, "mtime": 0, "tallies": []}')
+        self.assertEqual(meshtal.load_index(meshtal_file), index)
+
+    def test_no_sidecar(self):
+        meshtal.load_index(meshtal_file, use_sidecar=False)
+        self.assertFalse(os.path.exists(meshtal._index_filename(meshtal_file)))
+
+    def test_read_indexed_tally(self):
+        index = meshtal.load_index(meshtal_file)
+        tallies = list(meshtal.iter_tallies(meshtal_file))
+        for entry, tally in zip(index, tallies):
+            indexed = meshtal.read_indexed_tally(meshtal_file, entry)
+            self.assertEqual(indexed.number, tally.number)
+            self.assertEqual(indexed.e_bounds, tally.e_bounds)
+            self.assertTrue((indexed.data == tally.data).all())
+
+    def test_parallel(self):
+        index = meshtal.load_index(meshtal_file)
+        for entry in index:
+            tally = meshtal.read_indexed_tally(meshtal_file, entry)
+            parallel = meshtal.read_indexed_tally(meshtal_file, entry, 2)
+            self.assertEqual(parallel.data.shape, tally.data.shape)
+            self.assertTrue((parallel.data == tally.data).all())
+
+    def test_parallel_bad_group(self):
+        badmeshtal = os.path.join(tmpdir, "meshtal_badgroup")
+        with open(meshtal_file, 'r') as fr:
+            with open(badmeshtal, 'w') as fw:
+                fw.write(fr.read().replace('5.71094E-06', 'xxxxxxxxxxx'))
+        entry = meshtal.build_index(badmeshtal)[0]
+        self.assertRaises(meshtal.MeshtalError,
+                          meshtal.read_indexed_tally, badmeshtal,
+                          entry, 3)
+
+    def test_variable_width(self):
+        """Lines of differing lengths are indexed by reading them"""
+        varmeshtal = os.path.join(tmpdir, "meshtal_varwidth")
+        with open(meshtal_file, 'r') as fr:
+            with open(varmeshtal, 'w') as fw:
+                fw.write(fr.read().replace(' 1.83049E-02', '  1.83049E-02'))
+
+        index = meshtal.build_index(varmeshtal)
+        self.assertEqual([e['line'] for e in index], [5, 97])
+        self.assertEqual(index[0]['line_length'], None)
+        tally = meshtal.read_indexed_tally(varmeshtal, index[1])
+        self.assertEqual(tally.fluxes[0][13], 1.83049E-02)
+
+
+    def test_scan_tallies(self):
+        """A single pass reads the selected tallies and saves the index"""
+        scanned = list(meshtal.scan_tallies(meshtal_file,
+                                            lambda n, entry: n == 1))
+        self.assertEqual([e for e, t in scanned],
+                         meshtal.build_index(meshtal_file))
+        self.assertEqual([t is None for e, t in scanned], [True, False])
+        self.assertEqual(scanned[1][1].number, '14')
+        self.assertEqual(meshtal.saved_index(meshtal_file),
+                         [e for e, t in scanned])
+
+
+class TestReadTallies(unittest.TestCase):
+
+    def setUp(self):
+        meshtal.clear_cache()
+        idxfile = meshtal._index_filename(meshtal_file)
+        if os.path.exists(idxfile):
+            os.remove(idxfile)
+        # Count the times the meshtal is opened
+        self.opened = []
+        self.open_file = meshtal.open_file
+        def open_file(filename, *args):
+            self.opened.append(filename)
+            return self.open_file(filename, *args)
+        meshtal.open_file = open_file
+
+    def tearDown(self):
+        meshtal.open_file = self.open_file
+
+    def test_single_pass(self):
+        tallies = list(meshtal.read_tallies(meshtal_file, use_cache=False))
+        self.assertEqual([t.number for t in tallies], ['4', '14'])
+        self.assertEqual(len(self.opened), 1)
+        self.assertTrue(meshtal.saved_index(meshtal_file) is not None)
+
+    def test_cached(self):
+        select = lambda n, entry: entry['number'] == '14'
+        first = list(meshtal.read_tallies(meshtal_file, select,
+                                          use_cache=True))
+        self.assertEqual(len(self.opened), 1)
+        # The second read needs neither the meshtal nor a new index
+        second = list(meshtal.read_tallies(meshtal_file, select,
+                                           use_cache=True))
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual([t.number for t in second], ['14'])
+        self.assertTrue((first[0].data == second[0].data).all())
+
+
+class TestCompressed(unittest.TestCase):
+
+    def setUp(self):
+        self.gzmeshtal = os.path.join(tmpdir, "meshtal.gz")
+        with open(meshtal_file, 'rb') as fr:
+            fw = gzip.open(self.gzmeshtal, 'wb')
+            fw.write(fr.read())
+            fw.close()
+
+    def test_iter_tallies(self):
+        tallies = list(meshtal.iter_tallies(meshtal_file))
+        gztallies = list(meshtal.iter_tallies(self.gzmeshtal))
+        self.assertEqual([t.number for t in gztallies], ['4', '14'])
+        for tally, gztally in zip(tallies, gztallies):
+            self.assertTrue((gztally.data == tally.data).all())
+
+    def test_index(self):
+        index = meshtal.build_index(meshtal_file)
+        gzindex = meshtal.load_index(self.gzmeshtal)
+        # Offsets are those of the decompressed text
+        self.assertEqual(gzindex, index)
+        for entry in gzindex:
+            tally = meshtal.read_indexed_tally(meshtal_file, entry)
+            gztally = meshtal.read_indexed_tally(self.gzmeshtal, entry, 2)
+            self.assertTrue((gztally.data == tally.data).all())
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        meshtal.clear_cache()
+        self.index = meshtal.load_index(meshtal_file)
+
+    def _cache_files(self):
+        return [name for name in os.listdir(meshtal.cache_dir())
+                if name.endswith('.npz')]
+
+    def test_cached_tally(self):
+        for entry in self.index:
+            tally = meshtal.read_indexed_tally(meshtal_file, entry)
+            meshtal.read_cached_tally(meshtal_file, entry)
+            cached = meshtal.read_cached_tally(meshtal_file, entry)
+            self.assertEqual(cached.number, tally.number)
+            self.assertEqual(cached.particle, tally.particle)
+            self.assertEqual(cached.x_bounds, tally.x_bounds)
+            self.assertEqual(cached.e_bounds, tally.e_bounds)
+            self.assertEqual(cached.e_bins, tally.e_bins)
+            self.assertEqual(cached.columns, tally.columns)
+            self.assertTrue((cached.data == tally.data).all())
+        self.assertEqual(len(self._cache_files()), 2)
+
+    def test_cache_hit(self):
+        entry = self.index[0]
+        meshtal.read_cached_tally(meshtal_file, entry)
+        # Spoil the cached data, to tell whether the cache is used
+        cachefile = meshtal._cache_filename(meshtal_file, entry)
+        tally = meshtal._load_cached_tally(cachefile)
+        tally.data = tally.data * 0
+        meshtal._save_cached_tally(cachefile, tally)
+        cached = meshtal.read_cached_tally(meshtal_file, entry)
+        self.assertEqual(cached.fluxes[0][0], 0.0)
+
+        # A different content hash is a different cache key
+        tally = meshtal.read_cached_tally(meshtal_file, entry,
+                digest=meshtal.file_digest(meshtal_file))
+        self.assertEqual(tally.fluxes[0][0], 4.38009E-04)
+
+    def test_evict(self):
+        for entry in self.index:
+            meshtal.read_cached_tally(meshtal_file, entry)
+        files = self._cache_files()
+        self.assertEqual(len(files), 2)
+        sizes = [os.path.getsize(os.path.join(meshtal.cache_dir(), f))
+                 for f in files]
+        meshtal.evict_cache(max(sizes))
+        self.assertEqual(len(self._cache_files()), 1)
+        meshtal.clear_cache()
+        self.assertEqual(self._cache_files(), [])
+
+    def test_evict_keep(self):
+        for entry in self.index:
+            meshtal.read_cached_tally(meshtal_file, entry)
+        keep = meshtal._cache_filename(meshtal_file, self.index[0])
+        meshtal.evict_cache(0, keep=keep)
+        self.assertEqual(self._cache_files(), [os.path.basename(keep)])
+
+    def test_too_large(self):
+        # A tally larger than the whole cache is not cached, and does not
+        # evict the tallies already cached
+        meshtal.read_cached_tally(meshtal_file, self.index[0])
+        old_size = os.environ.get('R2S_CACHE_SIZE')
+        os.environ['R2S_CACHE_SIZE'] = '0'
+        try:
+            tally = meshtal.read_cached_tally(meshtal_file, self.index[1])
+        finally:
+            if old_size is None:
+                del os.environ['R2S_CACHE_SIZE']
+            else:
+                os.environ['R2S_CACHE_SIZE'] = old_size
+        self.assertEqual(tally.number, '14')
+        self.assertEqual(self._cache_files(), [os.path.basename(
+                meshtal._cache_filename(meshtal_file, self.index[0]))])
+
+
+class TestLazyTally(unittest.TestCase):
+
+    def setUp(self):
+        self.tallies = list(meshtal.iter_tallies(meshtal_file))
+
+    def _check_subset(self, lazy, full, groups, i, j, k):
+        data = full.data.reshape(full.e_bins, 3, 3, 3, 2)
+        indices = [lazy.groups.index(g) for g in groups]
+        expected = data[indices, i[0]:i[1], j[0]:j[1], k[0]:k[1]]
+        subset = lazy.read(groups, i, j, k)
+        self.assertEqual(subset.shape, (len(groups), expected[0].size / 2, 2))
+        self.assertTrue((subset == expected.reshape(subset.shape)).all())
+
+    def test_groups(self):
+        t4 = meshtal.open_tally(meshtal_file, 4)
+        self.assertEqual(t4.groups, [1, 2, 'total'])
+        self.assertEqual(t4.dims, (3, 3, 3))
+        t14 = meshtal.open_tally(meshtal_file, '14')
+        self.assertEqual(t14.groups, [1])
+        self.assertTrue((t14.read() == self.tallies[1].data).all())
+        self.assertRaises(meshtal.MeshtalError, t14.read, ['total'])
+        self.assertRaises(meshtal.MeshtalError,
+                          meshtal.open_tally, meshtal_file, 5)
+
+    def test_subsets(self):
+        lazy = meshtal.open_tally(meshtal_file, 4)
+        full = self.tallies[0]
+        self._check_subset(lazy, full, ['total'], (0, 3), (0, 3), (0, 3))
+        self._check_subset(lazy, full, ['total', 1], (1, 3), (0, 3), (0, 3))
+        self._check_subset(lazy, full, [2], (0, 2), (1, 2), (0, 3))
+        self._check_subset(lazy, full, [1, 2], (1, 2), (0, 3), (2, 3))
+        self.assertRaises(meshtal.MeshtalError, lazy.read, None, (2, 2))
+        self.assertRaises(meshtal.MeshtalError, lazy.read, None, (0, 4))
+
+    def test_bounds(self):
+        lazy = meshtal.open_tally(meshtal_file, 4)
+        self.assertEqual(lazy.bounds(j=(1, 3)),
+                ([-15.0, -5.0, 5.0, 15.0], [-5.0, 5.0, 15.0],
+                 [-15.0, -5.0, 5.0, 15.0]))
+
+    def test_variable_width(self):
+        varmeshtal = os.path.join(tmpdir, "meshtal_varwidth_lazy")
+        with open(meshtal_file, 'r') as fr:
+            with open(varmeshtal, 'w') as fw:
+                fw.write(fr.read().replace(' 1.83049E-02', '  1.83049E-02'))
+        lazy = meshtal.open_tally(varmeshtal, 4)
+        self.assertEqual(lazy.entry['line_length'], None)
+        self._check_subset(lazy, self.tallies[0], [1, 'total'],
+                           (1, 2), (0, 3), (2, 3))
+
+
+class TestArrays(unittest.TestCase):
+
+    def test_read_tally_arrays(self):
+        tally = list(meshtal.iter_tallies(meshtal_file))[0]
+        arrays = meshtal.read_tally_arrays(meshtal_file)
+        self.assertEqual(arrays.number, '4')
+        self.assertEqual(arrays.particle, 'n')
+        self.assertEqual(list(arrays.x_bounds), [-15.0, -5.0, 5.0, 15.0])
+        self.assertEqual(list(arrays.e_bounds), [0.0, 0.1, 1.0])
+        self.assertEqual(arrays.fluxes.shape, (3, 3, 3, 3))
+        self.assertEqual(arrays.errors.shape, (3, 3, 3, 3))
+        # Indexed [group, i, j, k]; z changes fastest in the meshtal
+        self.assertEqual(arrays.fluxes[0, 0, 0, 1], tally.fluxes[0][1])
+        self.assertEqual(arrays.fluxes[2, 2, 1, 0], tally.fluxes[2][21])
+        self.assertEqual(arrays.errors[1, 0, 1, 2], tally.errors[1][5])
+
+        arrays = meshtal.read_tally_arrays(meshtal_file, 14, use_cache=False)
+        self.assertEqual(arrays.fluxes.shape, (1, 3, 3, 3))
+        self.assertRaises(meshtal.MeshtalError, meshtal.read_tally_arrays,
+                          meshtal_file, 5)
@@ -2,6 +2,9 @@ import unittest
 import sys
 import os
 import itertools
+import random
+import shutil
+import tempfile
 import numpy
 
 try:
@@ -37,17 +40,48 @@ class mmGridHelperTest( unittest.TestCase) :
             self.assertTrue( all(pt[x] > 0 and pt[x] < 1.0 
                                  for x in (0,1)) )
 
+        # a given generator gives reproducible points
+        points = [list(mmgrid._random_square( 10, random.Random(5) )( 0, 1, 0, 1 ))
+                  for _ in range(2)]
+        self.assertEqual( points[0], points[1] )
+
+    def test_bin_segments(self):
+        # segments of materials 0, 2 and 1 from 0 to 0.5, 2.5 and 7.5
+        samples = mmgrid._bin_segments( [0, 1, 2, 4], [0.5, 2.0, 5.0],
+                                        [0, 2, 1], 3 )
+        check = [[0.5, 0, 0.5], [0, 0, 1.0], [0, 0.75, 0.25]]
+        self.assertTrue( numpy.allclose(samples, check) )
+
+        # a ray that ends within the grid
+        samples = mmgrid._bin_segments( [0, 1, 2], [1.5], [1], 2 )
+        self.assertTrue( numpy.allclose(samples, [[0, 1], [0, 0.5]]) )
+
+    def test_relative_errors(self):
+        # 4 rays: one voxel always in material 0, one half in each material
+        mats = numpy.array([[4.0, 0.0], [2.0, 2.0]])
+        rel = mmgrid._relative_errors( mats, mats, 4 )
+        self.assertTrue( numpy.allclose(rel, [[0, 0], [0.5, 0.5]]) )
+
 
 class mmGridTest( unittest.TestCase ):
     
     # must load dagmc geometry only once; use this alphabetically first name to ensure
-    # this function runs before other tests
+    # this function runs before other tests.  The geometry is loaded by main(), which
+    # is run here on a coarse grid as a smoke test
     def test__load(self):
         path = os.path.join( os.path.dirname( __file__ ), 'h5m_files/hemispheres.h5m' )
-        pydagmc.dagmc.load( path )
+        outdir = tempfile.mkdtemp()
+        try:
+            output = os.path.join( outdir, 'mmgrid_output.h5m' )
+            alara_geom = os.path.join( outdir, 'alara_geom' )
+            mmgrid.main( ['-d', '3', '-n', '2', '-o', output, '-a', alara_geom, path] )
+            self.assertTrue( os.path.exists(output) )
+            self.assertTrue( os.path.exists(alara_geom) )
+        finally:
+            shutil.rmtree( outdir )
 
     def test_matset(self):
-        """Test the prepare_materials and get_mata_id functions"""
+        """Test the prepare_materials, get_mat_id and get_volume_materials functions"""
         matdict = mmgrid.prepare_materials()
         self.assertEqual( matdict, 
                          {(0, 0.0): (0, 'matVOID'),
@@ -58,6 +92,10 @@ class mmGridTest( unittest.TestCase ):
         self.assertEqual( 1, mmgrid.get_mat_id(matdict,2) )
         self.assertEqual( 2, mmgrid.get_mat_id(matdict,4) )
 
+        vol_mats = mmgrid.get_volume_materials(matdict)
+        for vol in (1, 2, 4):
+            self.assertEqual( vol_mats[vol], mmgrid.get_mat_id(matdict,vol) )
+
     def test_rayframes(self):
 
         # a mesh with divisions at -1, 0, and 1 for all three dimensions
@@ -102,10 +140,60 @@ class mmGridTest( unittest.TestCase ):
                     sum(x['mats']), 1.0, 
                     msg='Normality at ijk={0}:\n'
                         '    sum({1}) = {2} != 1.0'.format(ijk, x['mats'], sum(x['mats'])))
+        # Rounding must not give negative variances, and NaN errors
+        self.assertTrue( numpy.isfinite(grid.grid['errs']).all() )
 
         grid.create_tags()
 
 
+    def test_mmgrid_generate_workers(self):
+        """Test that a seed gives the same grid with any number of workers"""
+        grid_side = [-5,-2.5,0,2.5,5]
+        grids = []
+        for workers in (1, 3):
+            grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+            grid.generate(3, False, workers, seed=42)
+            grids.append(grid.grid)
+
+        for field in ('mats', 'errs'):
+            self.assertTrue( (grids[0][field] == grids[1][field]).all() )
+
+    def test_mmgrid_generate_adaptive(self):
+        """Test sampling in batches up to an error tolerance"""
+        grid_side = [-5,-2.5,0,2.5,5]
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        grid.generate(4, tolerance=0.1, batch=2, seed=42)
+
+        # Each voxel gets at least two batches of rays from each direction
+        self.assertTrue( (grid.rays >= 3*2*2).all() )
+        self.assertTrue( (grid.rays <= 3*4**2).all() )
+        for ijk, x in numpy.ndenumerate(grid.grid):
+            self.assertAlmostEqual( sum(x['mats']), 1.0 )
+
+        self.assertRaises( mmgrid.mmGridError, grid.generate, 4, True,
+                           tolerance=0.1 )
+
+    def test_mmgrid_generate_adaptive_batch(self):
+        """Test that adaptive sampling refuses batches of a single ray"""
+        grid_side = [-5,-2.5,0,2.5,5]
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        self.assertRaises( mmgrid.mmGridError, grid.generate, 4,
+                           tolerance=0.1, batch=1 )
+
+    def test_mmgrid_generate_probe(self):
+        """Test that voxels probed as a single material are 100% of it"""
+        grid_side = [-5,-2.5,0,2.5,5]
+        grid = mmgrid.mmGrid( ScdMesh( *([grid_side]*3) ) )
+        grid.generate(3, probe=True, seed=42)
+
+        self.assertEqual( grid.homogeneous.shape, (4,4,4) )
+        for ijk, x in numpy.ndenumerate(grid.grid):
+            self.assertAlmostEqual( sum(x['mats']), 1.0 )
+            mat = grid.homogeneous[ijk]
+            if mat >= 0:
+                self.assertEqual( x['mats'][mat], 1.0 )
+                self.assertEqual( x['errs'][mat], 0.0 )
+
     def test_unequal_grid_size(self):
         """Test creating an mmgrid on a mesh with uneven grid spacing"""
         grid_side = [-3,0,.1,.2,3]
@@ -7,8 +7,15 @@ from tempfile import mkdtemp
 from shutil import copyfile
 import ConfigParser
 import contextlib
+import gzip
+import shutil
+
+from nose.plugins.skip import SkipTest
 
 from r2s_setup import R2S_CFG_Error
+from r2s import h5mfile
+from r2s.scdmesh import ScdMesh
+from r2s.grouptags import find_num_groups, get_group_values
 import r2s_step2 as s2
 
 
@@ -75,13 +82,14 @@ class TestLoadConfigParams(unittest.TestCase):
                     "cumulative = True\n" \
                     "add_fmesh_card = False\n"
                     "resample = True\n"
+                    "lazy_datafile = True\n"
                     )
             myNTF.seek(0) # Goes to beginning
 
             config = ConfigParser.SafeConfigParser()
             config.read(myNTF.name)
 
-            (opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, opt_cumulative, opt_phtnfmesh, resample, uni_resamp_all) = \
+            (opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, opt_cumulative, opt_phtnfmesh, resample, uni_resamp_all, lazy_datafile) = \
                     s2.load_config_params(config)
             # Check for correctness
             self.assertEqual(opt_isotope, 'u235')
@@ -93,6 +101,7 @@ class TestLoadConfigParams(unittest.TestCase):
             self.assertFalse(opt_phtnfmesh)
             self.assertTrue(resample)
             self.assertFalse(uni_resamp_all)
+            self.assertTrue(lazy_datafile)
 
     def test_load_config_params_badisotope(self):
         """Simulate a .cfg file and check that multiple isotopes in r2s.cfg
@@ -180,6 +189,68 @@ class TestHandlePhtnData(unittest.TestCase):
                     'v', False, False, False, False, False,
                     gammas=gammaNTF.name)
 
+    def test_handle_phtn_data_gzip(self):
+        """Tests that a gzipped phtn_src file gives the same 'gammas' file
+        """
+        tmpdir = mkdtemp()
+        try:
+            phtnfile_gz = os.path.join(tmpdir, "phtn_src.gz")
+            with open(self.phtnfile, 'rb') as fr:
+                fw = gzip.open(phtnfile_gz, 'wb')
+                fw.write(fr.read())
+                fw.close()
+            meshfile_gz = os.path.join(tmpdir, "mesh.h5m")
+            copyfile(self.meshfile, meshfile_gz)
+            gammas = os.path.join(tmpdir, "gammas")
+            gammas_gz = os.path.join(tmpdir, "gammas_gz")
+            # The name of a numbered cooling step is read from phtn_src
+            s2.handle_phtn_data(self.meshfile_new, self.phtnfile, 'TOTAL',
+                    '1', 'v', False, False, False, False, False,
+                    gammas=gammas, lazy_datafile=True)
+            s2.handle_phtn_data(meshfile_gz, phtnfile_gz, 'TOTAL',
+                    '1', 'v', False, False, False, False, False,
+                    gammas=gammas_gz, lazy_datafile=True)
+            with contextlib.nested(open(gammas), open(gammas_gz)) as (f, fgz):
+                lines, lines_gz = f.readlines(), fgz.readlines()
+            # The first line of 'gammas' starts with the date and time
+            self.assertTrue(" Cooling time: 1 s;" in lines_gz[0])
+            self.assertEqual(lines[0].split(';', 1)[1],
+                             lines_gz[0].split(';', 1)[1])
+            self.assertEqual(lines[1:], lines_gz[1:])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_handle_phtn_data_lazy(self):
+        """Tests that a data file written with h5py loads in MOAB, with the
+        same tag values as one written with PyTAPS
+        """
+        if h5mfile.h5py is None:
+            raise SkipTest('h5py is not available')
+        meshfile_lazy = self.meshfile_new + '.lazy.h5m'
+        copyfile(self.meshfile, meshfile_lazy)
+        try:
+            with NTF() as gammaNTF:
+                s2.handle_phtn_data(self.meshfile_new, self.phtnfile,
+                        'TOTAL', '1', 'v', False, False, False, False, False,
+                        gammas=gammaNTF.name)
+                s2.handle_phtn_data(meshfile_lazy, self.phtnfile,
+                        'TOTAL', '1', 'v', False, False, False, False, False,
+                        gammas=gammaNTF.name, lazy_datafile=True)
+            sm = ScdMesh.fromFile(self.meshfile_new)
+            sm_lazy = ScdMesh.fromFile(meshfile_lazy)
+            for prefix in ('phtn_src', 'n'):
+                num_groups = find_num_groups(sm.imesh, prefix)
+                self.assertTrue(num_groups > 0)
+                self.assertEqual(find_num_groups(sm_lazy.imesh, prefix),
+                                 num_groups)
+                values = get_group_values(sm.imesh, prefix,
+                                          sm.iterateHex('xyz'))
+                values_lazy = get_group_values(sm_lazy.imesh, prefix,
+                                               sm_lazy.iterateHex('xyz'))
+                self.assertTrue((values_lazy == values).all())
+        finally:
+            os.remove(meshfile_lazy)
+
 
 class TestGenMCNPP(unittest.TestCase):
     #
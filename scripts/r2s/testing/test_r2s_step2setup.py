@@ -7,6 +7,7 @@ from tempfile import mkdtemp
 from shutil import rmtree
 import ConfigParser
 import contextlib
+import gzip
 
 from r2s_setup import R2S_CFG_Error
 import r2s_step2setup as s2s
@@ -114,6 +115,24 @@ class TestGenIsoCoolLists(unittest.TestCase):
         self.assertEqual(isolist, ["a", "b", "c", "d"])
         self.assertEqual(coollist, ["shutdown", "1_d", "2 w", "99 y"])
 
+    def test_gen_iso_cool_lists_gzip(self):
+        """Test getting cooling times from a gzipped phtn_src file.
+        """
+        tmpdir = mkdtemp()
+        try:
+            phtn_src = os.path.join(tmpdir, "phtn_src.gz")
+            fw = gzip.open(phtn_src, 'wb')
+            fw.write(self.NTFcontents)
+            fw.close()
+            for coollistraw, expected in (("0, 2", ["shutdown", "2 w"]),
+                                          ("all", ["shutdown", "1_d", "2 w",
+                                              "99 y", "whoops", "too far"])):
+                isolist, coollist = s2s.gen_iso_cool_lists("a", coollistraw,
+                                                           phtn_src)
+                self.assertEqual(coollist, expected)
+        finally:
+            rmtree(tmpdir)
+
     def test_gen_iso_cool_lists4(self):
         """Test getting string cooling times from phtn_src file w/out of order cooling numbers.
         """
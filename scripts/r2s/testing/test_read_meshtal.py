@@ -0,0 +1,162 @@
+from r2s.data_transfer import read_meshtal
+from r2s.data_transfer import meshtal as meshtal_module
+from r2s.scdmesh import ScdMesh
+from itaps import iBase
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+
+# These directories are relative to scripts directory.
+thisdir = os.path.dirname(__file__)
+meshtal_orig = os.path.join(thisdir, "files_test_read_meshtal/meshtal_2tallies")
+
+# Reading a meshtal may write an index file next to it, and cache its
+# tallies, so the tests work on a copy of the meshtal in a temporary
+# directory, with the tally cache there too.
+tmpdir = None
+meshtal = None
+old_cache_dir = None
+
+
+def setup_module():
+    global tmpdir, meshtal, old_cache_dir
+    tmpdir = tempfile.mkdtemp()
+    meshtal = os.path.join(tmpdir, "meshtal")
+    shutil.copy(meshtal_orig, meshtal)
+    old_cache_dir = os.environ.get('R2S_CACHE_DIR')
+    os.environ['R2S_CACHE_DIR'] = os.path.join(tmpdir, "cache")
+
+
+def teardown_module():
+    if old_cache_dir is None:
+        del os.environ['R2S_CACHE_DIR']
+    else:
+        os.environ['R2S_CACHE_DIR'] = old_cache_dir
+    shutil.rmtree(tmpdir)
+
+
+class TestReadTallyAt(unittest.TestCase):
+
+    def test_read_tally_at(self):
+        tally = read_meshtal._read_tally_at(meshtal, 97)
+        self.assertEqual(tally.number, '14')
+        t14 = list(meshtal_module.iter_tallies(meshtal))[1]
+        self.assertEqual(list(tally.fluxes[0]), list(t14.fluxes[0]))
+
+        self.assertRaises(read_meshtal.MeshtalError,
+                          read_meshtal._read_tally_at, meshtal, 96)
+
+
+
+class TestMain(unittest.TestCase):
+    # Output files are written to a fresh working directory
+
+    def setUp(self):
+        self.olddir = os.getcwd()
+        self.outdir = tempfile.mkdtemp(dir=tmpdir)
+        os.chdir(self.outdir)
+
+    def tearDown(self):
+        os.chdir(self.olddir)
+        shutil.rmtree(self.outdir)
+
+    def test_tally_names(self):
+        read_meshtal.main(['read_meshtal.py', meshtal])
+        self.assertEqual(sorted(os.listdir(self.outdir)),
+                         ['flux_mesh_tally14.h5m', 'flux_mesh_tally4.h5m'])
+
+    def test_too_few_names(self):
+        # Nothing is written if an output name is missing for any tally
+        self.assertRaises(SystemExit, read_meshtal.main,
+                          ['read_meshtal.py', meshtal, '-o', 'tally4.h5m'])
+        self.assertEqual(os.listdir(self.outdir), [])
+
+
+class TestReadMeshtalTallies(unittest.TestCase):
+
+    def test_shared_mesh(self):
+        meshes = read_meshtal.read_meshtal_tallies(meshtal, norm={'14': 2.0})
+        self.assertEqual(meshes.keys(), ['4', '14'])
+        sm4, prefix4 = meshes['4']
+        sm14, prefix14 = meshes['14']
+
+        # Both tallies have the same bounds, so they share a mesh
+        self.assertTrue(sm4 is sm14)
+        self.assertEqual((prefix4, prefix14), ('n4', 'n14'))
+
+        hx = sm4.getHex(2, 2, 2)
+        tag = sm4.imesh.getTagHandle('n4_group_total')
+        self.assertAlmostEqual(tag[hx], 4.13802E-04)
+        tag = sm4.imesh.getTagHandle('n14_group_001')
+        self.assertAlmostEqual(tag[hx], 2 * 4.13802E-04)
+        tag = sm4.imesh.getTagHandle('n14_group_001_error')
+        self.assertAlmostEqual(tag[hx], 1.98855E-01)
+        tag = sm4.imesh.getTagHandle('n4_particle')
+        self.assertEqual(tag[sm4.imesh.rootSet], 1)
+
+    def test_subset(self):
+        meshes = read_meshtal.read_meshtal_tallies(meshtal, [14])
+        self.assertEqual(meshes.keys(), ['14'])
+        sm, prefix = meshes['14']
+        # A lone tally on its mesh uses the usual tag names
+        self.assertEqual(prefix, 'n')
+        sm.imesh.getTagHandle('n_group_001')
+        sm.imesh.getTagHandle('E_upper_bounds')
+
+        self.assertRaises(read_meshtal.MeshtalError,
+                          read_meshtal.read_meshtal_tallies, meshtal, [5])
+
+    def test_single_read(self):
+        """All requested tallies come from one opening of the meshtal"""
+        opened = []
+        open_file = meshtal_module.open_file
+        def counting_open(filename, *args):
+            opened.append(filename)
+            return open_file(filename, *args)
+        meshtal_module.open_file = counting_open
+        try:
+            meshes = read_meshtal.read_meshtal_tallies(meshtal, [4, 14],
+                                                       use_cache=False)
+        finally:
+            meshtal_module.open_file = open_file
+        self.assertEqual(meshes.keys(), ['4', '14'])
+        self.assertEqual(opened, [meshtal])
+
+
+class TestVectorTags(unittest.TestCase):
+
+    def test_vector_tags(self):
+        tally = list(meshtal_module.iter_tallies(meshtal))[1]
+        sm = read_meshtal.tally_to_scdmesh(tally, 2.0, vector=True)
+        hx = sm.getHex(2, 2, 2)
+        self.assertEqual(len(sm.imesh.getTagHandle('n_groups')[hx]), 1)
+        self.assertAlmostEqual(sm.imesh.getTagHandle('n_groups')[hx][0],
+                               2 * 4.13802E-04)
+        self.assertAlmostEqual(sm.imesh.getTagHandle('n_groups_error')[hx][0],
+                               1.98855E-01)
+        num_groups = sm.imesh.getTagHandle('n_num_groups')
+        self.assertEqual(num_groups[sm.imesh.rootSet], 1)
+        self.assertRaises(iBase.TagNotFoundError,
+                          sm.imesh.getTagHandle, 'n_group_001')
+
+
+class TestTagTallySubset(unittest.TestCase):
+
+    def test_sub_box(self):
+        lazy = meshtal_module.open_tally(meshtal, 4)
+        tally = list(meshtal_module.iter_tallies(meshtal))[0]
+
+        # Tagging part of a mesh with the whole tally's dimensions
+        sm = ScdMesh(*lazy.bounds())
+        read_meshtal.tag_tally_subset(lazy, sm, ['total'], i=(1, 3), norm=2.0)
+        tag = sm.imesh.getTagHandle('n_group_total')
+        self.assertAlmostEqual(tag[sm.getHex(2, 2, 2)], 2 * tally.fluxes[2][26])
+
+        # Tagging a mesh of just the sub-box
+        sm = ScdMesh(*lazy.bounds(k=(2, 3)))
+        read_meshtal.tag_tally_subset(lazy, sm, [1], k=(2, 3))
+        tag = sm.imesh.getTagHandle('n_group_001_error')
+        self.assertAlmostEqual(tag[sm.getHex(0, 0, 0)], tally.errors[0][2])
@@ -0,0 +1,96 @@
+import os
+import os.path
+import multiprocessing
+import shutil
+import tempfile
+import numpy as np
+import unittest
+
+from r2s import sharedmesh
+from r2s.arraymesh import ArrayScdMesh
+from r2s.sharedmesh import SharedMeshError
+
+
+def _tag_sum(hexes):
+    tag = sharedmesh.worker_mesh.imesh.getTagHandle('vals')
+    return float(tag[hexes].sum())
+
+
+def _child_attach(path, queue):
+    mesh = sharedmesh.attach(path)
+    queue.put((mesh.getDivisions('x'),
+               float(mesh.getTagArray('vals').sum())))
+
+
+class TestSharedMesh(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = ArrayScdMesh(range(4), [0, 1, 3], [0, 2, 3], mins=(1, 0, 0))
+        self.mesh.setTagArray('vals', np.arange(12.).reshape(3, 2, 2))
+        tag = self.mesh.imesh.createTag('vec', 2, int)
+        tag[self.mesh.iterateHex()] = np.arange(24).reshape(12, 2)
+
+    def test_attach(self):
+        with sharedmesh.publish(self.mesh, ['vals', 'vec']) as shared:
+            mesh = sharedmesh.attach(shared.path)
+            self.assertEqual(mesh.dims, self.mesh.dims)
+            self.assertEqual(mesh.getDivisions('y'), [0, 1, 3])
+            self.assertTrue((mesh.getHexVolumeArray() ==
+                             self.mesh.getHexVolumeArray()).all())
+            self.assertTrue((mesh.getTagArray('vals') ==
+                             self.mesh.getTagArray('vals')).all())
+            vec = mesh.imesh.getTagHandle('vec')
+            self.assertEqual(list(vec[5]), [10, 11])
+
+            # published arrays are read-only; new tags are private
+            self.assertRaises(ValueError, vec.__setitem__, 0, [1, 1])
+            mesh.imesh.createTag('own', 1, float)[0] = 1.0
+        self.assertFalse(os.path.exists(shared.path))
+        self.assertRaises(SharedMeshError, sharedmesh.attach, shared.path)
+
+    def test_workers(self):
+        shared = sharedmesh.publish(self.mesh, ['vals'])
+        try:
+            slabs = [s.hexes for s in self.mesh.iterateSlabs('x')]
+            pool = multiprocessing.Pool(2, sharedmesh.attach_worker,
+                                        (shared.path,))
+            sums = pool.map(_tag_sum, slabs)
+            pool.close()
+            pool.join()
+            self.assertEqual(sum(sums), 66.0)
+            # workers do not remove the published mesh
+            self.assertTrue(os.path.exists(shared.path))
+        finally:
+            shared.close()
+
+    def test_child_process(self):
+        queue = multiprocessing.Queue()
+        with sharedmesh.publish(self.mesh, ['vals']) as shared:
+            child = multiprocessing.Process(target=_child_attach,
+                                            args=(shared.path, queue))
+            child.start()
+            divs, total = queue.get(timeout=30)
+            child.join()
+            self.assertEqual(divs, [0, 1, 2, 3])
+            self.assertEqual(total, 66.0)
+        # closing the owner's mesh removes the published arrays
+        self.assertFalse(os.path.exists(shared.path))
+
+    def test_remove_stale(self):
+        directory = tempfile.mkdtemp()
+        try:
+            # a mesh left behind by a publishing process that has exited
+            child = multiprocessing.Process(target=os.getpid)
+            child.start()
+            child.join()
+            stale = os.path.join(directory,
+                                 'scdmesh-{0}-abc'.format(child.pid))
+            os.mkdir(stale)
+            with sharedmesh.publish(self.mesh, directory=directory) as shared:
+                self.assertFalse(os.path.exists(stale))
+                # meshes of live processes are kept
+                sharedmesh.remove_stale(directory)
+                self.assertTrue(os.path.exists(shared.path))
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
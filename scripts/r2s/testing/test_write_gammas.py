@@ -2,10 +2,14 @@ import unittest
 import os.path
 import itertools
 
+import numpy as np
+from nose.plugins.skip import SkipTest
+
+from r2s import h5mfile
 from r2s.data_transfer import read_alara_phtn
 from r2s.data_transfer import write_gammas
 from r2s.scdmesh import ScdMesh, ScdMeshError
-from itaps import iMesh, iBase
+from r2s.arraymesh import ArrayScdMesh
 
 
 thisdir = os.path.dirname(__file__)
@@ -158,3 +162,71 @@ class TestWriteGammas_Correct(unittest.TestCase):
         write_gammas.gen_gammas_file_from_h5m(self.sm, outfile, do_bias=True, cumulative=True)
         self.compare_gammas(outfile, gammas8)
     
+
+    def test_vox_cum_bias_slabs(self):
+        """Verify gammas file for voxel sampling, read a slab at a time"""
+        self.meshfile = meshfile_g
+        self.sm = ScdMesh.fromFile(self.meshfile)
+        write_gammas.gen_gammas_file_from_h5m(self.sm, outfile, do_bias=True,
+                cumulative=True, slab_width=1)
+        self.compare_gammas(outfile, gammas8)
+
+    def test_vox_cum_bias_array(self):
+        """Verify gammas file for voxel sampling from an ArrayScdMesh, whose
+        tags are read with h5py rather than PyTAPS"""
+        if h5mfile.h5py is None:
+            raise SkipTest('h5py is not available')
+        self.sm = ArrayScdMesh.fromFile(meshfile_g, tags=[])
+        write_gammas.gen_gammas_file_from_h5m(self.sm, outfile, do_bias=True,
+                cumulative=True, slab_width=1)
+        self.compare_gammas(outfile, gammas8)
+
+
+class TestSourceStrength(unittest.TestCase):
+    # Source strengths summed over a mesh of uneven widths, with the voxel
+    #  volumes taken from the mesh's volume array
+
+    def setUp(self):
+        self.sm = ArrayScdMesh([0, 1, 3], [0, 2, 5, 6], [-1, 0, 4])
+        # Voxel volumes in xyz order (z changing fastest)
+        self.expected = [dx * dy * dz for dx in (1, 2) for dy in (2, 3, 1)
+                         for dz in (1, 4)]
+        # Two groups; the second voxel of each x plane has no source
+        srcs = np.ones((2, 3, 2, 2))
+        srcs[:, 0, 1, :] = 0
+        self.sm.setTagArray('phtn_src_groups', srcs)
+
+    def tearDown(self):
+        if os.path.exists(totalsfile):
+            os.remove(totalsfile)
+
+    def test_voxel_subset(self):
+        voxels = self.sm.iterateHex('xyz')[[0, 5, 11]]
+        vols = write_gammas._voxel_volumes(self.sm.imesh, voxels)
+        self.assertEqual(vols, [self.expected[n] for n in (0, 5, 11)])
+
+    def test_voxels(self):
+        voxels = self.sm.iterateHex('xyz')[[1, 5, 11]]
+        total, volume, groups, vols = \
+                write_gammas.calc_total_source_strength(self.sm.imesh, voxels)
+        self.assertEqual(vols, [self.expected[n] for n in (1, 5, 11)])
+        self.assertEqual(groups, 2)
+        self.assertEqual(volume, vols[1] + vols[2])
+        self.assertEqual(total, 2 * volume)
+
+    def test_mesh(self):
+        active = [v for n, v in enumerate(self.expected) if n % 6 != 1]
+        total, volume, groups, vols = \
+                write_gammas.calc_total_source_strength(self.sm)
+        self.assertEqual(vols, self.expected)
+        self.assertEqual(volume, sum(active))
+        self.assertEqual(total, 2 * sum(active))
+
+    def test_slabs(self):
+        whole = write_gammas.calc_total_source_strength(self.sm)
+        slabs = write_gammas.calc_total_source_strength(self.sm, slab_width=1)
+        self.assertEqual(slabs, whole[:3] + (None,))
+
+    def test_mesh_and_voxels(self):
+        self.assertRaises(ValueError, write_gammas.calc_total_source_strength,
+                          self.sm, self.sm.iterateHex('xyz'))
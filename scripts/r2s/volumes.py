@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-from itaps import iBase, iMesh, iMeshExtensions
+try:
+    from itaps import iBase, iMesh
+except ImportError:
+    iBase = iMesh = None
 
 from numpy import cross, dot, sqrt
 from numpy.linalg import det
@@ -145,11 +145,42 @@ structuredmesh = True
 # also increase the runtime of r2s_step1.
 mmgrid_rays = 10
 
+# Number of processes used for the ray tracing of the macromaterial grid.
+#  The rays are split among the processes, and the grid obtained is the same
+#  with any number of processes.
+mmgrid_workers = 1
+
+# If not 0, rays are fired through each mesh row in batches, until the relative
+#  errors of the material fractions along the row are at most this tolerance
+#  (e.g. 0.05), or mmgrid_rays^2 rays have been fired.  Rows of a single
+#  material stop after two batches.
+mmgrid_tolerance = 0
+
+# If True, each voxel is first probed at its center and corners for a single
+#  material, and no rays are fired along mesh rows whose voxels all are one
+#  material.  Probes can miss thin features inside a voxel.
+mmgrid_probe = False
+
 # If gen_mmgrid is True, ray tracing is performed to generate the macromaterials
 #  grid during r2s_step1.py. If the macromaterial grid already exists, set this
 #  parameter to False to avoid re-running the ray tracing.
 gen_mmgrid = True
 
+# Number of processes used to parse the meshtal file. With more than one
+#  process, the energy groups of the tally are decoded in parallel.
+meshtal_workers = 1
+
+# If meshtal_cache is True, tallies read from the meshtal file are saved in a
+#  binary cache (by default in ~/.cache/r2s/meshtal; set the R2S_CACHE_DIR
+#  environment variable to change this), so later runs need not parse the
+#  meshtal file again.  Tallies larger than the cache size limit (2048 MB, or
+#  the R2S_CACHE_SIZE environment variable in MB) are not cached.
+meshtal_cache = False
+
+# If vector_tags is True, the neutron fluxes of all energy groups are tagged
+#  as one vector tag (n_groups) instead of one tag per group (n_group_###).
+vector_tags = False
+
 # If step2setup is True, runs the r2s_step2setup.py script at the end of 
 #  r2s_step1.py.  r2s_step2setup.py creates folders for all cooling steps
 #  and isotopes specified
@@ -184,18 +215,22 @@ gen_mmgrid = True
 # -uni_resamp_all toggles whether a resampled particle in uniform sampling
 #   is resampled over the entire problem, rather than within the selected voxel.
 #   This approach will result in an unfair game being played for most problems.
+# -if lazy_datafile is True (and h5py is installed), only the tags needed in
+#   step 2 are read from step1_datafile, and the new tags are written into it
+#   with h5py instead of PyTAPS.
 # Note: photon_isotope and photon_cooling can have multiple, comma 
 #  delimited entries for use in conjunction with the r2s_step2setup.py script.
 photon_isotope = TOTAL
 photon_cooling = 0
 sampling = v
-# Next six boolean values
+# Next seven boolean values
 photon_bias = False
 custom_ergbins = False
 cumulative = False
 add_fmesh_card = True
 resample = True
 uni_resamp_all = False
+lazy_datafile = False
 
 
 ###############################################################################
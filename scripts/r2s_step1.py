@@ -6,7 +6,7 @@ import ConfigParser
 
 from itaps import iMesh
 
-from r2s.data_transfer.read_meshtal import read_meshtal, find_tallies
+from r2s.data_transfer.read_meshtal import read_meshtal
 from r2s.data_transfer.write_alara_fluxin import write_alara_fluxin
 from r2s.data_transfer.write_alara_geom import write_alara_geom
 from r2s import mmgrid
@@ -97,7 +97,9 @@ def load_config_params(config):
     Returns
     -------
     A list of the following values taken from the .cfg file:
-    gen_mmgrid, mmgrid_rays, opt_step2setup, isscd
+    gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, meshtal_workers,
+    meshtal_cache, vector_tags, mmgrid_workers, mmgrid_tolerance,
+    mmgrid_probe
     """
     # This list stores (1) parameter names as listed in r2s.cfg; 
     # (2) their defaults; (3) which 'get' function to use for the parameter
@@ -105,7 +107,13 @@ def load_config_params(config):
             [ 'gen_mmgrid',     True,  config.getboolean],
             [ 'mmgrid_rays',    10,    config.getint],
             [ 'step2setup',     False, config.getboolean],
-            [ 'structuredmesh', True,  config.getboolean]
+            [ 'structuredmesh', True,  config.getboolean],
+            [ 'meshtal_workers', 1,    config.getint],
+            [ 'meshtal_cache',  False, config.getboolean],
+            [ 'vector_tags',    False, config.getboolean],
+            [ 'mmgrid_workers', 1,     config.getint],
+            [ 'mmgrid_tolerance', 0.0, config.getfloat],
+            [ 'mmgrid_probe',   False, config.getboolean]
             ]
 
     param_list = list()
@@ -119,15 +127,20 @@ def load_config_params(config):
             # Use default
             param_list.append( param[1])
 
-    (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd) = param_list
+    (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, meshtal_workers, \
+            meshtal_cache, vector_tags, mmgrid_workers, mmgrid_tolerance, \
+            mmgrid_probe) = param_list
 
-    return (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd)
+    return (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, meshtal_workers, \
+            meshtal_cache, vector_tags, mmgrid_workers, mmgrid_tolerance, \
+            mmgrid_probe)
 
 
 ###########################
 # Do step 1
 
-def handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd=True):
+def handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd=True,
+                   workers=1, use_cache=False, vector=False):
     """Read MCNP meshtal file and tag mesh
 
     Parameters
@@ -142,6 +155,12 @@ def handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd=True):
         If True, handle geometry as a structured mesh. Otherwise mesh is
         assumed to be unstructured and unstructured mesh tally results are
         assumed to exist on the mesh (Error raised if tag TALLY_TAG is missing).
+    workers : int
+        Number of processes used to decode the meshtal's energy groups.
+    use_cache : boolean
+        Whether to load the tally from, and save it to, the tally cache.
+    vector : boolean
+        Whether to tag the fluxes of all energy groups as one vector tag.
     """
     if not isscd: # is unstructured
         mesh = iMesh.Mesh()
@@ -155,14 +174,16 @@ def handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd=True):
             
         return mesh
 
+    # The first tally is read, in a single pass over the meshtal file
     print "Loading mesh tally file `{0}'".format(meshtal_file)
-    tally_numbers, tally_lines = find_tallies(meshtal_file)
     # If not regenerating the mmGrid info, attempt to load existing datafile
     if gen_mmgrid == False:
         print "Attempting to re-use existing ScdMesh file '{0}'".format(datafile)
         alt_sm = ScdMesh.fromFile(datafile)  # Note: ray tracing is done later
         try:
-            mesh = read_meshtal(meshtal_file, tally_lines[0], mesh=alt_sm)
+            mesh = read_meshtal(meshtal_file, None,
+                                workers=workers, use_cache=use_cache,
+                                smesh=alt_sm, vector=vector)
         except ScdMeshError:
             print "ERROR:"
             print "Existing mesh in '{0}' does not match mesh in '{1}'. " \
@@ -171,13 +192,15 @@ def handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd=True):
 
     else:
         print "Creating ScdMesh file '{0}' from scratch.".format(datafile)
-        mesh = read_meshtal(meshtal_file, tally_lines[0])
+        mesh = read_meshtal(meshtal_file, None, workers=workers,
+                            use_cache=use_cache, vector=vector)
 
     return mesh
 
 
 def handle_mesh_materials(mesh, mcnp_geom, gen_mmgrid=False, mmgrid_rays=10, 
-                          isscd=True):
+                          isscd=True, mmgrid_workers=1, mmgrid_tolerance=None,
+                          mmgrid_probe=False):
     """Tag the mesh with materials
 
     Parameters
@@ -193,6 +216,15 @@ def handle_mesh_materials(mesh, mcnp_geom, gen_mmgrid=False, mmgrid_rays=10,
     isscd : boolean
         If True, handle geometry as a structured mesh. Otherwise mesh is
         assumed to be unstructured and materials are based on voxel centers.
+    mmgrid_workers : integer
+        Number of processes to run mmgrid's ray tracing with
+    mmgrid_tolerance : float
+        If given (and not 0), rays are fired in batches until the relative
+        errors of the material fractions are at most mmgrid_tolerance, with
+        at most mmgrid_rays^2 rays per mesh row
+    mmgrid_probe : boolean
+        If True, voxels are probed for a single material first, and no rays
+        are fired along mesh rows of such voxels
     """
 
     print "Loading geometry file `{0}'".format(mcnp_geom)
@@ -209,7 +241,9 @@ def handle_mesh_materials(mesh, mcnp_geom, gen_mmgrid=False, mmgrid_rays=10,
         print "Will use {0} rays per mesh row".format(mmgrid_rays)
 
         grid = mmgrid.mmGrid( mesh )
-        grid.generate( mmgrid_rays, False )
+        grid.generate( mmgrid_rays, False, mmgrid_workers,
+                       tolerance=mmgrid_tolerance or None,
+                       probe=mmgrid_probe )
         grid.create_tags()
 
     else:
@@ -297,14 +331,17 @@ if __name__ == "__main__":
         (meshtal_file, mcnp_geom, alara_snippet, visfile, datafile, \
             fluxin, alara_geom, alara_matdict) = load_config_files(config)
 
-        (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd) = \
-                load_config_params(config)
+        (gen_mmgrid, mmgrid_rays, opt_step2setup, isscd, meshtal_workers, \
+                meshtal_cache, vector_tags, mmgrid_workers, \
+                mmgrid_tolerance, mmgrid_probe) = load_config_params(config)
 
         # Do step 1
-        mesh = handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd)
+        mesh = handle_meshtal(meshtal_file, gen_mmgrid, datafile, isscd,
+                              meshtal_workers, meshtal_cache, vector_tags)
 
         handle_mesh_materials( \
-                mesh, mcnp_geom, gen_mmgrid, mmgrid_rays, isscd)
+                mesh, mcnp_geom, gen_mmgrid, mmgrid_rays, isscd,
+                mmgrid_workers, mmgrid_tolerance, mmgrid_probe)
 
         save_mesh(mesh, datafile, visfile)
 
@@ -2,11 +2,15 @@
 
 import sys
 import ConfigParser
+import os
 import os.path
 
 from r2s.data_transfer import read_alara_phtn, write_gammas
 from r2s import mcnp_n2p
 from r2s.scdmesh import ScdMesh, ScdMeshError
+from r2s.arraymesh import ArrayScdMesh
+from r2s import h5mfile
+from r2s.fileio import open_file
 from itaps import iBase, iMesh, iMeshExtensions
 from r2s_setup import get_input_file, FileMissingError, R2S_CFG_Error
 
@@ -59,7 +63,7 @@ def load_config_params(config):
     -------
     A list of the following values taken from the .cfg file:
     opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, 
-    opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all
+    opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all, lazy_datafile
     """
 
     # This list stores (1) parameter names as listed in r2s.cfg; 
@@ -73,7 +77,8 @@ def load_config_params(config):
             [ 'cumulative'    , False,   config.getboolean],
             [ 'add_fmesh_card', True,    config.getboolean],
             [ 'resample'      , False,   config.getboolean],
-            [ 'uni_resamp_all', False,   config.getboolean]
+            [ 'uni_resamp_all', False,   config.getboolean],
+            [ 'lazy_datafile' , False,   config.getboolean]
             ] 
 
     param_list = list()
@@ -88,8 +93,8 @@ def load_config_params(config):
             param_list.append( param[1])
 
     (opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, \
-            opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all \
-            ) = param_list
+            opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all, \
+            lazy_datafile) = param_list
 
     # Check for multiple comma delimited values; raise error if this is found
     if len(opt_isotope.split(",")) != 1:
@@ -100,14 +105,14 @@ def load_config_params(config):
         raise R2S_CFG_Error("r2s.cfg entry 'photon_cooling' contains " \
                 "multiple values. r2s_step2.py only uses a single value.")
 
-    return (opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all)
+    return (opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all, lazy_datafile)
 
 
 ###########################
 # Do step 2
 def handle_phtn_data(datafile, phtn_src, opt_isotope, opt_cooling,  \
         opt_sampling, opt_bias, opt_cumulative, cust_ergbins, 
-        resample, uni_resamp_all, gammas="gammas"):
+        resample, uni_resamp_all, gammas="gammas", lazy_datafile=False):
     """Loads phtn_src data, tags this to mesh, and generates 'gammas' file.
 
     Parameters
@@ -140,6 +145,9 @@ def handle_phtn_data(datafile, phtn_src, opt_isotope, opt_cooling,  \
         potential to result in an unfair game.
     gammas : string (optional)
         File name for 'gammas' file. Defaults to 'gammas'.
+    lazy_datafile : boolean (optional)
+        If true and h5py is available, read and write the data file with
+        h5py instead of PyTAPS; see the notes.
 
     Returns
     -------
@@ -149,10 +157,19 @@ def handle_phtn_data(datafile, phtn_src, opt_isotope, opt_cooling,  \
     Notes
     -----
     Only creates gammas file if mesh is an ScdMesh.
+
+    With lazy_datafile (and h5py), the mesh is an ArrayScdMesh, and only
+    the tags needed here are read from the data file (see r2s.h5mfile).  The
+    new tags are written into a copy of the data file, keeping its other
+    tags (e.g. neutron fluxes) as they are, and the copy then replaces the
+    data file, so that the data file is never left partly written.
     """
     print "Loading step one data file '{0}'".format(datafile)
     try:
-        mesh = ScdMesh.fromFile(datafile)
+        if lazy_datafile and h5mfile.h5py is not None:
+            mesh = ArrayScdMesh.fromFile(datafile, tags=[])
+        else:
+            mesh = ScdMesh.fromFile(datafile)
     except ScdMeshError:
         mesh = iMesh.Mesh()
         mesh.load(datafile)
@@ -164,9 +181,14 @@ def handle_phtn_data(datafile, phtn_src, opt_isotope, opt_cooling,  \
 
     print "Saving photon source information to '{0}'".format(datafile)
     if isinstance(mesh, ScdMesh):
-        mesh.imesh.save(datafile)
+        if isinstance(mesh, ArrayScdMesh):
+            tmpfile = datafile + '.{0}.tmp'.format(os.getpid())
+            mesh.save(tmpfile)
+            os.rename(tmpfile, datafile)
+        else:
+            mesh.imesh.save(datafile)
 
-        with open(phtn_src, 'r') as fr:
+        with open_file(phtn_src, 'r') as fr:
             try:
                 coolingstepstring = read_alara_phtn.get_cooling_step_name( \
                     opt_cooling, fr)[0]
@@ -243,13 +265,13 @@ if __name__ == "__main__":
                 load_config_files(config)
 
         (opt_isotope, opt_cooling, opt_sampling, opt_ergs, opt_bias, \
-                opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all) = \
-                load_config_params(config)
+                opt_cumulative, opt_phtnfmesh, resampling, uni_resamp_all, \
+                lazy_datafile) = load_config_params(config)
 
         # Do step 2
         mesh = handle_phtn_data(datafile, phtn_src, opt_isotope, opt_cooling, \
                 opt_sampling, opt_bias, opt_cumulative, opt_ergs, resampling, \
-                uni_resamp_all, gammas)
+                uni_resamp_all, gammas, lazy_datafile)
 
         gen_mcnp_p(mesh, mcnp_p_problem, mcnp_n_problem, opt_phtnfmesh)
 
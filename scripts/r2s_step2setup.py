@@ -9,6 +9,7 @@ import ConfigParser
 from time import gmtime, strftime
 from shutil import copy
 from r2s_setup import R2S_CFG_Error
+from r2s.fileio import open_file
 
 
 def load_configs(config):
@@ -84,7 +85,7 @@ def gen_iso_cool_lists(opt_isotope, opt_cooling, phtn_src):
     try:
         list_cool_needed = [int(time) for time in cool_list]
         list_cool_needed.sort()
-        with open(phtn_src, 'r') as fr:
+        with open_file(phtn_src, 'r') as fr:
             linecnt = -1
             isotope = ""
             firstisotope = ""
@@ -104,7 +105,7 @@ def gen_iso_cool_lists(opt_isotope, opt_cooling, phtn_src):
     except ValueError:
         if isinstance(cool_list[0], basestring):
             # Get all cooling steps in phtn_src
-            with open(phtn_src, 'r') as fr:
+            with open_file(phtn_src, 'r') as fr:
                 lineparts = fr.readline().split("\t")
                 all_cool_list = list()
                 isotope = lineparts[0]
@@ -10,14 +10,79 @@
 # The script will automatically search for a tag in the for tag_name+_error.
 # If it exists, the error value will be appended to the answer:
 # value (plus/minus) error
+#
+# With the -t TALLY option, a meshtal file can be given in place of the
+# structured mesh; only the requested value is read from tally TALLY.
+# tag_name is then the name read_meshtal.py would give the tag, e.g.
+# n_group_total or n_group_003.
+#
+# With the -c option, x_value, y_value and z_value are coordinates of a
+# point, and the value of the voxel containing the point is printed.
+#
+# With the -p POINTS option, the values are printed for every point listed
+# in the file POINTS (one line of x y z coordinates per point), e.g. detector
+# or dose point locations; only structured_mesh and tag_name are then given.
+# Points outside the mesh get the value nan.
 # 
 ###############################################################################
 
 import linecache
 from optparse import OptionParser
 import sys
+import numpy as np
 from itaps import iMesh, iBase
 from r2s.scdmesh import ScdMesh
+from r2s.arraymesh import ArrayScdMesh
+from r2s.data_transfer.meshtal import open_tally
+
+def sample_values(sm, points, tag_name, outside='raise'):
+    """Return the values of a tag in the voxels containing a list of points
+
+    Parameters
+    ----------
+    sm : ScdMesh
+        Structured mesh holding the tag.
+    points : array_like of shape (N, 3)
+        x, y and z coordinates of the points.
+    tag_name : string
+        Name of the tag.
+    outside : {'raise', 'nan'}, optional
+        For points outside the mesh, raise ScdMeshError, or give values (and
+        errors) of nan.
+
+    Returns
+    -------
+    values : array of N floats
+    errors : array of N floats, or None
+        The values of the tag tag_name+'_error', if the mesh has it.
+    """
+    loc = sm.locate(points, 'raise' if outside == 'raise' else 'clip')
+    results = []
+    for name in (tag_name, tag_name + '_error'):
+        try:
+            tag = sm.imesh.getTagHandle(name)
+        except iBase.TagNotFoundError:
+            results.append(None)
+            continue
+        values = np.array(tag[loc.hexes], dtype=float)
+        values[~loc.inside] = np.nan
+        results.append(values)
+    if results[0] is None:
+        raise iBase.TagNotFoundError(tag_name)
+    return results[0], results[1]
+
+
+def print_point_values(sm, points, tag_name):
+    """Print the values of a tag at each of a list of points"""
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    values, errors = sample_values(sm, points, tag_name, outside='nan')
+    for n, point in enumerate(points):
+        line = ' '.join(str(x) for x in point) + ' ' + str(values[n])
+        if errors is None:
+            print line
+        else:
+            print line, u"\u00B1", errors[n]
+
 
 def print_value(sm, x, y, z, tag_name):
     voxel=sm.getHex(x,y,z)
@@ -30,26 +95,70 @@ def print_value(sm, x, y, z, tag_name):
         print ans
 
 
+def print_meshtal_value(meshtal, tally_number, x, y, z, tag_name,
+                        coords=False):
+    tally = open_tally(meshtal, tally_number)
+    if coords:
+        # locate the point on a mesh of the tally's bounds
+        sm = ArrayScdMesh(tally.header.x_bounds, tally.header.y_bounds,
+                          tally.header.z_bounds)
+        x, y, z = sm.locate([[x, y, z]]).ijk[0]
+    group = tag_name.rsplit('_group_', 1)[-1]
+    if group != 'total':
+        group = int(group)
+    ans, error = tally.read([group], (x, x + 1), (y, y + 1), (z, z + 1))[0, 0]
+    print ans, u"\u00B1", error
+
 
 def main(arguments=None):
 
     parser = OptionParser\
-             (usage='%prog structured_mesh x_value y_value z_value tag_name')
+             (usage='%prog structured_mesh x_value y_value z_value tag_name\n'
+                    '       %prog -p POINTS structured_mesh tag_name')
 
     #parser.add_option('-o', dest='fluxin_name', default='ALARAflux.in',\
     #    help='Name of ALARA fluxin output file, default=%default')
+    parser.add_option('-t', dest='tally', default=None,
+        help='Read the value from tally TALLY of a meshtal file, given in\
+              place of the structured mesh')
+    parser.add_option('-c', action='store_true', dest='coords', default=False,
+        help='Take x_value, y_value and z_value as the coordinates of a\
+              point rather than as voxel indices')
+    parser.add_option('-p', dest='points', default=None,
+        help='Print the values at every point (x y z per line) in the\
+              file POINTS')
 
     (opts, args) = parser.parse_args( arguments )
 
+    if opts.points:
+        if len(args) != 3 or opts.tally:
+            parser.error\
+            ( '\nNeed exactly 2 arguments with -p: run with -h for usage' )
+        sm=ScdMesh.fromFile(args[1])
+        print_point_values(sm, np.loadtxt(opts.points, ndmin=2), args[2])
+        return
+
     if len(args) != 6 :
         parser.error\
         ( '\nNeed exactly 5 arguments: run with -h flag for usage' )
 
-    
+    if opts.coords:
+        x, y, z = [float(a) for a in args[2:5]]
+    else:
+        x, y, z = [int(a) for a in args[2:5]]
+
+    if opts.tally:
+        print_meshtal_value(args[1], opts.tally, x, y, z, args[5],
+                            opts.coords)
+        return
+
     #Load Structured mesh from file
     sm=ScdMesh.fromFile(args[1])
 
-    print_value(sm, int(args[2]), int(args[3]), int(args[4]), args[5])
+    if opts.coords:
+        x, y, z = sm.locate([[x, y, z]]).ijk[0]
+
+    print_value(sm, x, y, z, args[5])
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -2,13 +2,18 @@
 #python imports
 import linecache
 from optparse import OptionParser
+import os
+import shutil
 import sys
 import datetime
+from itertools import izip
+import numpy as np
 # itaps imports
 from itaps import iMesh
 from itaps import iBase
 # r2s imports
 from r2s.scdmesh import ScdMesh
+from r2s.arraymesh import ArrayScdMesh
 from tools import h5m_to_wwinp
 
 
@@ -57,7 +62,7 @@ def gen_e_group_names(flux_mesh, totals_bool):
     return e_group_names
 
 ################################################################################
-def find_max_fluxes(flux_mesh, e_group_names):
+def find_max_fluxes(flux_mesh, e_group_names, slab_width=None):
     """
     This function reads a flux mesh and returns a vector of maximum fluxes for 
     each energy group.
@@ -70,18 +75,18 @@ def find_max_fluxes(flux_mesh, e_group_names):
         and E_group_bounds (vector of energy upper bounds).
     e_group_names : vector of energy names
         In the form X_group_YYY or X_group_total.
+    slab_width : int, optional
+        Number of x planes of voxels to read fluxes for at a time; by default
+        the fluxes of the whole mesh are read at once.
         
     """
 
 
     max_fluxes = [0]*len(e_group_names)
-    for i, e_group_name in enumerate(e_group_names):
-
-        for flux_voxel in flux_mesh.iterateHex('xyz'):
-            flux = flux_mesh.imesh.getTagHandle(e_group_name)[flux_voxel]
-
-            if flux > max_fluxes[i]:
-                max_fluxes[i] = flux
+    for slab in flux_mesh.iterateSlabs('x', slab_width):
+        for i, e_group_name in enumerate(e_group_names):
+            fluxes = slab.getTag(e_group_name)
+            max_fluxes[i] = max(max_fluxes[i], float(fluxes.max()))
 
     return max_fluxes
 
@@ -103,15 +108,20 @@ def create_ww_mesh(flux_mesh, e_group_names):
         
     """
 
-    ww_mesh = ScdMesh(flux_mesh.getDivisions('x'),\
-                       flux_mesh.getDivisions('y'),\
-                       flux_mesh.getDivisions('z'))
+    # an array-backed flux mesh gets an array-backed ww mesh
+    if isinstance(flux_mesh, ArrayScdMesh):
+        mesh_class = ArrayScdMesh
+    else:
+        mesh_class = ScdMesh
+    ww_mesh = mesh_class(flux_mesh.getDivisions('x'),\
+                         flux_mesh.getDivisions('y'),\
+                         flux_mesh.getDivisions('z'))
 
     # create ww tags
+    voxels = ww_mesh.iterateHex('xyz')
     for e_group_name in e_group_names:
             ww_tag = ww_mesh.imesh.createTag('ww_{0}'.format(e_group_name), 1, float)
-            for voxel in ww_mesh.iterateHex('xyz'):
-                ww_tag[voxel] = 0
+            ww_tag[voxels] = np.zeros(len(voxels))
 
     # create e_upper_bound tags
     e_upper_bounds = \
@@ -132,7 +142,8 @@ def create_ww_mesh(flux_mesh, e_group_names):
 
 ################################################################################
 
-def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None):
+def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None,
+          slab_width=None):
     """
     This function reads a flux mesh and an optional preexisting ww mesh, preforms
     the MAGIC algorithm and returns the resulting weight window mesh.
@@ -157,6 +168,9 @@ def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None):
         lower bounds for subsequent iterations.  
     ww_mesh : ScdMesh
         A preexisting weight window mesh to apply MAGIC to.      
+    slab_width : int, optional
+        Number of x planes of voxels to apply MAGIC to at a time; by default
+        the whole mesh is done at once.
     """
 
     tolerance = float(tolerance)
@@ -164,7 +178,7 @@ def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None):
 
     e_group_names = gen_e_group_names(flux_mesh, totals_bool)
 
-    max_fluxes = find_max_fluxes(flux_mesh, e_group_names)
+    max_fluxes = find_max_fluxes(flux_mesh, e_group_names, slab_width)
     
     if ww_mesh == None:
         print "\tNo WW mesh file supplied; generating one based on meshtal"
@@ -188,25 +202,27 @@ def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None):
         print "\tSupplied meshes confirmed to have same dimensions"
 
 
-    # iterate through all voxels and energy groups and apply MAGIC  
-    flux_voxels = flux_mesh.iterateHex('xyz')
-    ww_voxels = ww_mesh.iterateHex('xyz')
+    # iterate through slabs of voxels and energy groups and apply MAGIC
+    flux_slabs = flux_mesh.iterateSlabs('x', slab_width)
+    ww_slabs = ww_mesh.iterateSlabs('x', slab_width)
 
-    for (flux_voxel, ww_voxel) in zip(flux_voxels, ww_voxels):
+    for (flux_slab, ww_slab) in izip(flux_slabs, ww_slabs):
 
         for i, e_group_name in enumerate(e_group_names):
 
-            flux = flux_mesh.imesh.getTagHandle(e_group_name)[flux_voxel]
-            error = flux_mesh.imesh.getTagHandle(e_group_name + '_error')[flux_voxel]
-            ww = ww_mesh.imesh.getTagHandle('ww_{0}'.format(e_group_name))[ww_voxel]
+            flux = flux_slab.getTag(e_group_name)
+            error = flux_slab.getTag(e_group_name + '_error')
+            ww = np.array(ww_slab.getTag('ww_{0}'.format(e_group_name)),
+                          dtype=float)
+
+            apply = (error < tolerance) & (error != 0) & (ww != -1)
+            ww[apply] = flux[apply]/(2*max_fluxes[i]) # apply magic method
 
-            if error < tolerance and error != 0 and ww != -1:
-                ww_mesh.imesh.getTagHandle('ww_{0}'.format(e_group_name))[ww_voxel]\
-                     = flux/(2*max_fluxes[i]) # apply magic method
+            if ww_bool == False:
+                null = ~apply & ((error > tolerance) | (error == 0.0))
+                ww[null] = null_value
 
-            elif ww_bool == False and (error > tolerance or error == 0.0):
-                ww_mesh.imesh.getTagHandle('ww_{0}'.format(e_group_name))[ww_voxel] \
-                    = null_value
+            ww_slab.setTag('ww_{0}'.format(e_group_name), ww)
 
     return ww_mesh
 
@@ -214,7 +230,7 @@ def magic(flux_mesh, totals_bool, null_value, tolerance, ww_mesh=None):
 ################################################################################
 
 def write_magic(flux_mesh_filename, ww_inp_mesh_filename, totals_bool, \
-                null_value, output_mesh, tolerance):
+                null_value, output_mesh, tolerance, slab_width=None):
     """
     This function takes the filename of the flux mesh and optional wieght window
     mesh, as well necessary parameter, sends them to the magic funtion and
@@ -242,18 +258,39 @@ def write_magic(flux_mesh_filename, ww_inp_mesh_filename, totals_bool, \
         lower bounds for subsequent iterations.  
     ww_inp_mesh_filename : ScdMesh file name
         A preexisting weight window mesh to apply MAGIC to.      
+    slab_width : int, optional
+        If given, the meshes are read as ArrayScdMesh objects and MAGIC is
+        applied to this many x planes of voxels at a time, so that fluxes
+        are read from the flux mesh file one slab at a time.  A preexisting
+        weight window mesh is then copied to output_mesh first, and its
+        weight windows are written into the copy slab by slab.
     """
 
-    flux_mesh = ScdMesh.fromFile(flux_mesh_filename)
+    if slab_width is None:
+        flux_mesh = ScdMesh.fromFile(flux_mesh_filename)
 
-    if ww_inp_mesh_filename != None:
-        ww_inp_mesh = ScdMesh.fromFile(ww_inp_mesh_filename)
+        if ww_inp_mesh_filename != None:
+            ww_inp_mesh = ScdMesh.fromFile(ww_inp_mesh_filename)
+
+        else:
+            ww_inp_mesh = None
 
     else:
-        ww_inp_mesh = None
+        flux_mesh = ArrayScdMesh.fromFile(flux_mesh_filename, tags=[])
+
+        if ww_inp_mesh_filename != None:
+            if not (os.path.exists(output_mesh) and
+                    os.path.samefile(ww_inp_mesh_filename, output_mesh)):
+                shutil.copyfile(ww_inp_mesh_filename, output_mesh)
+            ww_inp_mesh = ArrayScdMesh.fromFile(output_mesh, tags=[],
+                                                writable=True)
+
+        else:
+            ww_inp_mesh = None
    
 
-    ww_mesh = magic(flux_mesh, totals_bool, null_value, tolerance, ww_inp_mesh)
+    ww_mesh = magic(flux_mesh, totals_bool, null_value, tolerance, ww_inp_mesh,
+                    slab_width)
     ww_mesh.scdset.save(output_mesh)
     print "\tWrote WW mesh file '{0}'".format(output_mesh)
 
@@ -289,6 +326,11 @@ def main( arguments = None ):
               creating ww files from MAGIC or \
               overwriting existing ww values, default=%default')
 
+    parser.add_option('-s', dest='slab_width', type='int', default=None,\
+        help='Apply MAGIC to this many x planes of voxels at a time, \
+              reading fluxes from the flux mesh one slab at a time, \
+              default=%default')
+
     (opts, args) = parser.parse_args( arguments )
 
     if len(args) != 1:
@@ -297,7 +339,7 @@ def main( arguments = None ):
 
 
     write_magic(args[0], opts.ww_mesh, opts.totals_bool, opts.null_value, \
-                opts.output_mesh, opts.tolerance)
+                opts.output_mesh, opts.tolerance, opts.slab_width)
 
 
 
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+###############################################################################
+# This script merges the meshtal files of independent MCNP runs of the same
+# problem (e.g. runs with different random number seeds) into one meshtal.
+#
+# Each tally's results are combined with history-weighted statistics: the
+# merged result is the mean over all histories of all runs, and the merged
+# relative error is that of the pooled histories, as MCNP would have reported
+# for a single run of the combined length.
+#
+# The meshtals are read one tally at a time, one file at a time, so memory
+# use depends on the size of the largest tally but not on the number of files.
+###############################################################################
+
+#python imports
+from optparse import OptionParser
+import itertools
+import os
+import sys
+import numpy as np
+# r2s imports
+from r2s.data_transfer.meshtal import MeshtalError, load_index, \
+        read_histories, read_indexed_tally, group_names
+from r2s.fileio import open_file
+
+
+################################################################################
+def history_sums(tally, histories):
+    """Return the sums of scores and of squared scores behind a tally's results
+
+    For a result x (the mean score per history) with relative error R over N
+    histories, the sum of scores is N x, and the sum of squared scores is
+    N (x^2 + (N - 1) (R x)^2).
+
+    Parameters
+    ----------
+    tally : MeshtalTally object
+        Tally whose results have been read.
+    histories : float
+        Number of histories the tally's results are normalized by.
+
+    Returns
+    -------
+    sum1, sum2 : arrays of shape (e_bins, spatial_points)
+        The sums of scores and of squared scores.
+    """
+    x = tally.fluxes
+    sum1 = histories * x
+    sum2 = histories * (x**2 + (histories - 1) * (tally.errors * x)**2)
+    return sum1, sum2
+
+
+def sums_to_results(sum1, sum2, histories):
+    """Return results and relative errors from sums of scores
+
+    Parameters
+    ----------
+    sum1, sum2 : arrays
+        Sums of scores and of squared scores over all histories.
+    histories : float
+        Total number of histories.
+
+    Returns
+    -------
+    results, errors : arrays
+        The mean score per history, and its relative error.  The relative
+        error is 0 wherever the result is 0.
+    """
+    results = sum1 / histories
+    variance = (sum2 / histories - results**2) / max(histories - 1, 1)
+    # Round-off can make the variance of a constant score slightly negative
+    sigma = np.sqrt(np.maximum(variance, 0))
+    errors = np.zeros_like(results)
+    nonzero = results != 0
+    errors[nonzero] = sigma[nonzero] / np.abs(results[nonzero])
+    return results, errors
+
+
+def iter_merged_tallies(meshtals):
+    """Generator: yield each tally of several meshtals, merged across files
+
+    The meshtals must contain the same tallies, in the same order, with the
+    same bounds.
+
+    Parameters
+    ----------
+    meshtals : list of strings
+        File paths to meshtal files.
+
+    Returns
+    -------
+    tallies : generator of MeshtalTally objects
+        The merged tallies, in file order.  Their results are normalized
+        by the total number of histories of all the meshtals.
+    """
+    indices = [load_index(meshtal) for meshtal in meshtals]
+    histories = [read_histories(meshtal) for meshtal in meshtals]
+    total_histories = sum(histories)
+
+    numbers = [entry['number'] for entry in indices[0]]
+    for meshtal, index in zip(meshtals[1:], indices[1:]):
+        if [entry['number'] for entry in index] != numbers:
+            raise MeshtalError('Meshtal {0} has tallies {1}, but {2} has ' \
+                    'tallies {3}'.format(meshtal,
+                    [entry['number'] for entry in index], meshtals[0],
+                    numbers))
+
+    for t in xrange(len(numbers)):
+        merged = None
+        for meshtal, index, n in zip(meshtals, indices, histories):
+            tally = read_indexed_tally(meshtal, index[t])
+            if merged is None:
+                merged = tally
+                sum1, sum2 = history_sums(tally, n)
+                continue
+            for attr in ('particle', 'x_bounds', 'y_bounds', 'z_bounds',
+                         'e_bounds'):
+                if getattr(tally, attr) != getattr(merged, attr):
+                    raise MeshtalError('Tally {0} of {1} differs from that ' \
+                            'of {2} in {3}'.format(tally.number, meshtal,
+                            meshtals[0], attr))
+            tally_sum1, tally_sum2 = history_sums(tally, n)
+            sum1 += tally_sum1
+            sum2 += tally_sum2
+            del tally, tally_sum1, tally_sum2
+
+        merged.data[:, :, 0], merged.data[:, :, 1] = \
+                sums_to_results(sum1, sum2, total_histories)
+        del sum1, sum2
+        yield merged
+
+
+################################################################################
+def _centers(bounds):
+    """Return the midpoints between consecutive bounds"""
+    return [(a + b) / 2.0 for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def write_tally_data(f, tally):
+    """Write the data lines of a tally in MCNP's meshtal format
+
+    Parameters
+    ----------
+    f : file object
+        Open file to write to.
+    tally : MeshtalTally object
+        Tally whose results have been read.
+    """
+    coords = ['{0:10.3f}{1:10.3f}{2:10.3f}'.format(x, y, z)
+              for x, y, z in itertools.product(_centers(tally.x_bounds),
+                  _centers(tally.y_bounds), _centers(tally.z_bounds))]
+
+    for n, group in enumerate(group_names(tally.e_bins)):
+        if tally.columns == 5: # single energy bin; no energy column
+            energy = ' '
+        elif group == 'total':
+            energy = '   Total   '
+        else:
+            energy = '{0:11.3E}'.format(tally.e_bounds[group])
+        f.writelines('{0}{1} {2:11.5E} {3:11.5E}\n'.format(energy, c, x, r)
+                     for c, (x, r) in itertools.izip(coords, tally.data[n]))
+
+
+def write_meshtal(filename, template, tallies, histories):
+    """Write tallies to a meshtal file, with the header text of another
+
+    The text before the first tally, and each tally's header, are copied
+    from the template meshtal, except that the number of histories is
+    replaced.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the meshtal file to write.
+    template : string
+        Path of a meshtal file with the same tallies.
+    tallies : iterable of MeshtalTally objects
+        Tallies to write, in the order of the template's tallies.
+    histories : float
+        Number of histories the tallies are normalized by.
+    """
+    index = load_index(template)
+    with open_file(template) as ft:
+        preamble = ft.read(index[0]['header'])
+
+        with open(filename, 'w') as f:
+            for line in preamble.splitlines(True):
+                if line.find('Number of histories') != -1:
+                    line = ' Number of histories used for normalizing ' \
+                           'tallies = {0:16.2f}\n'.format(histories)
+                f.write(line)
+
+            for n, (entry, tally) in enumerate(itertools.izip(index, tallies)):
+                if n > 0:
+                    f.write('\n')
+                ft.seek(entry['header'])
+                f.write(ft.read(entry['data'] - entry['header']))
+                write_tally_data(f, tally)
+
+
+################################################################################
+def main( arguments = None ):
+
+    #Instatiate options parser
+    parser = OptionParser\
+             (usage='%prog <meshtal> <meshtal> [<meshtal> ...] [options]')
+
+    parser.add_option('-o', dest='output', default='merged.meshtal',\
+        help='Name of the merged meshtal output file, or with -m the\
+              structured mesh output file, default=%default')
+
+    parser.add_option('-m', action='store_true', dest='mesh', default=False,\
+        help='Write each merged tally to a structured mesh file instead of\
+              writing a meshtal. With several tallies, the tally number is\
+              added to each file name (e.g. merged_tally14.h5m)')
+
+    (opts, args) = parser.parse_args( arguments )
+
+    if len(args) < 2:
+        parser.error\
+        ( '\nNeed at least 2 arguments: <meshtal> <meshtal>' )
+
+    histories = sum(read_histories(meshtal) for meshtal in args)
+    tallies = iter_merged_tallies(args)
+
+    if not opts.mesh:
+        write_meshtal(opts.output, args[0], tallies, histories)
+        print "Merged {0} meshtals ({1} histories) into {2}".format(
+                len(args), histories, opts.output)
+        return
+
+    # Writing structured meshes needs MOAB, which merging meshtals does not
+    from r2s.data_transfer.read_meshtal import tally_to_scdmesh
+
+    numbers = [entry['number'] for entry in load_index(args[0])]
+    root, ext = os.path.splitext(opts.output)
+    for tally in tallies:
+        if len(numbers) == 1:
+            output = opts.output
+        else:
+            output = '{0}_tally{1}{2}'.format(root, tally.number, ext or '.h5m')
+        sm = tally_to_scdmesh(tally)
+        sm.scdset.save(output)
+        print "Saved merged tally {0} as {1}".format(tally.number, output)
+
+
+if __name__ == '__main__':
+    # No arguments case -> print help output
+    if len(sys.argv) == 1:
+        sys.argv.append('-h')
+
+    main()
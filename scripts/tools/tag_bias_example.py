@@ -2,6 +2,7 @@
 
 import sys
 import os.path
+import numpy as np
 from itaps import iBase, iMesh
 import ConfigParser
 
@@ -17,7 +18,7 @@ from r2s_setup import FileMissingError
 def calc_centers_list(scd):
     """Create list of voxel centroids for a structured cartesian mesh
     
-    Method creates a 1D list of voxel centroids in form [x,y,z]
+    Method creates a 1D array of voxel centroids in form [x,y,z]
     
     Parameters
     ----------
@@ -25,8 +26,8 @@ def calc_centers_list(scd):
 
     Returns
     -------
-    centers : list
-        a 1D list of voxel volumes in order 'xyz'
+    centers : array of shape (voxels, 3)
+        the voxel centroids in order 'xyz'
 
     Notes
     -----
@@ -36,37 +37,12 @@ def calc_centers_list(scd):
     - for x iterate y
     - iterate x
     """
-    
-    meshplanes = [ scd.getDivisions('x'),
-                   scd.getDivisions('y'),
-                   scd.getDivisions('z') ]
-
-    oldz = meshplanes[2][0]
-    oldy = meshplanes[1][0]
-    oldx = meshplanes[0][0]
-
-    nxdiv = len(meshplanes[0]) - 1
-    nydiv = len(meshplanes[1]) - 1
-    nzdiv = len(meshplanes[2]) - 1
-
-    # create 1D list
-    centers = [[0,0,0]] * (nxdiv * nydiv * nzdiv)
-
-    for cntx, x in enumerate(meshplanes[0][1:]):
-        oldy = meshplanes[1][0]
-        for cnty, y in enumerate(meshplanes[1][1:]):
-            oldz = meshplanes[2][0]
-            for cntz, z in enumerate(meshplanes[2][1:]):
-                # Calc volume here
-                centers[nydiv*nzdiv*cntx + nzdiv*cnty + cntz] = \
-                        [oldx+(x - oldx)/2, \
-                         oldy+(y - oldy)/2, \
-                         oldz+(z - oldz)/2]
-                oldz = z
-            oldy = y
-        oldx = x
-    
-    return centers
+    cx, cy, cz = [scd.getCenters(dim) for dim in 'xyz']
+    centers = np.empty((len(cx), len(cy), len(cz), 3))
+    centers[..., 0] = cx[:, np.newaxis, np.newaxis]
+    centers[..., 1] = cy[np.newaxis, :, np.newaxis]
+    centers[..., 2] = cz[np.newaxis, np.newaxis, :]
+    return centers.reshape(-1, 3)
 
 #####################################################################
 
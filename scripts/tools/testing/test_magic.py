@@ -100,6 +100,33 @@ def test_magic_it_1_1_group():
                 written = written_sm.imesh.getTagHandle('ww_n_group_001')[written_voxel]
                 assert_equal(written, expected)
 
+def test_magic_it_1_1_group_slabs():
+    thisdir = os.path.dirname(__file__)
+    flux_sm_filename = os.path.join(thisdir, 'files_test_magic/iteration_1_flux_1_group.h5m')
+    flux_sm = ScdMesh.fromFile(flux_sm_filename)
+    ww_sm_filename = os.path.join(thisdir, 'files_test_magic/iteration_0_magic_1_group.h5m')
+    ww_sm = ScdMesh.fromFile(ww_sm_filename)
+    expected_sm_filename = os.path.join(thisdir, 'files_test_magic/iteration_1_magic_1_group.h5m')   
+    expected_sm = ScdMesh.fromFile(expected_sm_filename)    
+
+    totals_bool = False
+    null_value = 0
+    tolerance = 0.1
+
+    # apply magic one x plane of voxels at a time
+    written_sm = magic.magic(flux_sm, totals_bool, null_value, tolerance, ww_sm,
+                             slab_width=1)
+    
+    #verify weight window lower bounds are the same
+    for x in range(0,3):
+        for y in range(0,3):
+            for z in range(0,3):
+                expected_voxel = expected_sm.getHex(x,y,z)
+                expected = expected_sm.imesh.getTagHandle('ww_n_group_001')[expected_voxel]
+                written_voxel = written_sm.getHex(x,y,z)
+                written = written_sm.imesh.getTagHandle('ww_n_group_001')[written_voxel]
+                assert_equal(written, expected)
+
 # Run as script
 #
 if __name__ == "__main__":
@@ -107,3 +134,4 @@ if __name__ == "__main__":
     test_magic_it_0_total_group()
     test_magic_it_0_1_group()
     test_magic_it_1_1_group()
+    test_magic_it_1_1_group_slabs()
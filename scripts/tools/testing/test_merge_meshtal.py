@@ -0,0 +1,92 @@
+from tools import merge_meshtal
+from r2s.data_transfer import meshtal
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+thisdir = os.path.dirname(__file__)
+meshtal_orig = os.path.join(thisdir, 'files_test_magic/iteration_0.meshtal')
+
+
+class TestMergeMeshtal(unittest.TestCase):
+
+    def setUp(self):
+        # Reading a meshtal writes an index file next to it
+        self.tmpdir = tempfile.mkdtemp()
+        self.meshtal = os.path.join(self.tmpdir, 'run1.meshtal')
+        shutil.copy(meshtal_orig, self.meshtal)
+        # A second run of 3000 histories, with the same results
+        self.meshtal3000 = os.path.join(self.tmpdir, 'run2.meshtal')
+        with open(meshtal_orig, 'r') as fr:
+            with open(self.meshtal3000, 'w') as fw:
+                fw.write(fr.read().replace('         1000.00', '         3000.00'))
+        self.tallies = list(meshtal.iter_tallies(self.meshtal))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_histories(self):
+        self.assertEqual(meshtal.read_histories(self.meshtal), 1000.0)
+        self.assertEqual(meshtal.read_histories(self.meshtal3000), 3000.0)
+
+    def test_merge(self):
+        merged = list(merge_meshtal.iter_merged_tallies(
+                      [self.meshtal, self.meshtal3000]))
+        self.assertEqual([t.number for t in merged], ['4', '14'])
+        for tally, m in zip(self.tallies, merged):
+            x, r = tally.fluxes, tally.errors
+            # Identical means merge to the same mean
+            self.assertTrue(np.allclose(m.fluxes, x))
+            # Pooled variance of 1000 + 3000 histories with equal means
+            var = (1000 * 999 + 3000 * 2999) * (r * x)**2 / 4000.0 / 3999.0
+            nonzero = x != 0
+            self.assertTrue(np.allclose(m.errors[nonzero],
+                                        np.sqrt(var[nonzero]) / x[nonzero]))
+            self.assertTrue((m.errors[nonzero] < r[nonzero]).all())
+            self.assertTrue((m.errors[~nonzero] == 0).all())
+
+    def test_stats(self):
+        # Single runs of one history each scoring 1 and 3
+        class Tally(object):
+            pass
+        a, b = Tally(), Tally()
+        a.fluxes, a.errors = np.array([[1.0]]), np.array([[0.0]])
+        b.fluxes, b.errors = np.array([[3.0]]), np.array([[0.0]])
+        sum1, sum2 = merge_meshtal.history_sums(a, 1)
+        b1, b2 = merge_meshtal.history_sums(b, 1)
+        results, errors = merge_meshtal.sums_to_results(sum1 + b1, sum2 + b2, 2)
+        self.assertEqual(results[0, 0], 2.0)
+        # sample variance 2, variance of the mean 1, relative error 1/2
+        self.assertAlmostEqual(errors[0, 0], 0.5)
+
+    def test_write_meshtal(self):
+        output = os.path.join(self.tmpdir, 'merged.meshtal')
+        merge_meshtal.main([self.meshtal, self.meshtal, '-o', output])
+        self.assertEqual(meshtal.read_histories(output), 2000.0)
+        written = list(meshtal.iter_tallies(output))
+        for tally, w in zip(self.tallies, written):
+            self.assertEqual(w.number, tally.number)
+            self.assertEqual(w.x_bounds, tally.x_bounds)
+            self.assertEqual(w.e_bounds, tally.e_bounds)
+            self.assertTrue(np.allclose(w.fluxes, tally.fluxes, rtol=1e-5))
+            self.assertTrue(np.allclose(w.errors,
+                            tally.errors * np.sqrt(999 / 1999.0), rtol=1e-5))
+        # Lines are written as MCNP writes them
+        with open(output) as f:
+            lines = f.readlines()
+        with open(self.meshtal) as f:
+            orig = f.readlines()
+        self.assertEqual(len(lines), len(orig))
+        self.assertEqual(lines[13][:42], orig[13][:42])
+        self.assertEqual(lines[-1][:31], orig[-1][:31])
+        self.assertEqual(len(lines[-1]), len(orig[-1]))
+
+    def test_mismatch(self):
+        other = os.path.join(self.tmpdir, 'other.meshtal')
+        with open(meshtal_orig, 'r') as fr:
+            with open(other, 'w') as fw:
+                fw.write(fr.read().replace('Number        14', 'Number        15'))
+        self.assertRaises(meshtal.MeshtalError, list,
+                merge_meshtal.iter_merged_tallies([self.meshtal, other]))
@@ -3,13 +3,13 @@
 
 # python imports
 from optparse import OptionParser
-import linecache
 import sys
 # MOAB imports
 from itaps import iMesh
 from itaps import iBase
 # r2s imports
 from r2s.scdmesh import ScdMesh, ScdMeshError
+from r2s.fileio import open_file
 
 def cartesian(wwinp):
     """This function reads in a Cartesian WWINP file and returns a structured
@@ -17,51 +17,48 @@ def cartesian(wwinp):
     Parameters
     ----------
     wwinp : file name
-        The weight window input file to create a mesh from.
+        The weight window input file to create a mesh from.  It may be gzip,
+        bzip2 or xz compressed.
     """
 
     print "Parsing Cartesian WWINP"
 
-    particle_identifier = linecache.getline(wwinp, 1).split()[2]
-    if particle_identifier == '1':
-        particle = 'n'
-    elif particle_identifier =='2':
-        particle = 'p'
-
-
-    # collect easy to parse energy group and mesh sized info
-    num_e_bins = int(linecache.getline(wwinp, 2).split()[-1])
-    # total number of fine mesh points
-    nfx, nfy, nfz = \
-        [int(float(x)) for x in linecache.getline(wwinp, 3).split()[0:3]]
-    x0, y0, z0 = [float(x) for x in linecache.getline(wwinp, 3).split()[3:6]]
-    # number of course points
-    ncx, ncy, ncz = \
-        [int(float(x)) for x in linecache.getline(wwinp, 4).split()[0:3]]
-
-    # get the x, y, and z bounds
-    x_bounds, x_last_line = block_2_bounds(wwinp, 5, ncx)
-    y_bounds, y_last_line = block_2_bounds(wwinp, x_last_line + 1, ncy)
-    z_bounds, z_last_line = block_2_bounds(wwinp, y_last_line + 1, ncz)
-
-    # create structured mesh these bounds
-    sm = ScdMesh(x_bounds, y_bounds, z_bounds)
-    
-    # Find the first line of WW values by counting through the e_bin values
-    # until the expected number of e_bins is reached
-    # Then create a root level tag with energy the energy bounds.
-    e_upper_bounds = []
-    line_num = z_last_line + 1
-
-    while len(e_upper_bounds) < num_e_bins:
-        e_upper_bounds += \
-            [float(x) for x in linecache.getline(wwinp, line_num).split()]
-        line_num += 1
-    
-    ww_first_line = line_num
-
-    # tag structured mesh with WW values
-    tag_mesh(sm, wwinp, ww_first_line, num_e_bins, nfx*nfy*nfz, particle)
+    # The file is read once, from start to end
+    with open_file(wwinp) as f:
+        lines = iter(f)
+
+        particle_identifier = next(lines).split()[2]
+        if particle_identifier == '1':
+            particle = 'n'
+        elif particle_identifier =='2':
+            particle = 'p'
+
+        # collect easy to parse energy group and mesh sized info
+        num_e_bins = int(next(lines).split()[-1])
+        # total number of fine mesh points
+        line = next(lines)
+        nfx, nfy, nfz = [int(float(x)) for x in line.split()[0:3]]
+        x0, y0, z0 = [float(x) for x in line.split()[3:6]]
+        # number of course points
+        ncx, ncy, ncz = [int(float(x)) for x in next(lines).split()[0:3]]
+
+        # get the x, y, and z bounds
+        x_bounds = block_2_bounds(lines, ncx)
+        y_bounds = block_2_bounds(lines, ncy)
+        z_bounds = block_2_bounds(lines, ncz)
+
+        # create structured mesh these bounds
+        sm = ScdMesh(x_bounds, y_bounds, z_bounds)
+
+        # Read the e_bin values until the expected number of e_bins is
+        # reached; the WW values start on the following line.
+        # Then create a root level tag with energy the energy bounds.
+        e_upper_bounds = []
+        while len(e_upper_bounds) < num_e_bins:
+            e_upper_bounds += [float(x) for x in next(lines).split()]
+
+        # tag structured mesh with WW values
+        tag_mesh(sm, lines, num_e_bins, nfx*nfy*nfz, particle)
 
     # tag root level of sm with energy bounds
     tag_e_bin = sm.imesh.createTag("E_upper_bounds", len(e_upper_bounds), float)
@@ -70,10 +67,10 @@ def cartesian(wwinp):
     return sm
 
 
-def block_2_bounds(wwinp, line_num, nc):
+def block_2_bounds(lines, nc):
     """
-       This function reads wwinp starting at a given line, and returns bounds
-       for the spacial varible beginging on that line. First it pulls out
+       This function reads wwinp lines from an iterator, and returns bounds
+       for the spacial varible beginging on the next line. First it pulls out
        vectors from Block 2 data (Appendix J) in the form:
 
        x0 nfmx(1) x(1) ry(1) nfmx(2) x(2) ry(2) ... nfmx(ncx) x(ncx) rx(ncx)
@@ -83,10 +80,10 @@ def block_2_bounds(wwinp, line_num, nc):
        a vector.
     Parameters
     ----------
-    wwinp : string
-        The weight window input file name to create a mesh from.
-    line_num : int
-        The first line with block 2 values
+    lines : iterator over strings
+        Lines of the weight window input file, positioned so that the next
+        line is the first with block 2 values.  It is advanced past the
+        last line with block 2 values.
     nc : int
         The number of course mesh points. 
     """
@@ -94,11 +91,7 @@ def block_2_bounds(wwinp, line_num, nc):
     # parse raw values from wwinp
     raw = []
     while len(raw) < 3*nc + 1:
-        raw += \
-            [float(x) for x in linecache.getline(wwinp, line_num).split()]
-        line_num += 1
-
-    last_line = line_num - 1 # for loop goes the last line by one
+        raw += [float(x) for x in next(lines).split()]
 
     # remove all the rx(i)/ry(i)/rz(i) values that contaminated the raw list
     removed_values = [raw[0]]
@@ -116,9 +109,9 @@ def block_2_bounds(wwinp, line_num, nc):
                 bounds.append((removed_values[i+1] - removed_values[i-1])*j\
                     /removed_values[i] + removed_values[i-1])
 
-    return bounds, last_line
+    return bounds
 
-def tag_mesh(sm, wwinp, ww_first_line, num_e_bins, nf, particle):
+def tag_mesh(sm, lines, num_e_bins, nf, particle):
     """This function reads in a structured and tags it with ww values from 
        wwinp.
 
@@ -126,10 +119,9 @@ def tag_mesh(sm, wwinp, ww_first_line, num_e_bins, nf, particle):
     ----------
     sm : ScdMesh
          The structured mesh with proper dimensions
-    wwinp : file name
-        The wwinp file
-    ww_first_line : int
-        The first line of weight window lower bound values in the wwinp file.
+    lines : iterator over strings
+        Lines of the wwinp file, positioned so that the next line is the
+        first line of weight window lower bound values.
     num_e_bins : int
         The number of energy groups
     nf : int
@@ -141,7 +133,6 @@ def tag_mesh(sm, wwinp, ww_first_line, num_e_bins, nf, particle):
     voxels=list(sm.iterateHex('zyx'))   
 
     # iterate over energy groups
-    line_num = ww_first_line
     for i in range(1, num_e_bins +1):
         # Create tags for e_group
         tag_name = 'ww_{0}_group_{1:03d}'.format(particle, i) # good sorting for up to 999 groups
@@ -150,9 +141,7 @@ def tag_mesh(sm, wwinp, ww_first_line, num_e_bins, nf, particle):
         # Get all data for energy group i
         ww_data = []
         while len(ww_data) < nf:
-            ww_data += \
-                [float(x) for x in linecache.getline(wwinp, line_num).split()]
-            line_num += 1
+            ww_data += [float(x) for x in next(lines).split()]
         
         tag_ww[voxels] = ww_data # tag data to voxels
 
@@ -190,7 +179,8 @@ def main(arguments=None):
 
     # determine nr from MCNP5 manual Table J.2
     # nr = 10 is Cartesian and nr = 16 is cylindrical
-    nr = linecache.getline(args[0],1).split()[3]
+    with open_file(args[0]) as f:
+        nr = f.readline().split()[3]
     if int(nr) == 10:
         ww_mesh = cartesian(args[0])
         ww_mesh.scdset.save(opts.output) 